@@ -85,6 +85,10 @@ def create_app(script_info=None):
         except Exception as e:
             app.logger.error(e)
 
+    # Start thumbnail job queue, and resume unfinished jobs
+    from cloudalbum.util.thumbnail_queue import thumbnail_queue
+    thumbnail_queue.init_app(app)
+
     @jwt.token_in_blacklist_loader
     def check_if_token_in_blacklist_set(decrypted_token):
         from cloudalbum.util.jwt_helper import is_blacklisted_token_set
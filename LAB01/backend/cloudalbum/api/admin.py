@@ -5,6 +5,7 @@ from flask import current_app as app
 from flask_restplus import Api, Resource
 from werkzeug.exceptions import InternalServerError
 from cloudalbum import db
+from cloudalbum.util.file_control import photo_list_cache
 import shutil
 
 admin_blueprint = Blueprint('admin', __name__)
@@ -40,5 +41,14 @@ class HealthCheck(Resource):
             raise InternalServerError('Healthcheck failed: {0}: {1}'.format(get_ip_addr(), e))
 
 
+@api.route('/photo_list_cache')
+class PhotoListCacheStats(Resource):
+    @api.doc(responses={200: 'counters of the photo list cache'})
+    def get(self):
+        """Counters of the photo list cache of this process, hit ratio and bytes in memory"""
+        cache = photo_list_cache()
+        return make_response({'ok': True, 'enabled': cache is not None, 'stats': cache.stats() if cache else {}}, 200)
+
+
 def get_ip_addr():
     return '{0}'.format(socket.gethostname())
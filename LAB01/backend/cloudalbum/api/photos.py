@@ -7,9 +7,11 @@
     :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
     :license: MIT, see LICENSE for more details.
 """
-import os, uuid
+import os, uuid, hashlib, json
+from functools import partial
+from itertools import chain
 from flask import current_app as app, make_response
-from flask import Blueprint, request
+from flask import Blueprint, request, Response, stream_with_context
 from flask_restplus import Api, Resource, fields
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime
@@ -18,10 +20,20 @@ from werkzeug.utils import secure_filename
 from pathlib import Path
 from jsonschema.exceptions import ValidationError
 from cloudalbum import db
-from cloudalbum.database.models import Photo
+from cloudalbum.database.models import Photo, PROCESSING_PENDING, PROCESSING_DONE, PHOTO_LIST_COLUMNS, \
+    PHOTO_LIST_ORDERS, query_photos, next_page_cursor, photos_to_json, decode_cursor
 from cloudalbum.schemas import validate_photo_info
-from cloudalbum.util.file_control import email_normalize, delete, save, insert_basic_info
-from werkzeug.exceptions import BadRequest, InternalServerError
+from cloudalbum.util.file_control import email_normalize, delete, save, insert_basic_info, find_same_content, \
+    is_shared, make_photo, map_batch, sized_rendition, get_photo_list_version, bump_photo_list_version, \
+    photo_list_cache
+from cloudalbum.util.exif import apply_image_info
+from cloudalbum.util.json_stream import batched, iter_json_object
+from cloudalbum.util.rendition import FITS
+from cloudalbum.util.serializer import dumps
+from cloudalbum.util.upload_session import create_session, write_chunk, list_chunks, open_chunks, delete_session, \
+    open_session, max_chunks, received_size, check_chunks
+from cloudalbum.util.thumbnail_queue import thumbnail_queue
+from werkzeug.exceptions import BadRequest, NotFound, InternalServerError
 
 
 authorizations = {
@@ -60,8 +72,21 @@ photo_info = api.model('New_photo', {
     'address': fields.String
 })
 
+# 'list' returns PHOTO_LIST_COLUMNS of the photos, 'full' every column.
+PHOTO_LIST_VIEWS = ['list', 'full']
+
+photo_list_parser = api.parser()
+photo_list_parser.add_argument('limit', type=int, location='args', default=0)
+photo_list_parser.add_argument('cursor', type=str, location='args')
+photo_list_parser.add_argument('view', type=str, location='args', choices=PHOTO_LIST_VIEWS, default='list')
+photo_list_parser.add_argument('order', type=str, location='args', choices=PHOTO_LIST_ORDERS,
+                               default=PHOTO_LIST_ORDERS[0])
+
 photo_get_parser = api.parser()
 photo_get_parser.add_argument('mode', type=str, location='args')
+photo_get_parser.add_argument('w', type=int, location='args', default=0)
+photo_get_parser.add_argument('h', type=int, location='args', default=0)
+photo_get_parser.add_argument('fit', type=str, location='args', choices=FITS, default='contain')
 
 file_upload_parser = api.parser()
 file_upload_parser.add_argument('file', location='files', type=FileStorage, required=True)
@@ -78,6 +103,158 @@ file_upload_parser.add_argument('city', type=str, location='form')
 file_upload_parser.add_argument('nation', type=str, location='form')
 file_upload_parser.add_argument('address', type=str, location='form')
 
+upload_session_parser = api.parser()
+upload_session_parser.add_argument('filename_orig', type=str, location='form', required=True)
+
+upload_finish_parser = file_upload_parser.copy()
+upload_finish_parser.remove_argument('file')
+
+files_upload_parser = file_upload_parser.copy()
+files_upload_parser.remove_argument('file')
+files_upload_parser.add_argument('files', location='files', type=FileStorage, action='append', required=True)
+
+digest_parser = file_upload_parser.copy()
+digest_parser.remove_argument('file')
+digest_parser.add_argument('digest', type=str, location='form', required=True)
+digest_parser.add_argument('filename_orig', type=str, location='form', required=True)
+
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'bmp', 'gif', 'png']
+
+
+def image_extension(filename_orig):
+    """
+    Return extension of the image file name, BadRequest is raised when the format is not supported.
+    :param filename_orig: file name on the client
+    :return: lower case extension
+    """
+    extension = filename_orig.rsplit('.', 1)[-1].lower()
+    if '.' not in filename_orig or extension not in IMAGE_EXTENSIONS:
+        app.logger.error('File format is not supported:{0}'.format(filename_orig))
+        raise BadRequest('File format is not supported:{0}'.format(filename_orig))
+    return extension
+
+
+def add_photo(current_user, filename, filename_orig, filesize, form, digest, same=None):
+    """
+    Insert the photo, and submit its thumbnail job unless it shares files of the same content already made.
+    :param current_user: JWT identity
+    :param same: Photo of the same content, see find_same_content()
+    :return: committed Photo
+    """
+    shared_done = same is not None and same.processing_state == PROCESSING_DONE
+    committed = insert_basic_info(current_user['user_id'], filename, filename_orig, filesize, form, digest,
+                                  PROCESSING_DONE if shared_done else PROCESSING_PENDING)
+    if not shared_done:
+        thumbnail_queue.submit(committed.id, current_user['email'])
+    return committed
+
+
+def save_photo(current_user, upload_file, filename_orig, extension, form):
+    """
+    Save the original and insert the photo, which shares the stored files when the same content is already stored.
+    :param current_user: JWT identity
+    :param upload_file: FileStorage of the original
+    :param filename_orig: file name on the client
+    :param extension: lower case extension, see image_extension()
+    :param form: parsed upload form, photo information of the image is filled in
+    :return: (committed Photo, Boolean which is True when the same content is already stored)
+    """
+    filename = secure_filename("{0}.{1}".format(uuid.uuid4(), extension))
+    filesize, digest, image_info = save(upload_file, filename, current_user['email'])
+    # Photo information of the image itself, the client does not need to parse EXIF.
+    apply_image_info(form, image_info)
+    same = find_same_content(current_user['user_id'], digest)
+    if same is not None:
+        # The same content is already stored, drop this copy and share the stored files.
+        delete(filename, current_user['email'])
+        filename = same.filename
+    return add_photo(current_user, filename, filename_orig, filesize, form, digest, same), same is not None
+
+
+def page_args(args):
+    """
+    Return limit and cursor of a photo list request.
+    :param args: parsed photo_list_parser
+    :return: (limit, None for the whole list, cursor)
+    :raise BadRequest: when the limit is out of range or the cursor is broken
+    """
+    limit = args['limit'] or app.config['PHOTO_LIST_DEFAULT_LIMIT']
+    if limit < 0 or limit > app.config['PHOTO_LIST_MAX_LIMIT']:
+        raise BadRequest('Invalid limit:{0}'.format(limit))
+    try:
+        if args['cursor']:
+            decode_cursor(args['cursor'], args['order'])
+    except ValueError:
+        raise BadRequest('Invalid cursor:{0}'.format(args['cursor']))
+    return limit or None, args['cursor']
+
+
+def photo_list_etag(user_id, version, limit=None, cursor=None, view='list', order=PHOTO_LIST_ORDERS[0]):
+    """
+    Return ETag of a photo list response, made of the list version of the user and the request.
+    :param user_id: user id
+    :param version: list version of the user, see get_photo_list_version()
+    :param limit: limit of page_args()
+    :param cursor: cursor of page_args()
+    :param view: one of PHOTO_LIST_VIEWS
+    :param order: one of PHOTO_LIST_ORDERS
+    :return: string, None when PHOTO_LIST_ETAG is off
+    """
+    if not app.config['PHOTO_LIST_ETAG']:
+        return None
+    request_key = json.dumps([user_id, limit, cursor, view, order])
+    return '{0}-{1}'.format(version, hashlib.sha1(request_key.encode('utf-8')).hexdigest()[:16])
+
+
+def with_etag(response, etag):
+    """
+    Set the ETag on the response, the browser revalidates it on every request.
+    :param response: Response
+    :param etag: string, the response is left as it is when it is None
+    :return: response
+    """
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def stream_photo_list(results, complete=None, max_bytes=0):
+    """
+    Return response of the photo list written batch by batch of PHOTO_LIST_STREAM_BATCH photos, while
+    the rows are fetched. An error after the first batch cuts the response short, it never looks complete.
+    :param results: iterator of query_photos()
+    :param complete: function called with the whole body once it is sent, e.g. to cache it
+    :param max_bytes: the body is given to complete() only up to this size
+    :return: streaming Response
+    """
+    batches = (photos_to_json(results, batch) for batch in batched(results, app.config['PHOTO_LIST_STREAM_BATCH']))
+    # The first batch is read here, so an error of the query is still answered with the status code.
+    first = next(batches, [])
+
+    def generate():
+        pieces = [] if complete is not None else None
+        sent = 0
+        try:
+            for piece in iter_json_object({'ok': True}, 'photos', chain([first], batches),
+                                          lambda: {'next_cursor': next_page_cursor(results)},
+                                          partial(dumps, fast=app.config['PHOTO_LIST_ORJSON'])):
+                piece = piece.encode('utf-8')
+                sent += len(piece)
+                if pieces is not None and sent > max_bytes:
+                    pieces = None
+                if pieces is not None:
+                    pieces.append(piece)
+                yield piece
+        except Exception as e:
+            app.logger.error('Photos list streaming failed')
+            app.logger.error(e)
+            raise
+        if pieces is not None:
+            complete(b''.join(pieces))
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
 
 @api.route('/ping')
 @api.doc('photos ping!')
@@ -99,18 +276,232 @@ class FileUpload(Resource):
         extension = (filename_orig.rsplit('.', 1)[1]).lower()
         current_user = get_jwt_identity()
 
-        if extension.lower() not in ['jpg', 'jpeg', 'bmp', 'gif', 'png']:
+        if extension.lower() not in IMAGE_EXTENSIONS:
             app.logger.error('File format is not supported:{0}'.format(filename_orig))
             raise BadRequest('File format is not supported:{0}'.format(filename_orig))
 
         try:
-            filename = secure_filename("{0}.{1}".format(uuid.uuid4(), extension))
-            filesize = save(form['file'], filename, current_user['email'])
-            insert_basic_info(current_user['user_id'], filename, filename_orig, filesize, form)
-            committed = Photo.query.filter_by(user_id=current_user['user_id'],
-                                              filename=filename,
-                                              filename_orig=filename_orig).first()
-            return make_response({'ok': True, 'photo_id': committed.id}, 200)
+            committed, duplicate = save_photo(current_user, form['file'], filename_orig, extension, form)
+            return make_response({'ok': True, 'photo_id': committed.id,
+                                  'processing_state': committed.processing_state,
+                                  'duplicate': duplicate, 'photos': committed.to_json()}, 200)
+        except Exception as e:
+            app.logger.error('File upload failed:user_id:{0}: {1}'.format(current_user['user_id'], e))
+            raise InternalServerError('File upload failed: {0}'.format(e))
+
+
+@api.route('/files')
+@api.expect(files_upload_parser)
+class FilesUpload(Resource):
+    @api.doc(responses={200: 'result of each file, in the order of the files',
+                        400: 'too many files',
+                        500: 'internal server error'})
+    @jwt_required
+    def post(self):
+        """Upload several photos at once, the form fields apply to each of them"""
+        form = files_upload_parser.parse_args()
+        upload_files = form.pop('files')
+        current_user = get_jwt_identity()
+        if len(upload_files) > app.config['UPLOAD_BATCH_MAX_FILES']:
+            raise BadRequest('Too many files:{0}, max:{1}'.format(len(upload_files),
+                                                                  app.config['UPLOAD_BATCH_MAX_FILES']))
+
+        def save_one(upload_file):
+            filename = secure_filename("{0}.{1}".format(uuid.uuid4(), image_extension(upload_file.filename)))
+            filesize, digest, image_info = save(upload_file, filename, current_user['email'])
+            return filename, filesize, digest, apply_image_info(dict(form), image_info)
+
+        # Files are saved in parallel, and the photos are inserted in one transaction.
+        results = map_batch(save_one, upload_files)
+        saved = {}
+        photos = []
+        try:
+            for upload_file, (result, error) in zip(upload_files, results):
+                if error is not None:
+                    continue
+                filename, filesize, digest, file_form = result
+                same = saved.get(digest) or find_same_content(current_user['user_id'], digest)
+                if same is not None:
+                    delete(filename, current_user['email'])
+                    filename = same.filename
+                shared_done = same is not None and same.processing_state == PROCESSING_DONE
+                photo = make_photo(current_user['user_id'], filename, upload_file.filename, filesize, file_form,
+                                   digest, PROCESSING_DONE if shared_done else PROCESSING_PENDING)
+                saved.setdefault(digest, photo)
+                photos.append(photo)
+            db.session.add_all(photos)
+            if photos:
+                bump_photo_list_version(current_user['user_id'])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error('Batch upload failed:user_id:{0}: {1}'.format(current_user['user_id'], e))
+            for result, error in results:
+                if error is None and not is_shared(current_user['user_id'], result[0]):
+                    delete(result[0], current_user['email'])
+            raise InternalServerError('Batch upload failed: {0}'.format(e))
+
+        files = []
+        photos = iter(photos)
+        for upload_file, (result, error) in zip(upload_files, results):
+            if error is not None:
+                app.logger.error('File upload failed:user_id:{0}:{1}: {2}'.format(current_user['user_id'],
+                                                                                 upload_file.filename, error))
+                files.append({'ok': False, 'filename_orig': upload_file.filename,
+                              'error': getattr(error, 'description', None) or str(error)})
+                continue
+            photo = next(photos)
+            if photo.processing_state == PROCESSING_PENDING:
+                thumbnail_queue.submit(photo.id, current_user['email'])
+            files.append({'ok': True, 'filename_orig': upload_file.filename, 'photo_id': photo.id,
+                          'processing_state': photo.processing_state, 'duplicate': photo.filename != result[0]})
+        return make_response({'ok': True, 'files': files}, 200)
+
+
+@api.route('/digest')
+@api.expect(digest_parser)
+class DigestCheck(Resource):
+    @api.doc(responses={200: 'exists is true when the photo is saved without file transfer',
+                        500: 'internal server error'})
+    @jwt_required
+    def post(self):
+        """Save a photo by SHA-256 digest of its file, when the same file is already uploaded"""
+        form = digest_parser.parse_args()
+        current_user = get_jwt_identity()
+
+        try:
+            same = find_same_content(current_user['user_id'], form['digest'])
+            if same is None:
+                return make_response({'ok': True, 'exists': False}, 200)
+
+            committed = add_photo(current_user, same.filename, form['filename_orig'], same.filesize, form,
+                                  same.digest, same)
+            return make_response({'ok': True, 'exists': True, 'photo_id': committed.id,
+                                  'processing_state': committed.processing_state}, 200)
+        except Exception as e:
+            app.logger.error('Digest check failed:user_id:{0}: {1}'.format(current_user['user_id'], e))
+            raise InternalServerError('Digest check failed: {0}'.format(e))
+
+
+@api.route('/uploads')
+@api.expect(upload_session_parser)
+class UploadSessions(Resource):
+    @api.doc(responses={200: 'return the upload session',
+                        400: 'file format is not supported',
+                        500: 'internal server error'})
+    @jwt_required
+    def post(self):
+        """Start a resumable upload, PUT its chunks to /uploads/<session_id>/<number> then call .../complete"""
+        form = upload_session_parser.parse_args()
+        current_user = get_jwt_identity()
+        image_extension(form['filename_orig'])
+
+        try:
+            session_id = create_session(current_user['user_id'], form['filename_orig'])
+            chunk_size = app.config['UPLOAD_SESSION_CHUNK_SIZE']
+            return make_response({'ok': True, 'session_id': session_id, 'chunk_size': chunk_size,
+                                  'max_chunks': max_chunks(chunk_size, app.config['UPLOAD_SESSION_MAX_SIZE']),
+                                  'expires_in': app.config['UPLOAD_SESSION_EXPIRE_TIME']}, 200)
+        except Exception as e:
+            app.logger.error('Upload session creation failed:user_id:{0}: {1}'.format(current_user['user_id'], e))
+            raise InternalServerError('Upload session creation failed: {0}'.format(e))
+
+
+@api.route('/uploads/<session_id>')
+class UploadSession(Resource):
+    @api.doc(responses={200: 'return the chunks received, and the offset to resume from',
+                        404: 'upload session not found',
+                        500: 'internal server error'})
+    @jwt_required
+    def get(self, session_id):
+        """Get the chunks which the resumable upload received"""
+        current_user = get_jwt_identity()
+        try:
+            _, session = open_session(current_user['user_id'], session_id)
+            chunks = list_chunks(current_user['user_id'], session_id)
+            return make_response({'ok': True, 'chunk_size': session['chunk_size'],
+                                  'received': received_size(chunks, session['chunk_size']),
+                                  'chunks': [{'number': number, 'size': size} for number, size in chunks]}, 200)
+        except FileNotFoundError:
+            raise NotFound('Upload session not found:{0}'.format(session_id))
+        except Exception as e:
+            app.logger.error('Upload session retrieving failed:user_id:{0}: {1}'.format(current_user['user_id'], e))
+            raise InternalServerError('Upload session retrieving failed: {0}'.format(e))
+
+    @api.doc(responses={200: 'upload session removed',
+                        404: 'upload session not found',
+                        500: 'internal server error'})
+    @jwt_required
+    def delete(self, session_id):
+        """Abort the resumable upload"""
+        current_user = get_jwt_identity()
+        try:
+            open_session(current_user['user_id'], session_id)
+            delete_session(session_id)
+            return make_response({'ok': True}, 200)
+        except FileNotFoundError:
+            raise NotFound('Upload session not found:{0}'.format(session_id))
+        except Exception as e:
+            app.logger.error('Upload session abort failed:user_id:{0}: {1}'.format(current_user['user_id'], e))
+            raise InternalServerError('Upload session abort failed: {0}'.format(e))
+
+
+@api.route('/uploads/<session_id>/<int:number>')
+class UploadChunk(Resource):
+    @api.doc(responses={200: 'chunk received',
+                        400: 'invalid chunk',
+                        404: 'upload session not found',
+                        500: 'internal server error'})
+    @jwt_required
+    def put(self, session_id, number):
+        """Upload a chunk of the resumable upload, the request body is the chunk"""
+        current_user = get_jwt_identity()
+        chunk_size = app.config['UPLOAD_SESSION_CHUNK_SIZE']
+        if not 1 <= number <= max_chunks(chunk_size, app.config['UPLOAD_SESSION_MAX_SIZE']):
+            raise BadRequest('Invalid chunk number:{0}'.format(number))
+
+        try:
+            size = write_chunk(current_user['user_id'], session_id, number, request.stream)
+            return make_response({'ok': True, 'number': number, 'size': size}, 200)
+        except FileNotFoundError:
+            raise NotFound('Upload session not found:{0}'.format(session_id))
+        except ValueError as e:
+            raise BadRequest('Invalid chunk:{0}'.format(e))
+        except Exception as e:
+            app.logger.error('Chunk upload failed:user_id:{0}: {1}'.format(current_user['user_id'], e))
+            raise InternalServerError('Chunk upload failed: {0}'.format(e))
+
+
+@api.route('/uploads/<session_id>/complete')
+@api.expect(upload_finish_parser)
+class UploadSessionComplete(Resource):
+    @api.doc(responses={200: 'photo saved',
+                        400: 'chunks are missing',
+                        404: 'upload session not found',
+                        500: 'internal server error'})
+    @jwt_required
+    def post(self, session_id):
+        """Assemble the chunks of the resumable upload into the photo"""
+        form = upload_finish_parser.parse_args()
+        current_user = get_jwt_identity()
+        try:
+            _, session = open_session(current_user['user_id'], session_id)
+            chunks = list_chunks(current_user['user_id'], session_id)
+            check_chunks(chunks, session['chunk_size'])
+        except FileNotFoundError:
+            raise NotFound('Upload session not found:{0}'.format(session_id))
+        except ValueError as e:
+            raise BadRequest('Upload is not complete:{0}'.format(e))
+
+        try:
+            filename_orig = session['filename_orig']
+            with open_chunks(current_user['user_id'], session_id, chunks) as stream:
+                committed, duplicate = save_photo(current_user, FileStorage(stream=stream, filename=filename_orig),
+                                                  filename_orig, image_extension(filename_orig), form)
+            delete_session(session_id)
+            return make_response({'ok': True, 'photo_id': committed.id,
+                                  'processing_state': committed.processing_state,
+                                  'duplicate': duplicate, 'photos': committed.to_json()}, 200)
         except Exception as e:
             app.logger.error('File upload failed:user_id:{0}: {1}'.format(current_user['user_id'], e))
             raise InternalServerError('File upload failed: {0}'.format(e))
@@ -150,6 +541,7 @@ class InfoUpload(Resource):
             photo.nation = valid_data['nation']
             photo.address = valid_data['address']
             db.session.add(photo)
+            bump_photo_list_version(photo.user_id)
             db.session.commit()
             app.logger.debug('success:photo info update:{}'.format(valid_data))
             return make_response({'ok': True, 'photos': photo.to_json()}, 200)
@@ -168,18 +560,57 @@ class List(Resource):
     @api.doc(
         responses=
         {
-            200: 'Return the whole photos list',
+            200: 'Return the photos list',
+            304: 'Photos list is not changed',
+            400: 'Invalid limit or cursor',
             500: 'Internal server error'
         }
     )
     @jwt_required
+    @api.expect(photo_list_parser)
     def get(self):
-        """Get all photos as list"""
+        """
+        Get photos as list, newest first in the order, a page of them when limit is given.
+        The whole list of the default view and order is answered from the photo list cache when it has the list
+        of the current version.
+        :queryparam limit: max number of photos of the page, up to PHOTO_LIST_MAX_LIMIT
+        :queryparam cursor: next_cursor of the previous page
+        :queryparam view: list(default) or full, see PHOTO_LIST_VIEWS
+        :queryparam order: upload_date(default) or taken_date, see PHOTO_LIST_ORDERS
+        :header If-None-Match: ETag of the list the client has, 304 is returned when the list is not changed
+        :return: photos and next_cursor, which is None on the last page, streamed when PHOTO_LIST_STREAM is on
+        """
+        args = photo_list_parser.parse_args()
+        limit, cursor = page_args(args)
         try:
             current_user = get_jwt_identity()['user_id']
-            photos = [photo.to_json() for photo in Photo.query.filter_by(user_id=current_user)]
+            # Only the whole list of the default view and order is cached, a page is a range of the index.
+            whole = limit is None and cursor is None and args['view'] == PHOTO_LIST_VIEWS[0] \
+                and args['order'] == PHOTO_LIST_ORDERS[0]
+            cache = photo_list_cache() if whole else None
+            # The version is read before the list, so a change during the query is seen by the next request.
+            version = get_photo_list_version(current_user) if cache or app.config['PHOTO_LIST_ETAG'] else None
+            etag = photo_list_etag(current_user, version, limit, cursor, args['view'], args['order'])
+            if etag and request.if_none_match.contains_weak(etag):
+                return with_etag(make_response('', 304), etag)
+            data = cache.get(current_user, version) if cache else None
+            if data is not None:
+                return with_etag(Response(data, mimetype='application/json'), etag)
+
+            # The list view reads its columns only, the full view loads the whole Photo.
+            columns = None if args['view'] == 'full' else PHOTO_LIST_COLUMNS
+            results = query_photos(current_user, args['order'], limit, cursor, columns,
+                                   app.config['PHOTO_LIST_TUPLES'], app.config['PHOTO_LIST_STREAM_BATCH'])
+            if app.config['PHOTO_LIST_STREAM']:
+                complete = partial(cache.put, current_user, version) if cache else None
+                return with_etag(stream_photo_list(results, complete, cache.max_bytes if cache else 0), etag)
+            photos = photos_to_json(results, list(results))
             app.logger.debug('success:photos_list: {0}'.format(photos))
-            return make_response({'ok': True, 'photos': photos}, 200)
+            data = dumps({'ok': True, 'photos': photos, 'next_cursor': next_page_cursor(results)},
+                         app.config['PHOTO_LIST_ORJSON']).encode('utf-8')
+            if cache:
+                cache.put(current_user, version, data)
+            return with_etag(Response(data, mimetype='application/json'), etag)
         except Exception as e:
             app.logger.error('Photos list retrieving failed')
             app.logger.error(e)
@@ -207,9 +638,12 @@ class OnePhoto(Resource):
                 app.logger.error('Not exist photo_id: {}'.format(photo_id))
                 raise BadRequest('Not exist photo_id')
             filename = db_photo.filename
+            user_id = db_photo.user_id
             db.session.delete(db_photo)
+            bump_photo_list_version(user_id)
             db.session.commit()
-            file_deleted = delete(filename, user['email'])
+            # Files of the same content are kept while another photo refers to them.
+            file_deleted = True if is_shared(user_id, filename) else delete(filename, user['email'])
 
             if file_deleted:
                 app.logger.debug('success:photo deleted: photo_id: {}'.format(photo_id))
@@ -237,8 +671,14 @@ class OnePhoto(Resource):
         Return image for thumbnail and original photo.
         :param photo_id: target photo id
         :queryparam mode: None(original) or thumbnail
+        :queryparam w: width of a sized rendition, made on demand
+        :queryparam h: height of a sized rendition
+        :queryparam fit: contain(default) or cover, see FITS
         :return: image url for authenticated user
         """
+        args = photo_get_parser.parse_args()
+        if args['w'] < 0 or args['h'] < 0:
+            raise BadRequest('Invalid size:{0}x{1}'.format(args['w'], args['h']))
         try:
             mode = request.args.get('mode')
             email = get_jwt_identity()['email']
@@ -247,7 +687,9 @@ class OnePhoto(Resource):
 
             photo = db.session.query(Photo).filter_by(id=photo_id).first()
 
-            if mode == 'thumbnail':
+            if args['w'] or args['h']:
+                full_path = sized_rendition(email, photo.filename, (args['w'], args['h']), args['fit'])
+            elif mode == 'thumbnail':
                 full_path = full_path / 'thumbnails' / photo.filename
             else:
                 full_path = full_path / photo.filename
@@ -30,6 +30,54 @@ class BaseConfig:
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', os.path.join(os.getcwd(), '/tmp'))
     THUMBNAIL_WIDTH = os.getenv('THUMBNAIL_WIDTH', 300)
     THUMBNAIL_HEIGHT = os.getenv('THUMBNAIL_HEIGHT', 200)
+    # Renditions made from each upload, comma separated 'name:WIDTHxHEIGHT' (e.g. 'retina:600x400').
+    # A rendition is stored in the folder named after it, 'thumbnails' is the photo grid thumbnail.
+    THUMBNAIL_RENDITIONS = os.getenv('THUMBNAIL_RENDITIONS',
+                                     'thumbnails:{0}x{1}'.format(THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT))
+    # Processes making renditions, 0 makes them in the calling thread. Original image is handed over by shared
+    # memory, and at most THUMBNAIL_PROCESS_QUEUE images are submitted at once, further uploads wait for a slot.
+    THUMBNAIL_PROCESSES = int(os.getenv('THUMBNAIL_PROCESSES', '0'))
+    THUMBNAIL_PROCESS_QUEUE = int(os.getenv('THUMBNAIL_PROCESS_QUEUE', '16'))
+    # Sized renditions are made on demand by GET /photos/<id>?w=&h=&fit=, each edge rounded up to one of
+    # RENDITION_SIZES to bound the renditions per photo. They are made from a mezzanine decode of at most
+    # RENDITION_MEZZANINE_SIZE pixels, and mezzanines of the last RENDITION_MEZZANINE_CACHE photos are kept in memory.
+    RENDITION_SIZES = os.getenv('RENDITION_SIZES', '160,320,640,1280')
+    RENDITION_MEZZANINE_SIZE = int(os.getenv('RENDITION_MEZZANINE_SIZE', '2048'))
+    RENDITION_MEZZANINE_CACHE = int(os.getenv('RENDITION_MEZZANINE_CACHE', '8'))
+    # Worker threads generating thumbnails after upload, 0 generates them in the request.
+    THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', '2'))
+    # Files of a /photos/files batch upload saved at once, shared by all requests of the process,
+    # and max number of files in one batch.
+    UPLOAD_BATCH_WORKERS = int(os.getenv('UPLOAD_BATCH_WORKERS', '4'))
+    UPLOAD_BATCH_MAX_FILES = int(os.getenv('UPLOAD_BATCH_MAX_FILES', '100'))
+    # Resumable upload receives the original in chunks of UPLOAD_SESSION_CHUNK_SIZE, see /photos/uploads.
+    # Sessions which received nothing for UPLOAD_SESSION_EXPIRE_TIME are removed, at most once per
+    # UPLOAD_SESSION_GC_INTERVAL in each process, 0 leaves them to 'manage.py collect_upload_sessions'.
+    UPLOAD_SESSION_CHUNK_SIZE = int(os.getenv('UPLOAD_SESSION_CHUNK_SIZE', str(8 * 1024 * 1024)))
+    UPLOAD_SESSION_MAX_SIZE = int(os.getenv('UPLOAD_SESSION_MAX_SIZE', str(50 * 1024 * 1024)))
+    UPLOAD_SESSION_EXPIRE_TIME = int(os.getenv('UPLOAD_SESSION_EXPIRE_TIME', str(24 * 60 * 60)))
+    UPLOAD_SESSION_GC_INTERVAL = int(os.getenv('UPLOAD_SESSION_GC_INTERVAL', '3600'))
+    # Photo list is streamed batch by batch of PHOTO_LIST_STREAM_BATCH photos while it is read, so the first byte
+    # and the memory do not wait for the whole list.
+    PHOTO_LIST_STREAM = os.getenv('PHOTO_LIST_STREAM', 'False') == 'True'
+    PHOTO_LIST_STREAM_BATCH = int(os.getenv('PHOTO_LIST_STREAM_BATCH', '100'))
+    # Photo list returns pages of 'limit' photos when it is given, PHOTO_LIST_DEFAULT_LIMIT otherwise,
+    # 0 returns the whole list at once.
+    PHOTO_LIST_DEFAULT_LIMIT = int(os.getenv('PHOTO_LIST_DEFAULT_LIMIT', '0'))
+    PHOTO_LIST_MAX_LIMIT = int(os.getenv('PHOTO_LIST_MAX_LIMIT', '1000'))
+    # Photo list reads the rows as tuples of the columns without making Photo objects of the ORM.
+    PHOTO_LIST_TUPLES = os.getenv('PHOTO_LIST_TUPLES', 'True') == 'True'
+    # Photo list answers ETag of the list version of the user, the same If-None-Match gets 304 after reading
+    # the version only.
+    PHOTO_LIST_ETAG = os.getenv('PHOTO_LIST_ETAG', 'True') == 'True'
+    # Photo list is encoded by orjson when it is installed, otherwise by json of the standard library.
+    PHOTO_LIST_ORJSON = os.getenv('PHOTO_LIST_ORJSON', 'True') == 'True'
+    # Serialized photo lists of the users read recently are kept in the process within PHOTO_LIST_CACHE_BYTES,
+    # 0 turns the cache off. PHOTO_LIST_SHARED_CACHE shares them among the processes for
+    # PHOTO_LIST_SHARED_CACHE_TIMEOUT seconds, e.g. 'redis://localhost:6379/0' or 'file:///tmp/cloudalbum-lists'.
+    PHOTO_LIST_CACHE_BYTES = int(os.getenv('PHOTO_LIST_CACHE_BYTES', str(64 * 1024 * 1024)))
+    PHOTO_LIST_SHARED_CACHE = os.getenv('PHOTO_LIST_SHARED_CACHE', '')
+    PHOTO_LIST_SHARED_CACHE_TIMEOUT = int(os.getenv('PHOTO_LIST_SHARED_CACHE_TIMEOUT', '3600'))
 
 
 class DevelopmentConfig(BaseConfig):
@@ -42,6 +90,7 @@ class TestingConfig(BaseConfig):
     """Testing configuration"""
     TESTING = True
     SECRET_KEY = os.getenv('FLASK_SECRET', 'test_secret')
+    THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', '0'))
     SQLALCHEMY_ECHO = eval(os.getenv('SQLALCHEMY_ECHO', 'False'))
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_TEST_URL', 'sqlite:////tmp/sqlite_test.database')
 
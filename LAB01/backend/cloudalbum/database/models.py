@@ -7,10 +7,20 @@
     :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
     :license: MIT, see LICENSE for more details.
 """
+import base64
+import json
 from flask_login import UserMixin
-from sqlalchemy import Float, DateTime, ForeignKey, Integer, String
+from sqlalchemy import Float, DateTime, ForeignKey, Integer, BigInteger, String, Index, and_, or_, select
+from sqlalchemy.orm import load_only
 from datetime import datetime
 from cloudalbum import db
+from cloudalbum.util.serializer import FieldPlan
+
+# Thumbnail generation state of a photo
+PROCESSING_PENDING = 'pending'
+PROCESSING_RUNNING = 'processing'
+PROCESSING_DONE = 'done'
+PROCESSING_FAILED = 'failed'
 
 
 class User(UserMixin, db.Model):
@@ -49,6 +59,10 @@ class Photo(db.Model):
     Database Model class for Photo table
     """
     __tablename__ = 'Photo'
+    # Photo list of a user in each order of PHOTO_LIST_ORDERS is a range of one of them. The primary key ends
+    # every entry (rowid of SQLite, clustered key of InnoDB), so the tie of a date is ordered by id in the index too.
+    __table_args__ = (Index('ix_Photo_user_id_upload_date', 'user_id', 'upload_date'),
+                      Index('ix_Photo_user_id_taken_date', 'user_id', 'taken_date'))
 
     id = db.Column(Integer, primary_key=True)
     user_id = db.Column(Integer, ForeignKey(User.id))
@@ -68,9 +82,13 @@ class Photo(db.Model):
     city = db.Column(String(400), unique=False)
     nation = db.Column(String(400), unique=False)
     address = db.Column(String(400), unique=False)
+    processing_state = db.Column(String(16), unique=False, index=True, default=PROCESSING_DONE)
+    # SHA-256 of the original. With user_id it is the content index, photos of the same content share the files.
+    digest = db.Column(String(64), unique=False, index=True)
 
     def __init__(self, user_id, filename_orig, filename, filesize, upload_date, tags, desc, geotag_lat, geotag_lng,
-                 taken_date, make, model, width, height, city, nation, address):
+                 taken_date, make, model, width, height, city, nation, address, processing_state=PROCESSING_DONE,
+                 digest=None):
         """Initialize"""
 
         self.user_id = user_id
@@ -90,6 +108,8 @@ class Photo(db.Model):
         self.city = city
         self.nation = nation
         self.address = address
+        self.processing_state = processing_state
+        self.digest = digest
 
     def __repr__(self):
         """print information"""
@@ -97,26 +117,184 @@ class Photo(db.Model):
         return '<%r %r %r>' % (self.__tablename__, self.user_id, self.upload_date)
 
     def to_json(self):
-        return {
-            'id': self.id,
-            'user_id': self.user_id,
-            'tags': self.tags,
-            'desc': self.desc,
-            'filename_orig': self.filename_orig,
-            'filename': self.filename,
-            'filesize': self.filesize,
-            'geotag_lat': self.geotag_lat,
-            'geotag_lng': self.geotag_lng,
-            'upload_date': self.upload_date,
-            'taken_date': self.taken_date,
-            'make': self.make,
-            'model': self.model,
-            'width': self.width,
-            'height': self.height,
-            'city': self.city,
-            'nation': self.nation,
-            'address': self.address
-        }
+        return PHOTO_JSON_PLAN.one(self)
 
     def insert_column(self, col, data):
         self[col] = data
+
+
+# Fields of Photo in the responses, datetimes are formatted as JSONEncoder does.
+PHOTO_JSON_PLAN = FieldPlan(['id', 'user_id', 'tags', 'desc', 'filename_orig', 'filename', 'filesize', 'geotag_lat',
+                             'geotag_lng', 'upload_date', 'taken_date', 'make', 'model', 'width', 'height', 'city',
+                             'nation', 'address', 'processing_state', 'digest'],
+                            {'upload_date': str, 'taken_date': str})
+
+
+class PhotoListVersion(db.Model):
+    """
+    Database Model class for PhotoListVersion table,
+    version of the photo list of a user which is bumped on every change of the photos of the user.
+    It starts from the epoch milliseconds of the first change, so a recreated database never gives
+    the version of a list before.
+    """
+    __tablename__ = 'PhotoListVersion'
+
+    # user_id is not the primary key, which SQLite would make the alias of rowid accepting integers only.
+    id = db.Column(Integer, primary_key=True)
+    user_id = db.Column(Integer, ForeignKey(User.id), unique=True, nullable=False)
+    version = db.Column(BigInteger, unique=False, nullable=False, default=0)
+
+    def __init__(self, user_id, version=0):
+        self.user_id = user_id
+        self.version = version
+
+    def __repr__(self):
+        return '<%r %r %r>' % (self.__tablename__, self.user_id, self.version)
+
+# Fields of the grid view of the photo list, the columns read by the list view. It has every column of
+# PHOTO_LIST_ORDERS, which the cursor is made of.
+PHOTO_LIST_COLUMNS = ['id', 'user_id', 'tags', 'desc', 'filename_orig', 'filename', 'geotag_lat', 'geotag_lng',
+                      'upload_date', 'taken_date', 'address', 'processing_state']
+# Orders of the photo list, newest first and the greater id first among the same date.
+# Photos without the date, e.g. taken_date of a photo without EXIF, come after the others.
+PHOTO_LIST_ORDERS = ['upload_date', 'taken_date']
+CURSOR_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def encode_cursor(order, photo):
+    """
+    Return opaque cursor of a page of photos, which starts after the photo in the order.
+    :param order: one of PHOTO_LIST_ORDERS
+    :param photo: last Photo or row of the previous page
+    :return: string
+    """
+    date = getattr(photo, order)
+    key = [order, date.strftime(CURSOR_DATE_FORMAT) if date is not None else None, photo.id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, order):
+    """
+    Return the key of the photo which the page of the cursor starts after, see encode_cursor().
+    :param cursor: string
+    :param order: one of PHOTO_LIST_ORDERS
+    :return: (date of the order, None when the photo has no date, photo id)
+    :raise ValueError: when the cursor is broken or of another order
+    """
+    try:
+        cursor_order, date, photo_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        date = datetime.strptime(date, CURSOR_DATE_FORMAT) if date is not None else None
+    except (TypeError, ValueError) as e:
+        raise ValueError('Broken cursor:{0}'.format(e))
+    if cursor_order != order or type(photo_id) is not int:
+        raise ValueError('Cursor of another order:{0}'.format(cursor_order))
+    return date, photo_id
+
+
+def keyset_ranges(order, after=None):
+    """
+    Return the ranges of the photo list in the order after the key, each is read from the index of the order.
+    Photos of the date come first, then photos without it. Neither has an OFFSET, so a deep page costs as much
+    as the first one.
+    :param order: one of PHOTO_LIST_ORDERS
+    :param after: key of decode_cursor(), from the first photo when it is None
+    :return: list of (condition, order_by)
+    """
+    column = getattr(Photo, order)
+    dated = (column.desc(), Photo.id.desc())
+    undated = (Photo.id.desc(),)
+    if after is None:
+        return [(column.isnot(None), dated), (column.is_(None), undated)]
+    date, photo_id = after
+    if date is None:
+        return [(and_(column.is_(None), Photo.id < photo_id), undated)]
+    # column <= date bounds the index range, the rest skips the photos of the same date up to the photo.
+    return [(and_(column <= date, or_(column < date, Photo.id < photo_id)), dated), (column.is_(None), undated)]
+
+
+class PhotoResults:
+    """
+    Photos of query_photos(), read lazily range by range of keyset_ranges().
+    """
+
+    def __init__(self, session, user_id, order, limit, after, columns, tuples, batch):
+        self.session = session
+        self.user_id = user_id
+        self.order = order
+        self.limit = limit
+        self.after = after
+        self.columns = columns
+        self.tuples = tuples
+        self.batch = batch
+        self.next_cursor = None
+
+    def query(self, condition, order_by, limit):
+        if self.tuples:
+            columns = [getattr(Photo, name) for name in self.columns]
+            statement = select(columns).where(and_(Photo.user_id == self.user_id, condition)) \
+                .order_by(*order_by).limit(limit)
+            return self.session.execute(statement)
+        query = self.session.query(Photo).filter(Photo.user_id == self.user_id, condition) \
+            .order_by(*order_by).limit(limit)
+        if self.columns is not None:
+            query = query.options(load_only(*self.columns))
+        return query.yield_per(self.batch)
+
+    def __iter__(self):
+        # One photo more than the limit is read, so the last page is known to have no next page.
+        count = 0
+        last = None
+        for condition, order_by in keyset_ranges(self.order, self.after):
+            remaining = self.limit + 1 - count if self.limit is not None else None
+            if remaining == 0:
+                break
+            for photo in self.query(condition, order_by, remaining):
+                count += 1
+                if self.limit is not None and count > self.limit:
+                    self.next_cursor = encode_cursor(self.order, last)
+                    return
+                last = photo
+                yield photo
+
+
+def query_photos(user_id, order='upload_date', limit=None, cursor=None, columns=None, tuples=False, batch=100,
+                 session=None):
+    """
+    Query a page of the photos of the user in the order, read lazily batch by batch.
+    :param user_id: user id
+    :param order: one of PHOTO_LIST_ORDERS
+    :param limit: max number of photos, every photo when it is None
+    :param cursor: next cursor of the previous page, from the first photo when it is None
+    :param columns: names of the columns read, e.g. PHOTO_LIST_COLUMNS, every column when it is None.
+                    It has every column of PHOTO_LIST_ORDERS when limit is given.
+    :param tuples: photos are tuples of the columns read without the ORM, see FieldPlan.many_tuples().
+                   Otherwise they are Photo, of which the other columns are loaded when they are read.
+    :param batch: number of Photo made at a time
+    :param session: database session, db.session when it is None
+    :return: iterator of Photo or tuple, see next_page_cursor()
+    :raise ValueError: when the cursor is broken
+    """
+    after = decode_cursor(cursor, order) if cursor else None
+    if tuples:
+        columns = PHOTO_JSON_PLAN.only(columns).names
+    return PhotoResults(session or db.session, user_id, order, limit, after, columns, tuples, batch)
+
+
+def next_page_cursor(results):
+    """
+    Return cursor of the page after the photos which query_photos() returned, once they are all read.
+    :param results: iterator of query_photos()
+    :return: cursor, None on the last page
+    """
+    return results.next_cursor
+
+
+def photos_to_json(results, photos):
+    """
+    Return the dicts of the photos of query_photos(), of the columns read.
+    :param results: iterator of query_photos()
+    :param photos: list of its photos
+    :return: list of dict
+    """
+    plan = PHOTO_JSON_PLAN.only(results.columns)
+    return plan.many_tuples(photos) if results.tuples else plan.many(photos)
@@ -24,6 +24,13 @@ class TestAdminService(BaseTestCase):
         response = self.client.get('/admin/health_check')
         self.assert200(response)
 
+    def test_photo_list_cache(self):
+        """Ensure the /photo_list_cache returns the counters of the photo list cache."""
+        response = self.client.get('/admin/photo_list_cache')
+        self.assert200(response)
+        self.assertTrue(response.json['enabled'])
+        self.assertIn('hits', response.json['stats'])
+
 
 if __name__ == '__main__':
     unittest.main()
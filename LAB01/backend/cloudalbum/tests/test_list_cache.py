@@ -0,0 +1,74 @@
+"""
+    cloudalbum/tests/test_list_cache.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Test cases for the cache of the serialized photo lists
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import shutil
+import tempfile
+import unittest
+from cloudalbum.util.list_cache import PhotoListCache, make_shared_cache
+
+
+class TestPhotoListCache(unittest.TestCase):
+    """Tests for the photo list cache."""
+
+    def test_version(self):
+        """Ensure the list is answered for its version only."""
+        cache = PhotoListCache(100)
+        self.assertIsNone(cache.get('user', 1))
+        cache.put('user', 1, b'[1]')
+        self.assertEqual(cache.get('user', 1), b'[1]')
+        self.assertIsNone(cache.get('user', 2))
+        self.assertIsNone(cache.get('other', 1))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 3)
+
+    def test_budget(self):
+        """Ensure the least recently read lists are evicted to keep the budget of bytes."""
+        cache = PhotoListCache(10)
+        cache.put('a', 1, b'aaaa')
+        cache.put('b', 1, b'bbbb')
+        cache.get('a', 1)
+        cache.put('c', 1, b'cccc')
+        self.assertIsNone(cache.get('b', 1))
+        self.assertEqual(cache.get('a', 1), b'aaaa')
+        self.assertEqual(cache.stats()['bytes'], 8)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        cache.put('d', 1, b'd' * 11)
+        self.assertIsNone(cache.get('d', 1))
+        cache.put('a', 2, b'aa')
+        self.assertEqual(cache.stats()['bytes'], 6)
+
+    def test_invalidate(self):
+        """Ensure the list of the user is dropped."""
+        cache = PhotoListCache(100)
+        cache.put('user', 1, b'[1]')
+        cache.invalidate('user')
+        cache.invalidate('user')
+        self.assertIsNone(cache.get('user', 1))
+        self.assertEqual(cache.stats()['bytes'], 0)
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+    def test_shared(self):
+        """Ensure a list is read from the shared backend by another process."""
+        path = tempfile.mkdtemp()
+        try:
+            writer = PhotoListCache(100, make_shared_cache('file://{0}'.format(path)))
+            reader = PhotoListCache(100, make_shared_cache('file://{0}'.format(path)))
+            writer.put('user', 1, b'[1]')
+            self.assertEqual(reader.get('user', 1), b'[1]')
+            self.assertEqual(reader.stats()['shared_hits'], 1)
+            self.assertIsNone(reader.get('user', 2))
+            writer.invalidate('user')
+            self.assertIsNone(PhotoListCache(100, make_shared_cache('file://{0}'.format(path))).get('user', 1))
+        finally:
+            shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
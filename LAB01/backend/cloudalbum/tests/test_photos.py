@@ -7,10 +7,16 @@
     :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
     :license: MIT, see LICENSE for more details.
 """
+import hashlib
 import unittest
 import pytest
 from io import BytesIO
+from PIL import Image
+from cloudalbum import db
+from cloudalbum.database.models import Photo
 from cloudalbum.tests.base import BaseTestCase
+from cloudalbum.util.file_control import photo_list_cache
+from cloudalbum.util.thumbnail_queue import thumbnail_queue
 from flask_jwt_extended import create_access_token
 
 for_user_token = {
@@ -74,6 +80,328 @@ class TestPhotoService(BaseTestCase):
         )
         self.assert200(response)
 
+    def test_list_stream(self):
+        """Ensure the /photos/ streams the same list batch by batch when PHOTO_LIST_STREAM is on."""
+        for _ in range(3):
+            upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+            response = self.client.post(
+                '/photos/file',
+                headers=self.test_header,
+                content_type='multipart/form-data',
+                data=upload
+            )
+            self.assert200(response)
+        # Streamed first, a list answered from the photo list cache is not streamed.
+        self.app.config.update(PHOTO_LIST_STREAM=True, PHOTO_LIST_STREAM_BATCH=2)
+        try:
+            response = self.client.get('/photos/', headers=self.test_header)
+        finally:
+            self.app.config.update(PHOTO_LIST_STREAM=False, PHOTO_LIST_STREAM_BATCH=100)
+        self.assert200(response)
+        self.assertTrue(response.is_streamed)
+        streamed = response.get_json()
+
+        response = self.client.get('/photos/', headers=self.test_header)
+        self.assert200(response)
+        self.assertEqual(streamed, response.get_json())
+        self.assertEqual(len(streamed['photos']), 3)
+
+    def test_list_cache(self):
+        """Ensure the /photos/ answers the cached list until the photos of the user are changed."""
+        cache = photo_list_cache()
+        response = self.client.get('/photos/', headers=self.test_header)
+        self.assert200(response)
+        hits = cache.stats()['hits']
+        response = self.client.get('/photos/', headers=self.test_header)
+        self.assert200(response)
+        self.assertEqual(cache.stats()['hits'], hits + 1)
+        self.assertEqual(response.get_json()['photos'], [])
+
+        upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+        response = self.client.post(
+            '/photos/file',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=upload
+        )
+        self.assert200(response)
+        photo_id = response.json['photo_id']
+        response = self.client.get('/photos/', headers=self.test_header)
+        self.assert200(response)
+        self.assertEqual([photo['id'] for photo in response.get_json()['photos']], [photo_id])
+
+        response = self.client.post('/photos/{0}/info'.format(photo_id), headers=self.test_header,
+                                    json={'tags': 'cached', 'taken_date': '2012:07:15 09:46:46'})
+        self.assert200(response)
+        response = self.client.get('/photos/', headers=self.test_header)
+        self.assertEqual(response.get_json()['photos'][0]['tags'], 'cached')
+
+        response = self.client.delete('/photos/{}'.format(photo_id), headers=self.test_header)
+        self.assert200(response)
+        response = self.client.get('/photos/', headers=self.test_header)
+        self.assertEqual(response.get_json()['photos'], [])
+
+    def test_list_etag(self):
+        """Ensure the /photos/ returns 304 for the ETag of the list until a photo is uploaded or deleted."""
+        response = self.client.get('/photos/', headers=self.test_header)
+        self.assert200(response)
+        etag = response.headers['ETag']
+        headers = dict(self.test_header, **{'If-None-Match': etag})
+        response = self.client.get('/photos/', headers=headers)
+        self.assertStatus(response, 304)
+
+        upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+        response = self.client.post(
+            '/photos/file',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=upload
+        )
+        self.assert200(response)
+        photo_id = response.json['photo_id']
+        response = self.client.get('/photos/', headers=headers)
+        self.assert200(response)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        headers['If-None-Match'] = response.headers['ETag']
+        response = self.client.delete('/photos/{}'.format(photo_id), headers=self.test_header)
+        self.assert200(response)
+        response = self.client.get('/photos/', headers=headers)
+        self.assert200(response)
+
+    def test_list_pages(self):
+        """Ensure the pages of the /photos/ have every photo once, newest first in each order."""
+        photo_ids = []
+        for _ in range(5):
+            upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+            response = self.client.post(
+                '/photos/file',
+                headers=self.test_header,
+                content_type='multipart/form-data',
+                data=upload
+            )
+            self.assert200(response)
+            photo_ids.append(response.json['photo_id'])
+        # Photos without taken_date come after the others, which are taken at the same time.
+        Photo.query.get(photo_ids[1]).taken_date = None
+        Photo.query.get(photo_ids[3]).taken_date = None
+        db.session.commit()
+        expected = {'upload_date': photo_ids[::-1], 'taken_date': [photo_ids[i] for i in (4, 2, 0, 3, 1)]}
+
+        for tuples in (True, False):
+            self.app.config['PHOTO_LIST_TUPLES'] = tuples
+            try:
+                for order, ids in expected.items():
+                    pages = []
+                    url = '/photos/?limit=2&order={0}'.format(order)
+                    while url:
+                        response = self.client.get(url, headers=self.test_header)
+                        self.assert200(response)
+                        pages.append([photo['id'] for photo in response.json['photos']])
+                        cursor = response.json['next_cursor']
+                        url = '/photos/?limit=2&order={0}&cursor={1}'.format(order, cursor) if cursor else None
+                    self.assertEqual(pages, [ids[0:2], ids[2:4], ids[4:]])
+            finally:
+                self.app.config['PHOTO_LIST_TUPLES'] = True
+
+        response = self.client.get('/photos/?limit=5', headers=self.test_header)
+        self.assertIsNone(response.json['next_cursor'])
+        self.assertNotIn('filesize', response.json['photos'][0])
+        response = self.client.get('/photos/?limit=1&view=full', headers=self.test_header)
+        self.assertEqual(response.json['photos'][0]['filesize'], len(b'my file contents'))
+
+    def test_list_invalid_page(self):
+        """Ensure the /photos/ refuses a limit out of range and a cursor which is broken or of another order."""
+        for _ in range(2):
+            upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+            response = self.client.post(
+                '/photos/file',
+                headers=self.test_header,
+                content_type='multipart/form-data',
+                data=upload
+            )
+            self.assert200(response)
+        response = self.client.get('/photos/?limit=1', headers=self.test_header)
+        cursor = response.json['next_cursor']
+        for query in ('limit=-1', 'limit=1001', 'cursor=broken', 'cursor={0}&order=taken_date'.format(cursor)):
+            response = self.client.get('/photos/?{0}'.format(query), headers=self.test_header)
+            self.assert400(response)
+
+    def test_upload_thumbnail_queue(self):
+        """Ensure thumbnails are made by the background queue and its state is in the /photos/ list."""
+        original = BytesIO()
+        Image.new('RGB', (1200, 800), (120, 80, 40)).save(original, 'JPEG')
+        original.seek(0)
+        upload['file'] = (original, 'test_image.jpg')
+        self.app.config['THUMBNAIL_WORKERS'] = 1
+        try:
+            response = self.client.post(
+                '/photos/file',
+                headers=self.test_header,
+                content_type='multipart/form-data',
+                data=upload
+            )
+            self.assert200(response)
+            thumbnail_queue.join(timeout=10)
+        finally:
+            self.app.config['THUMBNAIL_WORKERS'] = 0
+
+        response = self.client.get(
+            '/photos/',
+            headers=self.test_header,
+            content_type='application/json',
+        )
+        self.assert200(response)
+        self.assertEqual([photo['processing_state'] for photo in response.json['photos']], ['done'])
+
+    def test_upload_thumbnail_failed(self):
+        """Ensure a photo which thumbnail cannot be made is marked as failed."""
+        upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+        response = self.client.post(
+            '/photos/file',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=upload
+        )
+        self.assert200(response)
+        self.assertEqual(response.json['processing_state'], 'failed')
+
+    def test_upload_image_info(self):
+        """Ensure photo information is read from the image itself, without the client parsed fields."""
+        original = BytesIO()
+        Image.new('RGB', (1200, 800), (120, 80, 40)).save(original, 'JPEG')
+        original.seek(0)
+        data = {key: value for key, value in upload.items() if key not in ['width', 'height', 'taken_date']}
+        data['file'] = (original, 'test_image.jpg')
+        response = self.client.post(
+            '/photos/file',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=data
+        )
+        self.assert200(response)
+        self.assertEqual(response.json['photos']['width'], '1200')
+        self.assertEqual(response.json['photos']['height'], '800')
+        self.assertIsNone(response.json['photos']['taken_date'])
+
+    def test_upload_session(self):
+        """Ensure the /photos/uploads resumes from the chunks received, and saves the assembled photo."""
+        contents = b'my file contents, uploaded in chunks'
+        chunk_size = self.app.config['UPLOAD_SESSION_CHUNK_SIZE']
+        self.app.config['UPLOAD_SESSION_CHUNK_SIZE'] = 8
+        try:
+            response = self.client.post(
+                '/photos/uploads',
+                headers=self.test_header,
+                content_type='multipart/form-data',
+                data={'filename_orig': 'test_image.jpg'}
+            )
+            self.assert200(response)
+            url = '/photos/uploads/{0}'.format(response.json['session_id'])
+            chunks = [contents[offset:offset + 8] for offset in range(0, len(contents), 8)]
+            data = {key: value for key, value in upload.items() if key != 'file'}
+
+            for number in [1, 2, 4]:
+                self.assert200(self.client.put('{0}/{1}'.format(url, number), headers=self.test_header,
+                                               data=chunks[number - 1]))
+            response = self.client.get(url, headers=self.test_header)
+            self.assert200(response)
+            self.assertEqual(response.json['received'], 16)
+            self.assert400(self.client.post(url + '/complete', headers=self.test_header,
+                                            content_type='multipart/form-data', data=data))
+
+            for number in range(3, len(chunks) + 1):
+                self.assert200(self.client.put('{0}/{1}'.format(url, number), headers=self.test_header,
+                                               data=chunks[number - 1]))
+            response = self.client.post(url + '/complete', headers=self.test_header,
+                                        content_type='multipart/form-data', data=data)
+            self.assert200(response)
+            self.assertEqual(response.json['photos']['filesize'], len(contents))
+            self.assertEqual(response.json['photos']['digest'], hashlib.sha256(contents).hexdigest())
+            self.assert404(self.client.get(url, headers=self.test_header))
+        finally:
+            self.app.config['UPLOAD_SESSION_CHUNK_SIZE'] = chunk_size
+
+    def test_upload_files(self):
+        """Ensure the /photos/files saves several photos in one request, with the result of each file."""
+        data = {key: value for key, value in upload.items() if key != 'file'}
+        data['files'] = [(BytesIO(b'first file contents'), 'first.jpg'),
+                         (BytesIO(b'second file contents'), 'second.png'),
+                         (BytesIO(b'not an image'), 'notes.txt')]
+        response = self.client.post(
+            '/photos/files',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=data
+        )
+        self.assert200(response)
+        self.assertEqual([item['ok'] for item in response.json['files']], [True, True, False])
+        self.assertEqual([item['filename_orig'] for item in response.json['files']],
+                         ['first.jpg', 'second.png', 'notes.txt'])
+
+        response = self.client.get(
+            '/photos/',
+            headers=self.test_header,
+            content_type='application/json',
+        )
+        self.assert200(response)
+        self.assertEqual(sorted(photo['filename_orig'] for photo in response.json['photos']),
+                         ['first.jpg', 'second.png'])
+
+    def test_upload_duplicate(self):
+        """Ensure the same content uploaded again shares the stored file."""
+        photos = []
+        for _ in range(2):
+            upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+            response = self.client.post(
+                '/photos/file',
+                headers=self.test_header,
+                content_type='multipart/form-data',
+                data=upload
+            )
+            self.assert200(response)
+            photos.append(response.json)
+        self.assertEqual([photo['duplicate'] for photo in photos], [False, True])
+
+        response = self.client.get(
+            '/photos/',
+            headers=self.test_header,
+            content_type='application/json',
+        )
+        self.assert200(response)
+        self.assertEqual(len({photo['filename'] for photo in response.json['photos']}), 1)
+
+    def test_digest_check(self):
+        """Ensure the /photos/digest saves a photo without file transfer when the content is stored."""
+        data = {key: value for key, value in upload.items() if key != 'file'}
+        data['digest'] = hashlib.sha256(b'my file contents').hexdigest()
+        response = self.client.post(
+            '/photos/digest',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=data
+        )
+        self.assert200(response)
+        self.assertFalse(response.json['exists'])
+
+        upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+        response = self.client.post(
+            '/photos/file',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=upload
+        )
+        self.assert200(response)
+
+        response = self.client.post(
+            '/photos/digest',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=data
+        )
+        self.assert200(response)
+        self.assertTrue(response.json['exists'])
+
     def test_delete(self):
         """Ensure the /photos/<photo_id> route behaves correctly."""
         # 1. upload
@@ -127,6 +455,34 @@ class TestPhotoService(BaseTestCase):
         )
         self.assert200(response)
 
+    def test_get_sized(self):
+        """Ensure the /photos/<photo_id>?w=&h=&fit= makes a rendition of the size rounded up to RENDITION_SIZES."""
+        original = BytesIO()
+        Image.new('RGB', (1200, 800), (120, 80, 40)).save(original, 'JPEG')
+        original.seek(0)
+        upload['file'] = (original, 'test_image.jpg')
+        response = self.client.post(
+            '/photos/file',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=upload
+        )
+        self.assert200(response)
+        photo_id = response.json['photo_id']
+
+        for query, size in [({'w': 300}, (320, 213)), ({'w': 100, 'h': 100, 'fit': 'cover'}, (160, 160))]:
+            response = self.client.get(
+                '/photos/{}'.format(photo_id),
+                headers=self.test_header,
+                query_string=query
+            )
+            self.assert200(response)
+            self.assertEqual(Image.open(BytesIO(response.data)).size, size)
+
+        response = self.client.get('/photos/{}'.format(photo_id), headers=self.test_header,
+                                   query_string={'w': 100, 'fit': 'stretch'})
+        self.assert400(response)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -8,41 +8,137 @@
     :license: MIT, see LICENSE for more details.
 """
 import os
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from flask import current_app as app
-from PIL import Image
 from pathlib import Path
 from datetime import datetime
-from cloudalbum.database.models import Photo
+from cloudalbum.database.models import Photo, PhotoListVersion, PROCESSING_PENDING
+from cloudalbum.util.rendition import parse_renditions, make_renditions, get_rendition_pool, parse_sizes, \
+    quantize_size, sized_rendition_path, get_rendition_cache, SIZED_FOLDER
+from cloudalbum.util.exif import read_image_info, HEADER_SIZE
+from cloudalbum.util.list_cache import get_photo_list_cache
 from cloudalbum import db
 
 
+# Size of a chunk copied from the upload stream to the file, hashing it on the way.
+SAVE_CHUNK_SIZE = 1024 * 1024
+
+
 def email_normalize(email):
     return email.replace('@', '_at_').replace('.', '_dot_')
 
 
+_batch_executor = None
+_batch_workers = None
+_batch_executor_lock = threading.Lock()
+
+
+def get_batch_executor(workers):
+    """
+    Return the executor saving files of batch uploads, which is created at the first call.
+    :param workers: max number of files saved at once
+    :return: ThreadPoolExecutor
+    """
+    global _batch_executor, _batch_workers
+    with _batch_executor_lock:
+        if _batch_executor is None or _batch_workers != workers:
+            if _batch_executor is not None:
+                _batch_executor.shutdown(wait=False)
+            _batch_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload-batch')
+            _batch_workers = workers
+        return _batch_executor
+
+
+def run_in_app_context(application, func, *args):
+    with application.app_context():
+        return func(*args)
+
+
+def map_batch(func, items):
+    """
+    Run func(item) for each item on the batch executor, within the application context of the caller.
+    At most UPLOAD_BATCH_WORKERS items run at once in the process. func must not use the database session,
+    which is bound to the request thread.
+    :return: list of (result, exception) in the order of items
+    """
+    executor = get_batch_executor(int(app.config['UPLOAD_BATCH_WORKERS']))
+    futures = [executor.submit(run_in_app_context, app._get_current_object(), func, item) for item in items]
+    wait(futures)
+    return [(None, future.exception()) if future.exception() is not None else (future.result(), None)
+            for future in futures]
+
+
+def render_renditions(file_p, renditions):
+    """
+    Make renditions, in the rendition process pool when THUMBNAIL_PROCESSES is set.
+    :param file_p: pathlib.Path or file object of original image
+    :param renditions: list of (name, (width, height)), see parse_renditions()
+    :return: dict, rendition name to JPEG bytes
+    """
+    processes = int(app.config['THUMBNAIL_PROCESSES'])
+    if processes <= 0:
+        return make_renditions(file_p, renditions)
+
+    data = file_p.read_bytes() if isinstance(file_p, Path) else file_p.read()
+    pool = get_rendition_pool(processes, int(app.config['THUMBNAIL_PROCESS_QUEUE']))
+    return pool.make_renditions(data, renditions)
+
+
 def make_thumbnail(path, filename):
     """
-    Generate thumbnail from original image file.
+    Generate thumbnail and the other renditions from original image file.
+    Each rendition is saved in the folder named after it, e.g. 'thumbnails'.
     :param path: pathlib.Path, which pointing a original file directory
     :param filename: secure file name
-    :return: None
+    :return: Boolean, True when every rendition is saved
     """
-    thumb_path = path / 'thumbnails'
-    thumb_file_location = thumb_path / filename
-
     try:
-        if not thumb_path.exists():
-            thumb_path.mkdir()
-            app.logger.info("Create folder for thumbnails: %s", str(thumb_path))
-
-        im = Image.open(path / filename)
-        im = im.convert('RGB')
-        im.thumbnail((300, 200, Image.ANTIALIAS))
-        im.save(thumb_file_location)
-        app.logger.debug("success:thumbnail saved!:{}".format(str(thumb_file_location)))
+        renditions = render_renditions(path / filename, parse_renditions(app.config['THUMBNAIL_RENDITIONS']))
+        for name, image_bytes in renditions.items():
+            rendition_path = path / name
+            if not rendition_path.exists():
+                rendition_path.mkdir()
+                app.logger.info("Create folder for %s: %s", name, str(rendition_path))
+
+            (rendition_path / filename).write_bytes(image_bytes)
+            app.logger.debug("success:{0} saved!:{1}".format(name, str(rendition_path / filename)))
+        return True
     except Exception as e:
-        app.logger.error("ERROR:Thumbnails creation error:{}".format(str(thumb_file_location)))
+        app.logger.error("ERROR:Thumbnails creation error:{}".format(str(path / filename)))
         app.logger.error(e)
+        return False
+
+
+def sized_rendition(email, filename, size, fit):
+    """
+    Return the sized rendition of the photo, which is made from the mezzanine and saved at the first request.
+    :param email: user email address
+    :param filename: secure filename of the original
+    :param size: requested (width, height), 0 leaves the edge free. It is rounded up to RENDITION_SIZES
+    :param fit: one of FITS
+    :return: pathlib.Path of the rendition file
+    """
+    size = quantize_size(size[0], size[1], parse_sizes(app.config['RENDITION_SIZES']))
+    path = Path(app.config['UPLOAD_FOLDER']) / email_normalize(email)
+    rendition_file = path / sized_rendition_path(filename, size, fit)
+    if rendition_file.exists():
+        return rendition_file
+
+    def save_rendition(image_bytes):
+        rendition_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = rendition_file.with_name('{0}.{1}.tmp'.format(rendition_file.name, uuid.uuid4().hex))
+        temp_file.write_bytes(image_bytes)
+        os.replace(str(temp_file), str(rendition_file))
+        app.logger.debug("success:sized rendition saved!:{}".format(str(rendition_file)))
+
+    cache = get_rendition_cache(app.config['RENDITION_MEZZANINE_SIZE'], app.config['RENDITION_MEZZANINE_CACHE'])
+    cache.make(str(path / filename), lambda: path / filename, size, fit, save=save_rendition)
+    return rendition_file
 
 
 def delete(filename, email):
@@ -54,14 +150,17 @@ def delete(filename, email):
     """
     try:
         base_path = Path(app.config['UPLOAD_FOLDER']) / email_normalize(email)
-        thumbnail_file_location = base_path / 'thumbnails' / filename
         original_file_location = base_path / filename
 
-        if thumbnail_file_location.exists():
-            Path.unlink(thumbnail_file_location)
-            app.logger.debug('success:thumbnail file deleted:filepath:{}'.format(thumbnail_file_location))
-        else:
-            app.logger.debug('DEBUG:thumbnail file not exist:filepath:{}'.format(thumbnail_file_location))
+        for name, _ in parse_renditions(app.config['THUMBNAIL_RENDITIONS']):
+            thumbnail_file_location = base_path / name / filename
+            if thumbnail_file_location.exists():
+                Path.unlink(thumbnail_file_location)
+                app.logger.debug('success:thumbnail file deleted:filepath:{}'.format(thumbnail_file_location))
+            else:
+                app.logger.debug('DEBUG:thumbnail file not exist:filepath:{}'.format(thumbnail_file_location))
+
+        shutil.rmtree(str(base_path / SIZED_FOLDER / filename), ignore_errors=True)
 
         if original_file_location.exists():
             Path.unlink(original_file_location)
@@ -80,12 +179,13 @@ def delete(filename, email):
 def save(upload_file, filename, email):
     """
     Upload input file (photo) to specific path for individual user.
-    Save original file and thumbnail file.
+    Save original file only, thumbnail files are made by the thumbnail queue afterwards.
+    The file is hashed while it is copied, so the content can be looked up with find_same_content(),
+    and photo information is read from the head of the file on the way, see read_image_info().
     :param upload_file: file object
     :param filename: secure filename for upload
     :param email: user email address
-    :param application: Flask.application
-    :return: file size (byte)
+    :return: (file size (byte), SHA-256 hex digest, photo information dict)
     """
     path = Path(app.config['UPLOAD_FOLDER']) / email_normalize(email)
 
@@ -95,40 +195,114 @@ def save(upload_file, filename, email):
             app.logger.info("folder created:{}".format(str(path)))
 
         original_full_path = path / filename
-        upload_file.save(str(original_full_path))
+        digest = hashlib.sha256()
+        file_size = 0
+        header = b''
+        with original_full_path.open('wb') as f:
+            for chunk in iter(lambda: upload_file.stream.read(SAVE_CHUNK_SIZE), b''):
+                if len(header) < HEADER_SIZE:
+                    header += chunk[:HEADER_SIZE - len(header)]
+                digest.update(chunk)
+                f.write(chunk)
+                file_size += len(chunk)
         app.logger.debug("success:original file saved!:{}".format(str(original_full_path)))
-        file_size = os.stat(original_full_path).st_size
 
-        make_thumbnail(path, filename)
-
-        return file_size
+        return file_size, digest.hexdigest(), read_image_info(header)
     except Exception as e:
         app.logger.debug("ERROR:failed file saving:original or thumbnail: {}".format(filename))
         app.logger.error(e)
         raise e
 
 
-def insert_basic_info(user_id, filename, filename_orig, filesize, form):
-    new_photo = Photo(user_id=user_id,
-                      filename=filename,
-                      filename_orig=filename_orig,
-                      filesize=filesize,
-                      upload_date=datetime.today(),
-                      tags=form['tags'],
-                      desc=form['desc'],
-                      geotag_lat=form['geotag_lat'],
-                      geotag_lng=form['geotag_lng'],
-                      taken_date=datetime.strptime(form['taken_date'], "%Y:%m:%d %H:%M:%S"),
-                      make=form['make'],
-                      model=form['model'],
-                      width=form['width'],
-                      height=form['height'],
-                      city=form['city'],
-                      nation=form['nation'],
-                      address=form['address'])
+def get_photo_list_version(user_id):
+    """
+    Return version of the photo list of the user, a lookup of the primary key.
+    :param user_id: user id
+    :return: int, 0 when the photos of the user never changed
+    """
+    version = db.session.query(PhotoListVersion.version).filter_by(user_id=user_id).scalar()
+    return version or 0
+
+
+def bump_photo_list_version(user_id):
+    """
+    Increase version of the photo list of the user by one in the session, commit it with the change of the photos.
+    The cached list of the user is dropped, see photo_list_cache().
+    :param user_id: user id
+    :return: None
+    """
+    bumped = PhotoListVersion.query.filter_by(user_id=user_id) \
+        .update({'version': PhotoListVersion.version + 1}, synchronize_session=False)
+    if not bumped:
+        db.session.add(PhotoListVersion(user_id, int(time.time() * 1000)))
+    cache = photo_list_cache()
+    if cache is not None:
+        cache.invalidate(user_id)
+
+
+def photo_list_cache():
+    """
+    Return the photo list cache of this process, see PhotoListCache.
+    :return: PhotoListCache, None when PHOTO_LIST_CACHE_BYTES is 0
+    """
+    if app.config['PHOTO_LIST_CACHE_BYTES'] <= 0:
+        return None
+    return get_photo_list_cache(app.config['PHOTO_LIST_CACHE_BYTES'], app.config['PHOTO_LIST_SHARED_CACHE'],
+                                app.config['PHOTO_LIST_SHARED_CACHE_TIMEOUT'])
+
+
+def find_same_content(user_id, digest):
+    """
+    Return the first photo of the user which has the same content.
+    :param user_id: user id
+    :param digest: SHA-256 hex digest of the original
+    :return: Photo or None
+    """
+    if not digest:
+        return None
+    return Photo.query.filter_by(user_id=user_id, digest=digest.lower()).order_by(Photo.id).first()
+
+
+def is_shared(user_id, filename):
+    """
+    Return True when a photo of the user still refers to the files.
+    :param user_id: user id
+    :param filename: secure filename of the original
+    :return: Boolean
+    """
+    return Photo.query.filter_by(user_id=user_id, filename=filename).count() > 0
+
+
+def make_photo(user_id, filename, filename_orig, filesize, form, digest=None, processing_state=PROCESSING_PENDING):
+    return Photo(user_id=user_id,
+                 filename=filename,
+                 filename_orig=filename_orig,
+                 filesize=filesize,
+                 upload_date=datetime.today(),
+                 tags=form['tags'],
+                 desc=form['desc'],
+                 geotag_lat=form['geotag_lat'],
+                 geotag_lng=form['geotag_lng'],
+                 taken_date=datetime.strptime(form['taken_date'], "%Y:%m:%d %H:%M:%S")
+                 if form['taken_date'] else None,
+                 make=form['make'],
+                 model=form['model'],
+                 width=form['width'],
+                 height=form['height'],
+                 city=form['city'],
+                 nation=form['nation'],
+                 address=form['address'],
+                 processing_state=processing_state,
+                 digest=digest)
+
 
+def insert_basic_info(user_id, filename, filename_orig, filesize, form, digest=None,
+                      processing_state=PROCESSING_PENDING):
+    new_photo = make_photo(user_id, filename, filename_orig, filesize, form, digest, processing_state)
     app.logger.debug('new_photo: {0}'.format(new_photo))
     db.session.add(new_photo)
+    bump_photo_list_version(user_id)
     db.session.commit()
+    return new_photo
 
 
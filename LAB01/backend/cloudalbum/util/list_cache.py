@@ -0,0 +1,164 @@
+"""
+    cloudalbum/util/list_cache.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Cache of the serialized photo list of each user.
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+
+class PhotoListCache:
+    """
+    Serialized photo lists of the users read recently, kept in memory within a budget of bytes (LRU).
+    An entry is the list of one version of the user's photo list, see get_photo_list_version(), so the list of
+    an older version is never answered, even when another process changed the photos.
+    A list made on a miss is written through to the shared backend when it is given, so the other processes
+    get it from there instead of querying again.
+    """
+
+    def __init__(self, max_bytes, shared=None, shared_timeout=0):
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.shared_timeout = shared_timeout
+        # user id to (version, serialized list)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def shared_key(user_id, version):
+        return 'photo-list:{0}:{1}'.format(user_id, version)
+
+    def get(self, user_id, version):
+        """
+        Return the serialized list of the version of the user's photo list.
+        :param user_id: user id
+        :param version: version of the list
+        :return: bytes, None on a miss
+        """
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+
+        data = self.shared.get(self.shared_key(user_id, version)) if self.shared is not None else None
+        if data is not None:
+            self.store(user_id, version, data)
+        with self.lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.shared_hits += 1
+        return data
+
+    def put(self, user_id, version, data):
+        """
+        Keep the serialized list of the version of the user's photo list, and write it to the shared backend.
+        A list larger than the whole budget is not kept.
+        :param user_id: user id
+        :param version: version of the list
+        :param data: bytes
+        :return: None
+        """
+        if len(data) > self.max_bytes:
+            return
+        self.store(user_id, version, data)
+        if self.shared is not None:
+            self.shared.set(self.shared_key(user_id, version), data, timeout=self.shared_timeout)
+
+    def store(self, user_id, version, data):
+        with self.lock:
+            self.discard(user_id)
+            self.entries[user_id] = (version, data)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def discard(self, user_id):
+        entry = self.entries.pop(user_id, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+        return entry
+
+    def invalidate(self, user_id):
+        """
+        Drop the list of the user, call it when the photos of the user are changed.
+        Lists of the older versions in the shared backend are never read again, they expire there.
+        :param user_id: user id
+        :return: None
+        """
+        with self.lock:
+            entry = self.discard(user_id)
+            if entry is not None:
+                self.invalidations += 1
+        if entry is not None and self.shared is not None:
+            self.shared.delete(self.shared_key(user_id, entry[0]))
+
+    def stats(self):
+        """
+        Return counters of the cache.
+        :return: dict
+        """
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'shared_hits': self.shared_hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'invalidations': self.invalidations}
+
+
+def make_shared_cache(url):
+    """
+    Return the shared backend of the URL, Redis ('redis://host:port/db') or files ('file:///path') which the
+    processes of a host share. Redis needs the redis package.
+    :param url: backend URL, None or '' for no shared backend
+    :return: cache with get(), set() and delete(), or None
+    """
+    if not url:
+        return None
+    try:
+        from cachelib import RedisCache, FileSystemCache
+    except ImportError:
+        # cachelib is werkzeug.contrib.cache moved out of Werkzeug 1.0.
+        from werkzeug.contrib.cache import RedisCache, FileSystemCache
+
+    parts = urlsplit(url)
+    if parts.scheme == 'redis':
+        return RedisCache(host=parts.hostname or 'localhost', port=parts.port or 6379,
+                          password=parts.password, db=int(parts.path.strip('/') or 0), default_timeout=0)
+    if parts.scheme == 'file':
+        return FileSystemCache(parts.path, default_timeout=0)
+    raise ValueError('Unsupported shared cache:{0}'.format(url))
+
+
+_cache = None
+_cache_args = None
+_cache_lock = threading.Lock()
+
+
+def get_photo_list_cache(max_bytes, shared_url=None, shared_timeout=0):
+    """
+    Return the photo list cache of this process, which is created at the first call.
+    :param max_bytes: budget of the serialized lists kept in memory
+    :param shared_url: URL of the shared backend, see make_shared_cache()
+    :param shared_timeout: seconds a list is kept in the shared backend, 0 keeps it until the backend evicts it
+    :return: PhotoListCache
+    """
+    global _cache, _cache_args
+    with _cache_lock:
+        if _cache is None or _cache_args != (max_bytes, shared_url, shared_timeout):
+            _cache = PhotoListCache(max_bytes, make_shared_cache(shared_url), shared_timeout)
+            _cache_args = (max_bytes, shared_url, shared_timeout)
+        return _cache
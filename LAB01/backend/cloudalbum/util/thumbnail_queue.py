@@ -0,0 +1,133 @@
+"""
+    cloudalbum/util/thumbnail_queue.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Background job queue which generates thumbnails of uploaded photos.
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import threading
+from flask import current_app as app
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+from cloudalbum import db
+from cloudalbum.database.models import Photo, PROCESSING_PENDING, PROCESSING_RUNNING, PROCESSING_DONE, \
+    PROCESSING_FAILED
+from cloudalbum.util.file_control import email_normalize, make_thumbnail, bump_photo_list_version
+
+
+class ThumbnailQueue:
+    """
+    Thumbnail jobs are kept in the Photo table itself (processing_state), so the queue survives restart:
+    rows left in 'pending' or 'processing' state are submitted again when the application starts.
+    Jobs run on a thread pool of THUMBNAIL_WORKERS threads, or inline in the request when it is 0.
+    """
+
+    def __init__(self, app=None):
+        self.executor = None
+        self.futures = set()
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['thumbnail_queue'] = self
+
+        with app.app_context():
+            try:
+                self.recover()
+            except Exception as e:
+                app.logger.error('ERROR:thumbnail jobs recovery failed')
+                app.logger.error(e)
+
+    def recover(self):
+        """
+        Submit again the thumbnail jobs which were not finished before restart.
+        :return: number of submitted jobs
+        """
+        photos = Photo.query.filter(Photo.processing_state.in_([PROCESSING_PENDING, PROCESSING_RUNNING])).all()
+        for photo in photos:
+            photo.processing_state = PROCESSING_PENDING
+        for user_id in set(photo.user_id for photo in photos):
+            bump_photo_list_version(user_id)
+        db.session.commit()
+
+        for photo in photos:
+            self.submit(photo.id, photo.user.email if photo.user else None)
+        if photos:
+            app.logger.info('Recovered thumbnail jobs: {0}'.format(len(photos)))
+        return len(photos)
+
+    def submit(self, photo_id, email):
+        """
+        Enqueue thumbnail job of a photo, which is already in 'pending' state.
+        :param photo_id: Photo.id
+        :param email: owner's email address, which is the folder of the photo
+        :return: None
+        """
+        if int(app.config['THUMBNAIL_WORKERS']) <= 0:
+            self.process(photo_id, email)
+            return
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=int(app.config['THUMBNAIL_WORKERS']),
+                                                   thread_name_prefix='thumbnail')
+            future = self.executor.submit(self.run, app._get_current_object(), photo_id, email)
+            self.futures.add(future)
+        future.add_done_callback(self.discard)
+
+    def discard(self, future):
+        with self.lock:
+            self.futures.discard(future)
+
+    def join(self, timeout=None):
+        """
+        Wait until every submitted job is finished.
+        :param timeout: seconds
+        :return: None
+        """
+        with self.lock:
+            futures = list(self.futures)
+        wait(futures, timeout=timeout)
+
+    def run(self, application, photo_id, email):
+        with application.app_context():
+            self.process(photo_id, email)
+
+    def process(self, photo_id, email):
+        """
+        Generate thumbnails of a photo and record the result in processing_state.
+        A job is claimed by moving the row from 'pending' to 'processing', so it runs only once.
+        :param photo_id: Photo.id
+        :param email: owner's email address
+        :return: None
+        """
+        try:
+            claimed = Photo.query.filter_by(id=photo_id, processing_state=PROCESSING_PENDING) \
+                .update({'processing_state': PROCESSING_RUNNING}, synchronize_session=False)
+            if claimed:
+                bump_photo_list_version(Photo.query.with_entities(Photo.user_id).filter_by(id=photo_id).scalar())
+            db.session.commit()
+            if not claimed:
+                app.logger.debug('thumbnail job already taken:photo_id:{0}'.format(photo_id))
+                return
+
+            photo = Photo.query.filter_by(id=photo_id).first()
+            done = False
+            if email is not None:
+                path = Path(app.config['UPLOAD_FOLDER']) / email_normalize(email)
+                done = make_thumbnail(path, photo.filename)
+
+            photo.processing_state = PROCESSING_DONE if done else PROCESSING_FAILED
+            bump_photo_list_version(photo.user_id)
+            db.session.commit()
+            app.logger.debug('thumbnail job {0}:photo_id:{1}'.format(photo.processing_state, photo_id))
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error('ERROR:thumbnail job failed:photo_id:{0}'.format(photo_id))
+            app.logger.error(e)
+
+
+thumbnail_queue = ThumbnailQueue()
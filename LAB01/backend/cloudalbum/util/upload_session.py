@@ -0,0 +1,255 @@
+"""
+    cloudalbum/util/upload_session.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Resumable upload sessions, which receive the original in numbered chunks saved as temporary files.
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import io
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+from pathlib import Path
+from flask import current_app as app
+
+# Sessions are folders in the upload folder: 'session.json' and a file per chunk received.
+SESSIONS_FOLDER = '.upload_sessions'
+SESSION_FILE = 'session.json'
+COPY_SIZE = 1024 * 1024
+
+
+def sessions_path():
+    return Path(app.config['UPLOAD_FOLDER']) / SESSIONS_FOLDER
+
+
+def chunk_name(number):
+    return '{0:06d}.chunk'.format(number)
+
+
+def max_chunks(chunk_size, max_size):
+    """
+    Return max number of chunks of a resumable upload.
+    :param chunk_size: size of a chunk (byte)
+    :param max_size: max size of the original (byte)
+    :return: int
+    """
+    return -(-max_size // chunk_size)
+
+
+def received_size(chunks, chunk_size):
+    """
+    Return size of the head of the file which is received without a gap, the client resumes from there.
+    :param chunks: list of (chunk number, size) sorted by chunk number, numbers start from 1
+    :param chunk_size: size of a chunk (byte)
+    :return: offset (byte)
+    """
+    size = 0
+    for expected, (number, chunk_len) in enumerate(chunks, 1):
+        if number != expected:
+            break
+        size += chunk_len
+        if chunk_len < chunk_size:
+            break
+    return size
+
+
+def check_chunks(chunks, chunk_size):
+    """
+    Check the chunks make up the whole file, numbered from 1 without a gap and of chunk_size except the last one.
+    :param chunks: list of (chunk number, size) sorted by chunk number
+    :param chunk_size: size of a chunk (byte)
+    :return: file size (byte)
+    :raise ValueError: when a chunk is missing or of a wrong size
+    """
+    if not chunks:
+        raise ValueError('No chunk is received')
+    for expected, (number, chunk_len) in enumerate(chunks, 1):
+        if number != expected:
+            raise ValueError('Chunk {0} is missing'.format(expected))
+        if chunk_len != chunk_size and expected != len(chunks):
+            raise ValueError('Chunk {0} is {1} bytes, not {2}'.format(number, chunk_len, chunk_size))
+    return sum(chunk_len for _, chunk_len in chunks)
+
+
+def create_session(user_id, filename_orig):
+    """
+    Start a resumable upload. Stale sessions are removed on the way, see collect_stale_sessions().
+    :param user_id: user id
+    :param filename_orig: file name on the client
+    :return: session id
+    """
+    maybe_collect_stale_sessions()
+    session_id = uuid.uuid4().hex
+    path = sessions_path() / session_id
+    path.mkdir(parents=True)
+    (path / SESSION_FILE).write_text(json.dumps({'user_id': user_id, 'filename_orig': filename_orig,
+                                                 'chunk_size': app.config['UPLOAD_SESSION_CHUNK_SIZE']}))
+    app.logger.debug('success:upload session created:{0}'.format(str(path)))
+    return session_id
+
+
+def open_session(user_id, session_id):
+    """
+    Return the session of the user.
+    :param user_id: user id
+    :param session_id: session id, see create_session()
+    :return: (pathlib.Path of the session folder, dict of 'user_id', 'filename_orig' and 'chunk_size')
+    :raise FileNotFoundError: when the session is finished, removed, or of another user
+    """
+    try:
+        valid = uuid.UUID(session_id).hex == session_id
+    except ValueError:
+        valid = False
+    path = sessions_path() / session_id
+    if not valid:
+        raise FileNotFoundError(str(path))
+    session = json.loads((path / SESSION_FILE).read_text())
+    if session['user_id'] != user_id:
+        raise FileNotFoundError(str(path))
+    return path, session
+
+
+def write_chunk(user_id, session_id, number, stream):
+    """
+    Save a chunk of the session from the stream, a chunk received before is replaced.
+    The chunk is written to a temporary file and renamed, so a broken transfer never leaves a partial chunk.
+    :param user_id: user id
+    :param session_id: session id, see create_session()
+    :param number: chunk number, starts from 1
+    :param stream: file like object of the chunk
+    :return: size of the chunk (byte)
+    :raise FileNotFoundError: when the session is finished, removed, or of another user
+    :raise ValueError: when the chunk is empty or larger than the chunk size of the session
+    """
+    path, session = open_session(user_id, session_id)
+    temp_path = path / '{0}.{1}.tmp'.format(chunk_name(number), uuid.uuid4().hex)
+    size = 0
+    try:
+        with temp_path.open('wb') as f:
+            for data in iter(lambda: stream.read(COPY_SIZE), b''):
+                size += len(data)
+                if size > session['chunk_size']:
+                    raise ValueError('Chunk is larger than {0} bytes'.format(session['chunk_size']))
+                f.write(data)
+        if size == 0:
+            raise ValueError('Chunk is empty')
+        os.replace(str(temp_path), str(path / chunk_name(number)))
+        return size
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+def list_chunks(user_id, session_id):
+    """
+    Return the chunks which the session received.
+    :param user_id: user id
+    :param session_id: session id, see create_session()
+    :return: list of (chunk number, size) sorted by chunk number
+    :raise FileNotFoundError: when the session is finished, removed, or of another user
+    """
+    path, _ = open_session(user_id, session_id)
+    return sorted((int(chunk.name.split('.')[0]), chunk.stat().st_size) for chunk in path.glob('*.chunk'))
+
+
+class ChunksReader(io.RawIOBase):
+    """
+    Read the chunk files one after another as one file, so the original is not copied once more to be assembled.
+    """
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.current = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while True:
+            if self.current is None:
+                if not self.paths:
+                    return 0
+                self.current = self.paths.pop(0).open('rb')
+            size = self.current.readinto(b)
+            if size:
+                return size
+            self.current.close()
+            self.current = None
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+            self.current = None
+        super().close()
+
+
+def open_chunks(user_id, session_id, chunks):
+    """
+    Open the chunks of the session as the whole original.
+    :param user_id: user id
+    :param session_id: session id, see create_session()
+    :param chunks: list of (chunk number, size), see check_chunks()
+    :return: file like object
+    """
+    path, _ = open_session(user_id, session_id)
+    return io.BufferedReader(ChunksReader(path / chunk_name(number) for number, _ in chunks))
+
+
+def delete_session(session_id):
+    """
+    Remove the session folder with the chunks received.
+    :param session_id: session id, see create_session()
+    :return: None
+    """
+    shutil.rmtree(str(sessions_path() / session_id), ignore_errors=True)
+
+
+def collect_stale_sessions(max_age):
+    """
+    Remove the sessions which received nothing for max_age seconds.
+    :param max_age: seconds
+    :return: number of removed sessions
+    """
+    path = sessions_path()
+    if not path.exists():
+        return 0
+    expired = time.time() - max_age
+    removed = 0
+    for session_path in path.iterdir():
+        try:
+            # A chunk saved in the session folder updates its modification time.
+            if session_path.stat().st_mtime >= expired:
+                continue
+        except FileNotFoundError:
+            continue
+        shutil.rmtree(str(session_path), ignore_errors=True)
+        removed += 1
+    return removed
+
+
+_last_collected = 0
+_collect_lock = threading.Lock()
+
+
+def maybe_collect_stale_sessions():
+    """
+    Run collect_stale_sessions() for UPLOAD_SESSION_EXPIRE_TIME, at most once per UPLOAD_SESSION_GC_INTERVAL
+    in the process. A failure is logged only, the next interval tries again.
+    :return: None
+    """
+    global _last_collected
+    interval = app.config['UPLOAD_SESSION_GC_INTERVAL']
+    with _collect_lock:
+        if interval <= 0 or time.time() - _last_collected < interval:
+            return
+        _last_collected = time.time()
+    try:
+        removed = collect_stale_sessions(app.config['UPLOAD_SESSION_EXPIRE_TIME'])
+        app.logger.debug('success:{0} stale upload sessions removed'.format(removed))
+    except Exception as e:
+        app.logger.error('ERROR:collecting stale upload sessions failed:{0}'.format(e))
@@ -1,6 +1,8 @@
 import service from '@/service';
 import { SET_ALL_PHOTO_LIST, DELETE_ONE_PHOTO, SET_IS_LOADING } from '@/vuex/mutation-types';
 
+const THUMBNAIL_PLACEHOLDER = 'http://placehold.it/300x200';
+
 const setIsLoading = ({ commit }, data) => {
   commit(SET_IS_LOADING, data);
 };
@@ -36,6 +38,10 @@ const getAllPhotoList = async (store) => {
     } else {
       console.log(resp.data);
       photoList = await Promise.all(resp.data.photos.map(async (obj) => {
+        // Thumbnail is still being made (or failed) in the background.
+        if (obj.processing_state && obj.processing_state !== 'done') {
+          return { ...obj, thumbSrc: THUMBNAIL_PLACEHOLDER };
+        }
         const thumbnailBlobUrl = await buildImgSrc(obj.id, 'thumbnail');
         return { ...obj, thumbSrc: thumbnailBlobUrl };
       }));
@@ -7,10 +7,12 @@
     :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
     :license: MIT, see LICENSE for more details.
 """
+import hashlib
 import os
-import uuid
 from pathlib import Path
-from flask import Blueprint, request, make_response
+from functools import partial
+from itertools import chain
+from flask import Blueprint, request, make_response, Response, stream_with_context, json
 from flask import current_app as app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask_restplus import Api, Resource, fields
@@ -18,9 +20,15 @@ from pynamodb.exceptions import PynamoDBException
 from werkzeug.datastructures import FileStorage
 from werkzeug.exceptions import BadRequest, InternalServerError
 from werkzeug.utils import secure_filename
-from cloudalbum.database.model_ddb import Photo, photo_deserialize
+from cloudalbum.database.model_ddb import Photo, PHOTO_JSON_PLAN, query_photo_page, query_photos, \
+    next_page_cursor, decode_cursor, PHOTO_LIST_ATTRIBUTES, PHOTO_LIST_ORDERS, get_photo_list_version, \
+    bump_photo_list_version, new_photo_id, parse_list_dates
 from cloudalbum.solution import solution_put_photo_info_ddb, solution_delete_photo_from_ddb
-from cloudalbum.util.file_control import email_normalize, delete, save
+from cloudalbum.util.exif import apply_image_info
+from cloudalbum.util.json_stream import batched, iter_json_object
+from cloudalbum.util.serializer import dumps
+from cloudalbum.util.file_control import email_normalize, delete, save, sized_rendition
+from cloudalbum.util.rendition import FITS
 
 authorizations = {
     'Bearer Auth': {
@@ -58,8 +66,23 @@ photo_info = api.model('New_photo', {
     'address': fields.String
 })
 
+# 'list' returns PHOTO_LIST_ATTRIBUTES of the photos, 'full' every attribute.
+PHOTO_LIST_VIEWS = ['list', 'full']
+
+photo_list_parser = api.parser()
+photo_list_parser.add_argument('limit', type=int, location='args', default=0)
+photo_list_parser.add_argument('cursor', type=str, location='args')
+photo_list_parser.add_argument('view', type=str, location='args', choices=PHOTO_LIST_VIEWS, default='list')
+photo_list_parser.add_argument('order', type=str, location='args', choices=PHOTO_LIST_ORDERS,
+                               default=PHOTO_LIST_ORDERS[0])
+photo_list_parser.add_argument('since', type=str, location='args')
+photo_list_parser.add_argument('until', type=str, location='args')
+
 photo_get_parser = api.parser()
 photo_get_parser.add_argument('mode', type=str, location='args')
+photo_get_parser.add_argument('w', type=int, location='args', default=0)
+photo_get_parser.add_argument('h', type=int, location='args', default=0)
+photo_get_parser.add_argument('fit', type=str, location='args', choices=FITS, default='contain')
 
 file_upload_parser = api.parser()
 file_upload_parser.add_argument('file', location='files', type=FileStorage, required=True)
@@ -77,6 +100,97 @@ file_upload_parser.add_argument('address', type=str, location='form')
 file_upload_parser.add_argument('nation', type=str, location='form')
 
 
+def page_args(args):
+    """
+    Return limit and cursor of a photo list request.
+    :param args: parsed photo_list_parser
+    :return: (limit, None for the whole list, cursor)
+    :raise BadRequest: when the limit is out of range or the cursor is broken or of another order
+    """
+    limit = args['limit'] or app.config['PHOTO_LIST_DEFAULT_LIMIT']
+    if limit < 0 or limit > app.config['PHOTO_LIST_MAX_LIMIT']:
+        raise BadRequest('Invalid limit:{0}'.format(limit))
+    try:
+        if args['cursor']:
+            decode_cursor(args['cursor'], args['order'])
+    except ValueError:
+        raise BadRequest('Invalid cursor:{0}'.format(args['cursor']))
+    return limit or None, args['cursor']
+
+
+def date_range_args(args):
+    """
+    Return since and until of a photo list request, see parse_list_dates().
+    :param args: parsed photo_list_parser
+    :return: (since, until), datetime or None each
+    :raise BadRequest: when a date is broken, or the taken_date order is asked while PHOTO_TAKEN_DATE_INDEX is off
+    """
+    if args['order'] == 'taken_date' and not app.config['PHOTO_TAKEN_DATE_INDEX']:
+        raise BadRequest('Unsupported order:{0}'.format(args['order']))
+    try:
+        return parse_list_dates(args['since'], args['until'])
+    except ValueError as e:
+        raise BadRequest('Invalid date range: {0}'.format(e))
+
+
+def photo_list_etag(user_id, limit, cursor, view, order=PHOTO_LIST_ORDERS[0], since=None, until=None):
+    """
+    Return ETag of a photo list response, made of the list version of the user and the request.
+    The version is read before the query, so a change during the query is seen by the next request.
+    :param user_id: user id
+    :param limit: limit of page_args()
+    :param cursor: cursor of page_args()
+    :param view: one of PHOTO_LIST_VIEWS
+    :param order: one of PHOTO_LIST_ORDERS
+    :param since: since of the request as it is given
+    :param until: until of the request as it is given
+    :return: string, None when PHOTO_LIST_ETAG is off
+    """
+    if not app.config['PHOTO_LIST_ETAG']:
+        return None
+    version = get_photo_list_version(user_id)
+    request_key = json.dumps([user_id, limit, cursor, view, order, since, until])
+    return '{0}-{1}'.format(version, hashlib.sha1(request_key.encode('utf-8')).hexdigest()[:16])
+
+
+def with_etag(response, etag):
+    """
+    Set the ETag on the response, the browser revalidates it on every request.
+    :param response: Response
+    :param etag: string, the response is left as it is when it is None
+    :return: response
+    """
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def stream_photo_list(results, to_json):
+    """
+    Return response of the photo list written batch by batch of PHOTO_LIST_STREAM_BATCH photos, while
+    DynamoDB pages are read. An error after the first batch cuts the response short, it never looks complete.
+    :param results: iterator of query_photos()
+    :param to_json: function which returns list of dict of a list of Photo
+    :return: streaming Response
+    """
+    batches = (to_json(batch) for batch in batched(results, app.config['PHOTO_LIST_STREAM_BATCH']))
+    # The first batch is read here, so an error of the query is still answered with the status code.
+    first = next(batches, [])
+
+    def generate():
+        try:
+            yield from iter_json_object({'ok': True}, 'photos', chain([first], batches),
+                                        lambda: {'next_cursor': next_page_cursor(results)},
+                                        partial(dumps, fast=app.config['PHOTO_LIST_ORJSON']))
+        except Exception as e:
+            app.logger.error('Photos list streaming failed')
+            app.logger.error(e)
+            raise
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
 @api.route('/ping')
 @api.doc('photos ping!')
 class Ping(Resource):
@@ -102,12 +216,15 @@ class FileUpload(Resource):
             raise BadRequest('File format is not supported:{0}'.format(filename_orig))
 
         try:
-            filename = secure_filename("{0}.{1}".format(uuid.uuid4(), extension))
-            filesize = save(form['file'], filename, current_user['email'])
+            filename = secure_filename("{0}.{1}".format(new_photo_id(), extension))
+            filesize, image_info = save(form['file'], filename, current_user['email'])
+            # Photo information of the image itself, the client does not need to parse EXIF.
+            apply_image_info(form, image_info)
             user_id = current_user['user_id']
 
             # TODO 3: Implement following solution code to put item into Photo table of DynamoDB
             solution_put_photo_info_ddb(user_id, filename, form, filesize)
+            bump_photo_list_version(user_id)
 
             return make_response({'ok': True}, 200)
         except Exception as e:
@@ -120,17 +237,53 @@ class List(Resource):
     @api.doc(
         responses=
         {
-            200: 'Return the whole photos list',
+            200: 'Return the photos list',
+            304: 'Photos list is not changed',
+            400: 'Invalid limit, cursor, order or dates',
             500: 'Internal server error',
         }
     )
     @jwt_required
+    @api.expect(photo_list_parser)
     def get(self):
-        """Get all photos as list"""
+        """
+        Get photos as list, a page of them when limit is given.
+        :queryparam limit: max number of photos of the page, up to PHOTO_LIST_MAX_LIMIT
+        :queryparam cursor: next_cursor of the previous page
+        :queryparam view: list(default) or full, see PHOTO_LIST_VIEWS
+        :queryparam order: upload_date(default) or taken_date, newest first, see PHOTO_LIST_ORDERS.
+                           taken_date leaves out the photos without taken_date
+        :queryparam since: the earliest date of the order, e.g. 2019, 2019-07, 2019-07-15 or 2019-07-15T09:46:46
+        :queryparam until: the latest date of the order, the whole period of it, e.g. 2019 is until the end of 2019
+        :header If-None-Match: ETag of the list the client has, 304 is returned when the list is not changed
+        :return: photos and next_cursor, which is None on the last page, streamed when PHOTO_LIST_STREAM is on
+        """
+        args = photo_list_parser.parse_args()
+        limit, cursor = page_args(args)
+        since, until = date_range_args(args)
         try:
-            photos = [photo_deserialize(photo) for photo in Photo.query(get_jwt_identity()['user_id'])]
+            user_id = get_jwt_identity()['user_id']
+            # The list view reads its attributes from the list index, the full view reads the whole items.
+            attributes = None if args['view'] == 'full' else PHOTO_LIST_ATTRIBUTES
+            etag = photo_list_etag(user_id, limit, cursor, args['view'], args['order'],
+                                   args['since'], args['until'])
+            if etag and request.if_none_match.contains_weak(etag):
+                return with_etag(make_response('', 304), etag)
+            # The list index is read eventually consistent only, so it may be older than the version of the ETag.
+            # A list with ETag reads the table, or the local taken_date index, strongly consistent in place of it.
+            consistent = etag is not None
+            index = Photo.list_index if attributes and app.config['PHOTO_LIST_INDEX'] and not consistent else None
+            if app.config['PHOTO_LIST_STREAM']:
+                results = query_photos(user_id, limit, cursor, attributes, index, args['order'], since, until,
+                                       consistent)
+                return with_etag(stream_photo_list(results, PHOTO_JSON_PLAN.only(attributes).many), etag)
+            photos, next_cursor = query_photo_page(user_id, limit, cursor, attributes, index,
+                                                   args['order'], since, until, consistent)
+            photos = PHOTO_JSON_PLAN.only(attributes).many(photos)
             app.logger.debug('success:photos_list: {}'.format(photos))
-            return make_response({'ok': True, 'photos': photos}, 200)
+            data = dumps({'ok': True, 'photos': photos, 'next_cursor': next_cursor},
+                         app.config['PHOTO_LIST_ORJSON'])
+            return with_etag(Response(data, mimetype='application/json'), etag)
 
         except Exception as e:
             app.logger.error('Photos list retrieving failed')
@@ -156,6 +309,7 @@ class OnePhoto(Resource):
         try:
             # TODO 4: Implement following solution code to delete a photo from Photos which is a list
             filename = solution_delete_photo_from_ddb(user, photo_id)
+            bump_photo_list_version(user['user_id'])
             file_deleted = delete(filename, user['email'])
 
             if file_deleted:
@@ -185,8 +339,14 @@ class OnePhoto(Resource):
         Return image for thumbnail and original photo.
         :param photo_id: target photo id
         :queryparam mode: None(original) or thumbnail
+        :queryparam w: width of a sized rendition, made on demand
+        :queryparam h: height of a sized rendition
+        :queryparam fit: contain(default) or cover, see FITS
         :return: image url for authenticated user
         """
+        args = photo_get_parser.parse_args()
+        if args['w'] < 0 or args['h'] < 0:
+            raise BadRequest('Invalid size:{0}x{1}'.format(args['w'], args['h']))
         try:
             mode = request.args.get('mode')
             user = get_jwt_identity()
@@ -196,7 +356,9 @@ class OnePhoto(Resource):
             photo = Photo.get(user['user_id'], range_key=photo_id)
 
             if photo.id == photo_id:
-                if mode == 'thumbnail':
+                if args['w'] or args['h']:
+                    full_path = sized_rendition(email, photo.filename, (args['w'], args['h']), args['fit'])
+                elif mode == 'thumbnail':
                     full_path = full_path / 'thumbnails' / photo.filename
                 else:
                     full_path = full_path / photo.filename
@@ -29,12 +29,48 @@ class BaseConfig:
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', os.path.join(os.getcwd(), '/tmp'))
     THUMBNAIL_WIDTH = os.getenv('THUMBNAIL_WIDTH', 300)
     THUMBNAIL_HEIGHT = os.getenv('THUMBNAIL_HEIGHT', 200)
+    # Renditions made from each upload, comma separated 'name:WIDTHxHEIGHT' (e.g. 'retina:600x400').
+    # A rendition is stored in the folder named after it, 'thumbnails' is the photo grid thumbnail.
+    THUMBNAIL_RENDITIONS = os.getenv('THUMBNAIL_RENDITIONS',
+                                     'thumbnails:{0}x{1}'.format(THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT))
+    # Processes making renditions, 0 makes them in the calling thread. Original image is handed over by shared
+    # memory, and at most THUMBNAIL_PROCESS_QUEUE images are submitted at once, further uploads wait for a slot.
+    THUMBNAIL_PROCESSES = int(os.getenv('THUMBNAIL_PROCESSES', '0'))
+    THUMBNAIL_PROCESS_QUEUE = int(os.getenv('THUMBNAIL_PROCESS_QUEUE', '16'))
+    # Sized renditions are made on demand by GET /photos/<id>?w=&h=&fit=, each edge rounded up to one of
+    # RENDITION_SIZES to bound the renditions per photo. They are made from a mezzanine decode of at most
+    # RENDITION_MEZZANINE_SIZE pixels, and mezzanines of the last RENDITION_MEZZANINE_CACHE photos are kept in memory.
+    RENDITION_SIZES = os.getenv('RENDITION_SIZES', '160,320,640,1280')
+    RENDITION_MEZZANINE_SIZE = int(os.getenv('RENDITION_MEZZANINE_SIZE', '2048'))
+    RENDITION_MEZZANINE_CACHE = int(os.getenv('RENDITION_MEZZANINE_CACHE', '8'))
 
     AWS_REGION = Session().region_name if environ.get('AWS_REGION') is None else environ.get('AWS_REGION')
 
     # DynamoDB
     DDB_RCU = int(os.getenv('DDB_RCU', '10'))
     DDB_WCU = int(os.getenv('DDB_WCU', '10'))
+    # Photo list returns pages of 'limit' photos when it is given, PHOTO_LIST_DEFAULT_LIMIT otherwise,
+    # 0 returns the whole list at once.
+    PHOTO_LIST_DEFAULT_LIMIT = int(os.getenv('PHOTO_LIST_DEFAULT_LIMIT', '0'))
+    PHOTO_LIST_MAX_LIMIT = int(os.getenv('PHOTO_LIST_MAX_LIMIT', '1000'))
+    # Photo list without ETag reads the 'photo-list-index' of the Photo table, which has the list attributes only.
+    # It is turned off at startup when the Photo table has not the index, the list reads the table then.
+    PHOTO_LIST_INDEX = os.getenv('PHOTO_LIST_INDEX', 'True') == 'True'
+    # Photo list in the taken_date order reads the 'photo-taken-date-index' of the Photo table. DynamoDB makes a
+    # local secondary index only with a new table, it is turned off at startup for a table created before it,
+    # which answers 400 then.
+    PHOTO_TAKEN_DATE_INDEX = os.getenv('PHOTO_TAKEN_DATE_INDEX', 'True') == 'True'
+    # Photo list is streamed batch by batch of PHOTO_LIST_STREAM_BATCH photos while it is read, so the first byte
+    # and the memory do not wait for the whole list.
+    PHOTO_LIST_STREAM = os.getenv('PHOTO_LIST_STREAM', 'False') == 'True'
+    PHOTO_LIST_STREAM_BATCH = int(os.getenv('PHOTO_LIST_STREAM_BATCH', '100'))
+    # Photo list answers ETag of the list version of the user, the same If-None-Match gets 304 after reading
+    # the version only.
+    # A list with ETag reads the table strongly consistent in place of the list index, which is read
+    # eventually consistent only and may be older than the version, see PHOTO_LIST_INDEX.
+    PHOTO_LIST_ETAG = os.getenv('PHOTO_LIST_ETAG', 'True') == 'True'
+    # Photo list is encoded by orjson when it is installed, otherwise by json of the standard library.
+    PHOTO_LIST_ORJSON = os.getenv('PHOTO_LIST_ORJSON', 'True') == 'True'
 
 
 class DevelopmentConfig(BaseConfig):
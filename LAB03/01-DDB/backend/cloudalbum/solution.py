@@ -52,7 +52,8 @@ def solution_put_photo_info_ddb(user_id, filename, form, filesize):
           desc=form['desc'],
           geotag_lat=form['geotag_lat'],
           geotag_lng=form['geotag_lng'],
-          taken_date=datetime.strptime(form['taken_date'], "%Y:%m:%d %H:%M:%S"),
+          taken_date=datetime.strptime(form['taken_date'], "%Y:%m:%d %H:%M:%S")
+          if form['taken_date'] else None,
           make=form['make'],
           model=form['model'],
           width=form['width'],
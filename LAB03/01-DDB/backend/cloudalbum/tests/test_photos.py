@@ -10,8 +10,9 @@
 import unittest
 import pytest
 from io import BytesIO
+from PIL import Image
 from cloudalbum.tests.base import BaseTestCase
-from cloudalbum.database.model_ddb import Photo
+from cloudalbum.database.model_ddb import Photo, is_photo_id
 from flask_jwt_extended import create_access_token
 
 for_user_token = {
@@ -76,6 +77,180 @@ class TestPhotoService(BaseTestCase):
         )
         self.assert200(response)
 
+    def test_list_pages(self):
+        """Ensure the /photos/?limit=&cursor= returns the whole list page by page."""
+        for _ in range(3):
+            upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+            response = self.client.post(
+                '/photos/file',
+                headers=self.test_header,
+                content_type='multipart/form-data',
+                data=upload
+            )
+            self.assert200(response)
+        response = self.client.get('/photos/', headers=self.test_header)
+        self.assert200(response)
+        self.assertIsNone(response.get_json()['next_cursor'])
+        photo_ids = [photo['id'] for photo in response.get_json()['photos']]
+
+        paged_ids = []
+        query = {'limit': 2}
+        while True:
+            response = self.client.get('/photos/', headers=self.test_header, query_string=query)
+            self.assert200(response)
+            self.assertLessEqual(len(response.get_json()['photos']), 2)
+            paged_ids.extend(photo['id'] for photo in response.get_json()['photos'])
+            if not response.get_json()['next_cursor']:
+                break
+            query['cursor'] = response.get_json()['next_cursor']
+        self.assertEqual(paged_ids, photo_ids)
+
+        for query in [{'limit': -1}, {'limit': 100000}, {'limit': 2, 'cursor': '%%%'}]:
+            response = self.client.get('/photos/', headers=self.test_header, query_string=query)
+            self.assert400(response)
+
+    def test_list_order(self):
+        """Ensure the /photos/?order=&since=&until= returns the photos newest first in the order, within the dates."""
+        for _ in range(3):
+            upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+            response = self.client.post(
+                '/photos/file',
+                headers=self.test_header,
+                content_type='multipart/form-data',
+                data=upload
+            )
+            self.assert200(response)
+        response = self.client.get('/photos/', headers=self.test_header)
+        self.assert200(response)
+        photo_ids = [photo['id'] for photo in response.get_json()['photos']]
+        self.assertEqual(photo_ids, sorted(photo_ids, reverse=True))
+        self.assertTrue(all(is_photo_id(photo_id) for photo_id in photo_ids))
+
+        for query, expected in [({'since': '2000'}, photo_ids), ({'since': '2999'}, []),
+                                ({'order': 'taken_date', 'since': '2012-07', 'until': '2012-07'}, photo_ids),
+                                ({'order': 'taken_date', 'until': '2012-07-14'}, [])]:
+            response = self.client.get('/photos/', headers=self.test_header, query_string=query)
+            self.assert200(response)
+            self.assertEqual(sorted(photo['id'] for photo in response.get_json()['photos']), sorted(expected))
+
+        paged_ids = []
+        query = {'order': 'taken_date', 'limit': 2}
+        while True:
+            response = self.client.get('/photos/', headers=self.test_header, query_string=query)
+            self.assert200(response)
+            paged_ids.extend(photo['id'] for photo in response.get_json()['photos'])
+            if not response.get_json()['next_cursor']:
+                break
+            query['cursor'] = response.get_json()['next_cursor']
+        self.assertEqual(sorted(paged_ids), sorted(photo_ids))
+
+        response = self.client.get('/photos/', headers=self.test_header, query_string={'limit': 1})
+        cursor = response.get_json()['next_cursor']
+        for query in [{'since': 'x'}, {'since': '2020', 'until': '2019'}, {'order': 'name'},
+                      {'order': 'taken_date', 'limit': 1, 'cursor': cursor}]:
+            response = self.client.get('/photos/', headers=self.test_header, query_string=query)
+            self.assert400(response)
+        self.app.config['PHOTO_TAKEN_DATE_INDEX'] = False
+        try:
+            response = self.client.get('/photos/', headers=self.test_header, query_string={'order': 'taken_date'})
+            self.assert400(response)
+        finally:
+            self.app.config['PHOTO_TAKEN_DATE_INDEX'] = True
+
+    def test_list_stream(self):
+        """Ensure the /photos/ streams the same list batch by batch when PHOTO_LIST_STREAM is on."""
+        for _ in range(3):
+            upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+            response = self.client.post(
+                '/photos/file',
+                headers=self.test_header,
+                content_type='multipart/form-data',
+                data=upload
+            )
+            self.assert200(response)
+        response = self.client.get('/photos/', headers=self.test_header, query_string={'limit': 3})
+        self.assert200(response)
+        expected = response.get_json()
+
+        self.app.config.update(PHOTO_LIST_STREAM=True, PHOTO_LIST_STREAM_BATCH=2)
+        try:
+            response = self.client.get('/photos/', headers=self.test_header, query_string={'limit': 3})
+        finally:
+            self.app.config.update(PHOTO_LIST_STREAM=False, PHOTO_LIST_STREAM_BATCH=100)
+        self.assert200(response)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual([photo['id'] for photo in response.get_json()['photos']],
+                         [photo['id'] for photo in expected['photos']])
+        self.assertEqual(response.get_json()['next_cursor'], expected['next_cursor'])
+
+    def test_list_view(self):
+        """Ensure the /photos/ returns the list attributes only unless view=full is given."""
+        upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+        response = self.client.post(
+            '/photos/file',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=upload
+        )
+        self.assert200(response)
+        photo_id = [item.id for item in Photo.scan(Photo.filename_orig.startswith('test_image.jpg'), limit=1)][0]
+
+        # Reads the table, the list index is updated asynchronously.
+        self.app.config['PHOTO_LIST_INDEX'] = False
+        try:
+            views = {}
+            for view in ['list', 'full']:
+                response = self.client.get('/photos/', headers=self.test_header, query_string={'view': view})
+                self.assert200(response)
+                views[view] = next(photo for photo in response.get_json()['photos'] if photo['id'] == photo_id)
+        finally:
+            self.app.config['PHOTO_LIST_INDEX'] = True
+        self.assertEqual(views['list']['address'], upload['address'])
+        self.assertNotIn('make', views['list'])
+        self.assertEqual(views['full']['make'], upload['make'])
+
+        response = self.client.get('/photos/', headers=self.test_header, query_string={'view': 'grid'})
+        self.assert400(response)
+
+    def test_list_etag(self):
+        """Ensure the default /photos/ returns 304 for the ETag of the list until a photo is uploaded or deleted."""
+        response = self.client.get('/photos/', headers=self.test_header)
+        self.assert200(response)
+        etag = response.headers['ETag']
+        headers = dict(self.test_header, **{'If-None-Match': etag})
+        response = self.client.get('/photos/', headers=headers)
+        self.assertStatus(response, 304)
+        response = self.client.get('/photos/', headers=headers, query_string={'view': 'full'})
+        self.assert200(response)
+
+        upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+        response = self.client.post(
+            '/photos/file',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=upload
+        )
+        self.assert200(response)
+        photo_id = [item.id for item in Photo.scan(Photo.filename_orig.startswith('test_image.jpg'), limit=1)][0]
+        response = self.client.get('/photos/', headers=headers)
+        self.assert200(response)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        headers['If-None-Match'] = response.headers['ETag']
+        response = self.client.delete('/photos/{}'.format(photo_id), headers=self.test_header)
+        self.assert200(response)
+        response = self.client.get('/photos/', headers=headers)
+        self.assert200(response)
+
+        # Without ETag the list reads the list index.
+        self.app.config['PHOTO_LIST_ETAG'] = False
+        try:
+            response = self.client.get('/photos/', headers=headers)
+            self.assert200(response)
+            self.assertNotIn('ETag', response.headers)
+        finally:
+            self.app.config['PHOTO_LIST_ETAG'] = True
+
     def test_delete(self):
         """Ensure the /photos/<photo_id> route behaves correctly."""
         # 1. upload
@@ -127,6 +302,34 @@ class TestPhotoService(BaseTestCase):
         )
         self.assert200(response)
 
+    def test_get_sized(self):
+        """Ensure the /photos/<photo_id>?w=&h=&fit= makes a rendition of the size rounded up to RENDITION_SIZES."""
+        original = BytesIO()
+        Image.new('RGB', (1200, 800), (120, 80, 40)).save(original, 'JPEG')
+        original.seek(0)
+        upload['file'] = (original, 'test_image.jpg')
+        response = self.client.post(
+            '/photos/file',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=upload
+        )
+        self.assert200(response)
+        photo_id = [item.id for item in Photo.scan(Photo.filename_orig.startswith('test_image.jpg'), limit=1)][0]
+
+        for query, size in [({'w': 300}, (320, 213)), ({'w': 100, 'h': 100, 'fit': 'cover'}, (160, 160))]:
+            response = self.client.get(
+                '/photos/{}'.format(photo_id),
+                headers=self.test_header,
+                query_string=query
+            )
+            self.assert200(response)
+            self.assertEqual(Image.open(BytesIO(response.data)).size, size)
+
+        response = self.client.get('/photos/{}'.format(photo_id), headers=self.test_header,
+                                   query_string={'w': 100, 'fit': 'stretch'})
+        self.assert400(response)
+
 
 if __name__ == '__main__':
     unittest.main()
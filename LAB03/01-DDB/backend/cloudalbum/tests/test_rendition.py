@@ -0,0 +1,154 @@
+"""
+    cloudalbum/tests/test_rendition.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Test cases for thumbnail renditions
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import time
+import unittest
+import threading
+from io import BytesIO
+from PIL import Image
+from cloudalbum.util.rendition import parse_renditions, make_renditions, RenditionPool, supported_formats, \
+    rendition_path, best_format, parse_sizes, quantize_size, sized_rendition_path, RenditionCache, \
+    MemoryReader
+
+
+class TestRendition(unittest.TestCase):
+    """Tests for the rendition engine."""
+
+    def test_parse_renditions(self):
+        """Ensure renditions are parsed from configuration value, largest first."""
+        renditions = parse_renditions('thumbnails:300x200, lightbox:1280x960,retina:600X400,')
+        self.assertEqual(renditions, [('lightbox', (1280, 960)), ('retina', (600, 400)), ('thumbnails', (300, 200))])
+
+    def test_make_renditions(self):
+        """Ensure every rendition is made from a JPEG, fitting in its box."""
+        original = BytesIO()
+        Image.new('RGB', (4000, 3000), (120, 80, 40)).save(original, 'JPEG')
+        original.seek(0)
+
+        result = make_renditions(original, parse_renditions('thumbnails:300x200,retina:600x400,lightbox:1280x960'))
+
+        self.assertEqual(sorted(result.keys()), ['lightbox', 'retina', 'thumbnails'])
+        self.assertEqual(Image.open(BytesIO(result['thumbnails'])).size, (267, 200))
+        self.assertEqual(Image.open(BytesIO(result['retina'])).size, (533, 400))
+        self.assertEqual(Image.open(BytesIO(result['lightbox'])).size, (1280, 960))
+        self.assertEqual(Image.open(BytesIO(result['lightbox'])).format, 'JPEG')
+
+    @unittest.skipUnless(supported_formats('webp'), 'Pillow is built without WebP')
+    def test_make_renditions_formats(self):
+        """Ensure each rendition is also encoded in the extra formats, under sibling keys."""
+        original = BytesIO()
+        Image.new('RGB', (1600, 1200), (120, 80, 40)).save(original, 'JPEG')
+        original.seek(0)
+
+        result = make_renditions(original, parse_renditions('thumbnails:300x200'), formats=['webp'])
+
+        self.assertEqual(sorted(result.keys()), ['thumbnails', 'thumbnails.webp'])
+        self.assertEqual(Image.open(BytesIO(result['thumbnails.webp'])).format, 'WEBP')
+        self.assertEqual(Image.open(BytesIO(result['thumbnails.webp'])).size, (267, 200))
+
+    def test_rendition_path(self):
+        """Ensure files of the extra formats are siblings of the JPEG rendition."""
+        self.assertEqual(rendition_path('thumbnails', 'a.jpg'), 'thumbnails/a.jpg')
+        self.assertEqual(rendition_path('thumbnails.webp', 'a.jpg'), 'thumbnails/a.jpg.webp')
+
+    def test_best_format(self):
+        """Ensure the smallest format listed in the Accept header is picked, falling back to JPEG."""
+        chrome = 'image/avif,image/webp,image/apng,image/*,*/*;q=0.8'
+        self.assertEqual(best_format(chrome, ['webp', 'avif']), 'avif')
+        self.assertEqual(best_format(chrome, ['webp']), 'webp')
+        self.assertEqual(best_format('*/*', ['webp', 'avif']), 'jpeg')
+        self.assertEqual(best_format('image/webp;q=0, */*', ['webp']), 'jpeg')
+        self.assertEqual(best_format(None, ['webp']), 'jpeg')
+
+    def test_quantize_size(self):
+        """Ensure requested sizes are rounded up to the allowed edge lengths."""
+        sizes = parse_sizes('640, 160,320,')
+        self.assertEqual(sizes, [160, 320, 640])
+        self.assertEqual(quantize_size(100, 200, sizes), (160, 320))
+        self.assertEqual(quantize_size(320, 0, sizes), (320, 0))
+        self.assertEqual(quantize_size(5000, 641, sizes), (640, 640))
+
+    def test_sized_rendition_path(self):
+        """Ensure sized renditions of a photo share a folder."""
+        self.assertEqual(sized_rendition_path('a.jpg', (320, 0), 'contain'), 'sized/a.jpg/320x0-contain.jpg')
+        self.assertEqual(sized_rendition_path('a.jpg', (160, 160), 'cover', 'webp'), 'sized/a.jpg/160x160-cover.webp')
+
+    def test_rendition_cache(self):
+        """Ensure sized renditions fit as requested, and the original is decoded once for every size."""
+        original = BytesIO()
+        Image.new('RGB', (4000, 3000), (120, 80, 40)).save(original, 'JPEG')
+        loads = []
+
+        def load():
+            loads.append(1)
+            return BytesIO(original.getvalue())
+
+        cache = RenditionCache(1024, 2)
+        contain = cache.make('a.jpg', load, (320, 0), 'contain')
+        cover = cache.make('a.jpg', load, (160, 160), 'cover')
+
+        self.assertEqual(Image.open(BytesIO(contain)).size, (320, 240))
+        self.assertEqual(Image.open(BytesIO(cover)).size, (160, 160))
+        self.assertEqual(len(loads), 1)
+
+    def test_rendition_cache_single_flight(self):
+        """Ensure concurrent requests for the same rendition resize once, and all get the rendition."""
+        original = BytesIO()
+        Image.new('RGB', (1600, 1200), (40, 80, 120)).save(original, 'JPEG')
+        saved = []
+
+        def save(data):
+            time.sleep(0.2)
+            saved.append(data)
+
+        cache = RenditionCache(1024, 2)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            cache.make('a.jpg', lambda: BytesIO(original.getvalue()), (320, 320), 'contain', save=save)))
+            for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(saved), 1)
+        self.assertEqual(results, saved * 4)
+
+    def test_rendition_pool(self):
+        """Ensure renditions made in the process pool are the same as made in place."""
+        original = BytesIO()
+        Image.new('RGB', (1600, 1200), (40, 80, 120)).save(original, 'JPEG')
+        renditions = parse_renditions('thumbnails:300x200,retina:600x400')
+
+        pool = RenditionPool(2, 1)
+        try:
+            result = pool.make_renditions(original.getvalue(), renditions)
+        finally:
+            pool.shutdown()
+
+        self.assertEqual(result, make_renditions(BytesIO(original.getvalue()), renditions))
+
+    def test_memory_reader(self):
+        """Ensure an image decoded from a memoryview by the reader is the same as decoded from bytes."""
+        original = BytesIO()
+        Image.new('RGB', (1600, 1200), (40, 80, 120)).save(original, 'JPEG')
+        data = original.getvalue()
+        renditions = parse_renditions('thumbnails:300x200')
+
+        reader = MemoryReader(memoryview(data))
+        self.assertEqual(reader.read(4), data[:4])
+        self.assertEqual(reader.seek(-2, 2), len(data) - 2)
+        self.assertEqual(reader.read(), data[-2:])
+        self.assertEqual(reader.read(1), b'')
+        reader.seek(0)
+        self.assertEqual(make_renditions(reader, renditions), make_renditions(BytesIO(data), renditions))
+
+
+if __name__ == '__main__':
+    unittest.main()
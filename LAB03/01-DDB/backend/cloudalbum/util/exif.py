@@ -0,0 +1,125 @@
+"""
+    cloudalbum/util/exif.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Read photo information (EXIF and pixel dimensions) from the header of an uploaded image.
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+from io import BytesIO
+from datetime import datetime
+from PIL import Image
+
+# EXIF of JPEG is an APP1 segment (64KB at most) in front of the frame header which has the dimensions,
+# so the head of the file is enough and pixels are never decoded.
+HEADER_SIZE = 256 * 1024
+
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_DATETIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_GPS_IFD = 0x8825
+TAG_DATETIME_ORIGINAL = 0x9003
+
+GPS_LATITUDE_REF = 1
+GPS_LATITUDE = 2
+GPS_LONGITUDE_REF = 3
+GPS_LONGITUDE = 4
+
+# Format of EXIF DateTime, the same as taken_date of the upload form.
+DATETIME_FORMAT = "%Y:%m:%d %H:%M:%S"
+
+# Keys of photo information which the image header fills in, the same as the upload form fields.
+IMAGE_INFO_KEYS = ['make', 'model', 'width', 'height', 'taken_date', 'geotag_lat', 'geotag_lng']
+
+
+def rational(value):
+    """
+    Return float of EXIF rational, which is (numerator, denominator) in old Pillow.
+    """
+    if isinstance(value, tuple):
+        return float(value[0]) / float(value[1]) if value[1] else 0.0
+    return float(value)
+
+
+def gps_degree(value, ref):
+    """
+    Convert EXIF GPS coordinate to signed decimal degree.
+    :param value: (degrees, minutes, seconds)
+    :param ref: 'N', 'S', 'E' or 'W'
+    :return: float
+    """
+    degrees, minutes, seconds = (rational(v) for v in value)
+    degree = degrees + minutes / 60.0 + seconds / 3600.0
+    return -degree if str(ref).strip('\x00 ').upper() in ('S', 'W') else degree
+
+
+def sub_ifd(exif, tag):
+    """
+    Return nested IFD (EXIF, GPS) as dict, old Pillow loads some of them in place of the offset.
+    """
+    value = exif.get(tag)
+    if isinstance(value, dict):
+        return value
+    return exif.get_ifd(tag) or {}
+
+
+def text(value):
+    return value.strip('\x00 ') if isinstance(value, str) else None
+
+
+def date_text(value):
+    """
+    Return EXIF DateTime string, None when it is blank or broken, e.g. '0000:00:00 00:00:00'.
+    """
+    value = text(value)
+    try:
+        datetime.strptime(value, DATETIME_FORMAT)
+        return value
+    except (TypeError, ValueError):
+        return None
+
+
+def read_image_info(header):
+    """
+    Read photo information from the head of an image file.
+    :param header: bytes, the first HEADER_SIZE bytes of the file at least
+    :return: dict of IMAGE_INFO_KEYS found in the image, values are strings as the upload form fields
+    """
+    info = {}
+    try:
+        im = Image.open(BytesIO(header))
+        info['width'], info['height'] = (str(v) for v in im.size)
+        exif = im.getexif()
+    except Exception:
+        return info
+
+    try:
+        info['make'] = text(exif.get(TAG_MAKE))
+        info['model'] = text(exif.get(TAG_MODEL))
+        exif_ifd = sub_ifd(exif, TAG_EXIF_IFD) or exif
+        info['taken_date'] = date_text(exif_ifd.get(TAG_DATETIME_ORIGINAL) or exif.get(TAG_DATETIME))
+
+        gps = sub_ifd(exif, TAG_GPS_IFD)
+        if GPS_LATITUDE in gps and GPS_LONGITUDE in gps:
+            info['geotag_lat'] = str(gps_degree(gps[GPS_LATITUDE], gps.get(GPS_LATITUDE_REF, 'N')))
+            info['geotag_lng'] = str(gps_degree(gps[GPS_LONGITUDE], gps.get(GPS_LONGITUDE_REF, 'E')))
+    except Exception:
+        # Broken EXIF, the dimensions are still good.
+        pass
+    return {key: value for key, value in info.items() if value}
+
+
+def apply_image_info(form, info):
+    """
+    Fill the upload form with photo information read from the image.
+    Values of the image take precedence, the client values are kept for the keys which the image has not.
+    :param form: parsed upload form
+    :param info: dict, see read_image_info()
+    :return: form
+    """
+    for key in IMAGE_INFO_KEYS:
+        if info.get(key):
+            form[key] = info[key]
+    return form
@@ -8,42 +8,87 @@
     :license: MIT, see LICENSE for more details.
 """
 from flask import current_app as app
-from PIL import Image
 from pathlib import Path
+from cloudalbum.util.rendition import parse_renditions, make_renditions, get_rendition_pool, parse_sizes, \
+    quantize_size, sized_rendition_path, get_rendition_cache, SIZED_FOLDER
+from cloudalbum.util.exif import read_image_info, HEADER_SIZE
 from cloudalbum.database.model_ddb import Photo, photo_deserialize
 from datetime import datetime
 import os
+import uuid
+import shutil
 
 
 def email_normalize(email):
     return email.replace('@', '_at_').replace('.', '_dot_')
 
 
+def render_renditions(file_p, renditions):
+    """
+    Make renditions, in the rendition process pool when THUMBNAIL_PROCESSES is set.
+    :param file_p: pathlib.Path or file object of original image
+    :param renditions: list of (name, (width, height)), see parse_renditions()
+    :return: dict, rendition name to JPEG bytes
+    """
+    processes = int(app.config['THUMBNAIL_PROCESSES'])
+    if processes <= 0:
+        return make_renditions(file_p, renditions)
+
+    data = file_p.read_bytes() if isinstance(file_p, Path) else file_p.read()
+    pool = get_rendition_pool(processes, int(app.config['THUMBNAIL_PROCESS_QUEUE']))
+    return pool.make_renditions(data, renditions)
+
+
 def make_thumbnail(path, filename):
     """
-    Generate thumbnail from original image file.
+    Generate thumbnail and the other renditions from original image file.
+    Each rendition is saved in the folder named after it, e.g. 'thumbnails'.
     :param path: pathlib.Path, which pointing a original file directory
     :param filename: secure file name
     :return: None
     """
-    thumb_path = path / 'thumbnails'
-    thumb_file_location = thumb_path / filename
-
     try:
-        if not thumb_path.exists():
-            thumb_path.mkdir()
-            app.logger.info("Create folder for thumbnails: %s", str(thumb_path))
-
-        im = Image.open(path / filename)
-        im = im.convert('RGB')
-        im.thumbnail((300, 200, Image.ANTIALIAS))
-        im.save(thumb_file_location)
-        app.logger.debug("success:thumbnail saved!:{}".format(str(thumb_file_location)))
+        renditions = render_renditions(path / filename, parse_renditions(app.config['THUMBNAIL_RENDITIONS']))
+        for name, image_bytes in renditions.items():
+            rendition_path = path / name
+            if not rendition_path.exists():
+                rendition_path.mkdir()
+                app.logger.info("Create folder for %s: %s", name, str(rendition_path))
+
+            (rendition_path / filename).write_bytes(image_bytes)
+            app.logger.debug("success:{0} saved!:{1}".format(name, str(rendition_path / filename)))
     except Exception as e:
-        app.logger.error("ERROR:Thumbnails creation error:{}".format(str(thumb_file_location)))
+        app.logger.error("ERROR:Thumbnails creation error:{}".format(str(path / filename)))
         app.logger.error(e)
 
 
+def sized_rendition(email, filename, size, fit):
+    """
+    Return the sized rendition of the photo, which is made from the mezzanine and saved at the first request.
+    :param email: user email address
+    :param filename: secure filename of the original
+    :param size: requested (width, height), 0 leaves the edge free. It is rounded up to RENDITION_SIZES
+    :param fit: one of FITS
+    :return: pathlib.Path of the rendition file
+    """
+    size = quantize_size(size[0], size[1], parse_sizes(app.config['RENDITION_SIZES']))
+    path = Path(app.config['UPLOAD_FOLDER']) / email_normalize(email)
+    rendition_file = path / sized_rendition_path(filename, size, fit)
+    if rendition_file.exists():
+        return rendition_file
+
+    def save_rendition(image_bytes):
+        rendition_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = rendition_file.with_name('{0}.{1}.tmp'.format(rendition_file.name, uuid.uuid4().hex))
+        temp_file.write_bytes(image_bytes)
+        os.replace(str(temp_file), str(rendition_file))
+        app.logger.debug("success:sized rendition saved!:{}".format(str(rendition_file)))
+
+    cache = get_rendition_cache(app.config['RENDITION_MEZZANINE_SIZE'], app.config['RENDITION_MEZZANINE_CACHE'])
+    cache.make(str(path / filename), lambda: path / filename, size, fit, save=save_rendition)
+    return rendition_file
+
+
 def delete(filename, email):
     """
     Delete specific file (with thumbnail)
@@ -53,14 +98,17 @@ def delete(filename, email):
     """
     try:
         base_path = Path(app.config['UPLOAD_FOLDER']) / email_normalize(email)
-        thumbnail_file_location = base_path / 'thumbnails' / filename
         original_file_location = base_path / filename
 
-        if thumbnail_file_location.exists():
-            Path.unlink(thumbnail_file_location)
-            app.logger.debug('success:thumbnail file deleted:filepath:{}'.format(thumbnail_file_location))
-        else:
-            app.logger.debug('DEBUG:thumbnail file not exist:filepath:{}'.format(thumbnail_file_location))
+        for name, _ in parse_renditions(app.config['THUMBNAIL_RENDITIONS']):
+            thumbnail_file_location = base_path / name / filename
+            if thumbnail_file_location.exists():
+                Path.unlink(thumbnail_file_location)
+                app.logger.debug('success:thumbnail file deleted:filepath:{}'.format(thumbnail_file_location))
+            else:
+                app.logger.debug('DEBUG:thumbnail file not exist:filepath:{}'.format(thumbnail_file_location))
+
+        shutil.rmtree(str(base_path / SIZED_FOLDER / filename), ignore_errors=True)
 
         if original_file_location.exists():
             Path.unlink(original_file_location)
@@ -79,12 +127,11 @@ def delete(filename, email):
 def save(upload_file, filename, email):
     """
     Upload input file (photo) to specific path for individual user.
-    Save original file and thumbnail file.
+    Save original file and thumbnail file, photo information is read from the head of the file on the way.
     :param upload_file: file object
     :param filename: secure filename for upload
     :param email: user email address
-    :param application: Flask.application
-    :return: file size (byte)
+    :return: (file size (byte), photo information dict), see read_image_info()
     """
     path = Path(app.config['UPLOAD_FOLDER']) / email_normalize(email)
 
@@ -94,13 +141,16 @@ def save(upload_file, filename, email):
             app.logger.info("folder created:{}".format(str(path)))
 
         original_full_path = path / filename
-        upload_file.save(str(original_full_path))
+        with original_full_path.open('wb') as f:
+            header = upload_file.stream.read(HEADER_SIZE)
+            f.write(header)
+            shutil.copyfileobj(upload_file.stream, f)
         app.logger.debug("success:original file saved!:{}".format(str(original_full_path)))
         file_size = os.stat(original_full_path).st_size
 
         make_thumbnail(path, filename)
 
-        return file_size
+        return file_size, read_image_info(header)
     except Exception as e:
         app.logger.debug("ERROR:failed file saving:original or thumbnail: {}".format(filename))
         app.logger.error(e)
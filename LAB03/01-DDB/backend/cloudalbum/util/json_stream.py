@@ -0,0 +1,52 @@
+"""
+    cloudalbum/util/json_stream.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    JSON response written piece by piece, so a large photo list is sent while it is read.
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import json
+from itertools import islice
+
+
+def batched(iterable, size):
+    """
+    Yield lists of size items of the iterable, the last one may be shorter.
+    :param iterable: iterable, read lazily
+    :param size: number of items of a list
+    :return: generator of lists
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_json_object(head, array_name, batches, tail=None, dumps=json.dumps):
+    """
+    Yield text of a JSON object which has the items of the batches as an array, a piece per batch.
+    Only a batch of items is in memory at a time.
+    :param head: dict of the members written before the array
+    :param array_name: name of the array member
+    :param batches: iterable of lists of items, read lazily
+    :param tail: function returning dict of the members written after the array, called when the batches are over
+    :param dumps: function which encodes a value to JSON text
+    :return: generator of strings
+    """
+    yield '{'
+    for name, value in head.items():
+        yield '{0}: {1}, '.format(dumps(name), dumps(value))
+    yield '{0}: ['.format(dumps(array_name))
+    separator = ''
+    for batch in batches:
+        if batch:
+            yield separator + ', '.join(dumps(item) for item in batch)
+            separator = ', '
+    yield ']'
+    for name, value in (tail() if tail else {}).items():
+        yield ', {0}: {1}'.format(dumps(name), dumps(value))
+    yield '}'
@@ -14,7 +14,7 @@ from flask_restplus import Api, Resource
 from werkzeug.exceptions import InternalServerError
 import shutil
 import socket
-import boto3
+from cloudalbum.util import aws_client
 
 admin_blueprint = Blueprint('admin', __name__)
 api = Api(admin_blueprint, doc='/swagger/', title='Admin',
@@ -36,8 +36,8 @@ class HealthCheck(Resource):
     def get(self):
         try:
             # 1. Is database available?!
-            boto3.client('dynamodb').describe_table(TableName='Photo')
-            boto3.client('dynamodb').describe_table(TableName='User')
+            aws_client.dynamodb().describe_table(TableName='Photo')
+            aws_client.dynamodb().describe_table(TableName='User')
 
             # 2. Is disk have enough free space?!
             total, used, free = shutil.disk_usage('/')
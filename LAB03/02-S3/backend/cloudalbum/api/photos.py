@@ -7,17 +7,31 @@
     :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
     :license: MIT, see LICENSE for more details.
 """
-import uuid
-from flask import Blueprint, request, make_response
+import hashlib
+import time
+from functools import partial
+from itertools import chain
+from flask import Blueprint, request, make_response, Response, stream_with_context, json
 from flask_restplus import Api, Resource, fields
 from flask import current_app as app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from werkzeug.exceptions import BadRequest, InternalServerError
+from werkzeug.exceptions import BadRequest, NotFound, InternalServerError
 from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
-from cloudalbum.database.model_ddb import Photo
-from cloudalbum.util.file_control import delete_s3, save_s3, presigned_url, with_presigned_url
-from cloudalbum.solution import solution_put_photo_info_ddb, solution_delete_photo_from_ddb
+from cloudalbum.database.model_ddb import Photo, query_photo_page, query_photos, next_page_cursor, \
+    decode_cursor, PHOTO_LIST_ATTRIBUTES, PHOTO_LIST_ORDERS, get_photo_list_version, \
+    bump_photo_list_version, new_photo_id, parse_list_dates, is_registered_filename
+from cloudalbum.util.exif import apply_image_info
+from cloudalbum.util.json_stream import batched, iter_json_object
+from cloudalbum.util.serializer import dumps
+from cloudalbum.util.presign import window_start
+from cloudalbum.util.rendition import best_format, FITS
+from cloudalbum.util.file_control import delete_s3, save_s3, presigned_post, complete_s3_upload, \
+    find_content_ref, release_content, release_upload, rendition_formats, photo_formats, map_batch, \
+    create_upload_session, upload_chunk, list_chunks, finish_upload_session, abort_upload_session, \
+    max_chunks, received_size, sized_presigned_url, presigned_url, with_presigned_urls
+from cloudalbum.solution import solution_put_photo_info_ddb, solution_delete_photo_from_ddb, solution_make_photo, \
+    solution_put_photos_ddb
 
 
 authorizations = {
@@ -56,8 +70,23 @@ photo_info = api.model('New_photo', {
     'address': fields.String
 })
 
+# 'list' returns PHOTO_LIST_ATTRIBUTES of the photos, 'full' every attribute.
+PHOTO_LIST_VIEWS = ['list', 'full']
+
+photo_list_parser = api.parser()
+photo_list_parser.add_argument('limit', type=int, location='args', default=0)
+photo_list_parser.add_argument('cursor', type=str, location='args')
+photo_list_parser.add_argument('view', type=str, location='args', choices=PHOTO_LIST_VIEWS, default='list')
+photo_list_parser.add_argument('order', type=str, location='args', choices=PHOTO_LIST_ORDERS,
+                               default=PHOTO_LIST_ORDERS[0])
+photo_list_parser.add_argument('since', type=str, location='args')
+photo_list_parser.add_argument('until', type=str, location='args')
+
 photo_get_parser = api.parser()
 photo_get_parser.add_argument('mode', type=str, location='args')
+photo_get_parser.add_argument('w', type=int, location='args', default=0)
+photo_get_parser.add_argument('h', type=int, location='args', default=0)
+photo_get_parser.add_argument('fit', type=str, location='args', choices=FITS, default='contain')
 
 file_upload_parser = api.parser()
 file_upload_parser.add_argument('file', location='files', type=FileStorage, required=True)
@@ -74,6 +103,152 @@ file_upload_parser.add_argument('city', type=str, location='form')
 file_upload_parser.add_argument('address', type=str, location='form')
 file_upload_parser.add_argument('nation', type=str, location='form')
 
+upload_url_parser = api.parser()
+upload_url_parser.add_argument('filename_orig', type=str, location='form', required=True)
+
+upload_complete_parser = file_upload_parser.copy()
+upload_complete_parser.remove_argument('file')
+upload_complete_parser.add_argument('filename', type=str, location='form', required=True)
+upload_complete_parser.add_argument('filename_orig', type=str, location='form', required=True)
+
+upload_id_parser = api.parser()
+upload_id_parser.add_argument('upload_id', type=str, location='args', required=True)
+
+upload_finish_parser = upload_complete_parser.copy()
+upload_finish_parser.remove_argument('filename')
+upload_finish_parser.add_argument('upload_id', type=str, location='form', required=True)
+
+files_upload_parser = file_upload_parser.copy()
+files_upload_parser.remove_argument('file')
+files_upload_parser.add_argument('files', location='files', type=FileStorage, action='append', required=True)
+
+digest_parser = file_upload_parser.copy()
+digest_parser.remove_argument('file')
+digest_parser.add_argument('digest', type=str, location='form', required=True)
+digest_parser.add_argument('filename_orig', type=str, location='form', required=True)
+
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'bmp', 'gif', 'png']
+
+
+def image_extension(filename_orig):
+    """
+    Return extension of the image file name, BadRequest is raised when the format is not supported.
+    :param filename_orig: file name on the client
+    :return: lower case extension
+    """
+    extension = filename_orig.rsplit('.', 1)[-1].lower()
+    if '.' not in filename_orig or extension not in IMAGE_EXTENSIONS:
+        app.logger.error('File format is not supported:{0}'.format(filename_orig))
+        raise BadRequest('File format is not supported:{0}'.format(filename_orig))
+    return extension
+
+
+def check_filename(filename):
+    """
+    Check the filename given by /upload-url or /uploads, BadRequest is raised when it is not a secure filename.
+    :param filename: filename of the upload
+    :return: filename
+    """
+    if filename != secure_filename(filename):
+        raise BadRequest('Invalid filename:{0}'.format(filename))
+    return filename
+
+
+def page_args(args):
+    """
+    Return limit and cursor of a photo list request.
+    :param args: parsed photo_list_parser
+    :return: (limit, None for the whole list, cursor)
+    :raise BadRequest: when the limit is out of range or the cursor is broken or of another order
+    """
+    limit = args['limit'] or app.config['PHOTO_LIST_DEFAULT_LIMIT']
+    if limit < 0 or limit > app.config['PHOTO_LIST_MAX_LIMIT']:
+        raise BadRequest('Invalid limit:{0}'.format(limit))
+    try:
+        if args['cursor']:
+            decode_cursor(args['cursor'], args['order'])
+    except ValueError:
+        raise BadRequest('Invalid cursor:{0}'.format(args['cursor']))
+    return limit or None, args['cursor']
+
+
+def date_range_args(args):
+    """
+    Return since and until of a photo list request, see parse_list_dates().
+    :param args: parsed photo_list_parser
+    :return: (since, until), datetime or None each
+    :raise BadRequest: when a date is broken, or the taken_date order is asked while PHOTO_TAKEN_DATE_INDEX is off
+    """
+    if args['order'] == 'taken_date' and not app.config['PHOTO_TAKEN_DATE_INDEX']:
+        raise BadRequest('Unsupported order:{0}'.format(args['order']))
+    try:
+        return parse_list_dates(args['since'], args['until'])
+    except ValueError as e:
+        raise BadRequest('Invalid date range: {0}'.format(e))
+
+
+def photo_list_etag(user_id, limit, cursor, view, accept, order=PHOTO_LIST_ORDERS[0], since=None,
+                    until=None):
+    """
+    Return ETag of a photo list response, made of the list version of the user, the request and the window
+    of S3_PRESIGNED_URL_WINDOW which the URLs of the list are signed in, see cached_presigned_urls().
+    The version is read before the query, so a change during the query is seen by the next request.
+    :param user_id: user id
+    :param limit: limit of page_args()
+    :param cursor: cursor of page_args()
+    :param view: one of PHOTO_LIST_VIEWS
+    :param accept: Accept header, which chooses the thumbnail format
+    :param order: one of PHOTO_LIST_ORDERS
+    :param since: since of the request as it is given
+    :param until: until of the request as it is given
+    :return: string, None when PHOTO_LIST_ETAG is off or the URLs are signed on every request
+    """
+    window = app.config['S3_PRESIGNED_URL_WINDOW']
+    if not app.config['PHOTO_LIST_ETAG'] or window <= 0:
+        return None
+    version = get_photo_list_version(user_id)
+    request_key = json.dumps([user_id, limit, cursor, view, accept, order, since, until,
+                              window_start(time.time(), window)])
+    return '{0}-{1}'.format(version, hashlib.sha1(request_key.encode('utf-8')).hexdigest()[:16])
+
+
+def with_etag(response, etag):
+    """
+    Set the ETag on the response, the browser revalidates it on every request.
+    :param response: Response
+    :param etag: string, the response is left as it is when it is None
+    :return: response
+    """
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def stream_photo_list(results, to_json):
+    """
+    Return response of the photo list written batch by batch of PHOTO_LIST_STREAM_BATCH photos, while
+    DynamoDB pages are read. An error after the first batch cuts the response short, it never looks complete.
+    :param results: iterator of query_photos()
+    :param to_json: function which returns list of dict of a list of Photo
+    :return: streaming Response
+    """
+    batches = (to_json(batch) for batch in batched(results, app.config['PHOTO_LIST_STREAM_BATCH']))
+    # The first batch is read here, so an error of the query is still answered with the status code.
+    first = next(batches, [])
+
+    def generate():
+        try:
+            yield from iter_json_object({'ok': True}, 'photos', chain([first], batches),
+                                        lambda: {'next_cursor': next_page_cursor(results)},
+                                        partial(dumps, fast=app.config['PHOTO_LIST_ORJSON']))
+        except Exception as e:
+            app.logger.error('Photos list streaming failed')
+            app.logger.error(e)
+            raise
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
 
 @api.route('/ping')
 @api.doc('photos ping!')
@@ -95,42 +270,422 @@ class FileUpload(Resource):
         extension = (filename_orig.rsplit('.', 1)[1]).lower()
         current_user = get_jwt_identity()
 
-        if extension.lower() not in ['jpg', 'jpeg', 'bmp', 'gif', 'png']:
+        if extension.lower() not in IMAGE_EXTENSIONS:
             app.logger.error('File format is not supported:{0}'.format(filename_orig))
             raise BadRequest('File format is not supported:{0}'.format(filename_orig))
 
         try:
-            filename = secure_filename("{0}.{1}".format(uuid.uuid4(), extension))
-            filesize = save_s3(form['file'], filename, current_user['email'])
+            filename = secure_filename("{0}.{1}".format(new_photo_id(), extension))
             user_id = current_user['user_id']
+            filesize, stored, digest, image_info = save_s3(form['file'], filename, current_user['email'], user_id)
+            # Photo information of the image itself, the client does not need to parse EXIF.
+            apply_image_info(form, image_info)
 
-            solution_put_photo_info_ddb(user_id, filename, form, filesize)
-            return make_response({'ok': True}, 200)
+            try:
+                solution_put_photo_info_ddb(user_id, filename, form, filesize, digest=digest,
+                                            stored_filename=stored.filename, formats=photo_formats(stored))
+            except Exception as e:
+                release_upload(user_id, digest, stored.filename, current_user['email'])
+                raise e
+            bump_photo_list_version(user_id)
+            return make_response({'ok': True, 'photo_id': filename, 'duplicate': stored.filename != filename}, 200)
         except Exception as e:
             app.logger.error('File upload failed:user_id:{0}: {1}'.format(current_user['user_id'], e))
             raise InternalServerError('File upload failed: {0}'.format(e))
 
 
+@api.route('/files')
+@api.expect(files_upload_parser)
+class FilesUpload(Resource):
+    @api.doc(
+        responses=
+        {
+            200: 'Result of each file, in the order of the files',
+            400: 'Too many files',
+            500: 'Internal server error'
+        }
+    )
+    @jwt_required
+    def post(self):
+        """Upload several photos at once, the form fields apply to each of them"""
+        form = files_upload_parser.parse_args()
+        upload_files = form.pop('files')
+        current_user = get_jwt_identity()
+        user_id = current_user['user_id']
+        if len(upload_files) > app.config['UPLOAD_BATCH_MAX_FILES']:
+            raise BadRequest('Too many files:{0}, max:{1}'.format(len(upload_files),
+                                                                  app.config['UPLOAD_BATCH_MAX_FILES']))
+
+        def upload_one(upload_file):
+            filename = secure_filename("{0}.{1}".format(new_photo_id(), image_extension(upload_file.filename)))
+            filesize, stored, digest, image_info = save_s3(upload_file, filename, current_user['email'], user_id)
+            try:
+                file_form = apply_image_info(dict(form, file=upload_file), image_info)
+                return solution_make_photo(user_id, filename, file_form, filesize, digest=digest,
+                                           stored_filename=stored.filename, formats=photo_formats(stored))
+            except Exception as e:
+                release_upload(user_id, digest, stored.filename, current_user['email'])
+                raise e
+
+        results = map_batch(upload_one, upload_files)
+        photos = [photo for photo, error in results if error is None]
+        try:
+            solution_put_photos_ddb(photos)
+            if photos:
+                bump_photo_list_version(user_id)
+        except Exception as e:
+            app.logger.error('Batch upload failed:user_id:{0}: {1}'.format(user_id, e))
+            for photo in photos:
+                release_upload(user_id, photo.digest, photo.filename, current_user['email'])
+            raise InternalServerError('Batch upload failed: {0}'.format(e))
+
+        files = []
+        for upload_file, (photo, error) in zip(upload_files, results):
+            if error is None:
+                files.append({'ok': True, 'filename_orig': upload_file.filename, 'photo_id': photo.id,
+                              'duplicate': photo.filename != photo.id})
+            else:
+                app.logger.error('File upload failed:user_id:{0}:{1}: {2}'.format(user_id, upload_file.filename,
+                                                                                 error))
+                files.append({'ok': False, 'filename_orig': upload_file.filename,
+                              'error': getattr(error, 'description', None) or str(error)})
+        return make_response({'ok': True, 'files': files}, 200)
+
+
+@api.route('/digest')
+@api.expect(digest_parser)
+class DigestCheck(Resource):
+    @api.doc(
+        responses=
+        {
+            200: 'exists is true when the photo is saved without file transfer',
+            400: 'File format is not supported',
+            500: 'Internal server error'
+        }
+    )
+    @jwt_required
+    def post(self):
+        """Save a photo by SHA-256 digest of its file, when the same file is already uploaded"""
+        form = digest_parser.parse_args()
+        current_user = get_jwt_identity()
+        extension = image_extension(form['filename_orig'])
+
+        try:
+            stored = find_content_ref(current_user['user_id'], form['digest'])
+            if stored is None:
+                return make_response({'ok': True, 'exists': False}, 200)
+
+            filename = secure_filename("{0}.{1}".format(new_photo_id(), extension))
+            try:
+                form['file'] = FileStorage(filename=form['filename_orig'])
+                solution_put_photo_info_ddb(current_user['user_id'], filename, form, None,
+                                            digest=form['digest'].lower(), stored_filename=stored.filename,
+                                            formats=photo_formats(stored))
+            except Exception as e:
+                release_upload(current_user['user_id'], stored.digest, stored.filename, current_user['email'])
+                raise e
+            bump_photo_list_version(current_user['user_id'])
+            return make_response({'ok': True, 'exists': True, 'photo_id': filename}, 200)
+        except Exception as e:
+            app.logger.error('Digest check failed:user_id:{0}: {1}'.format(current_user['user_id'], e))
+            raise InternalServerError('Digest check failed: {0}'.format(e))
+
+
+@api.route('/upload-url')
+@api.expect(upload_url_parser)
+class UploadUrl(Resource):
+    @api.doc(
+        responses=
+        {
+            200: 'Return presigned POST url and form fields',
+            400: 'File format is not supported',
+            500: 'Internal server error'
+        }
+    )
+    @jwt_required
+    def post(self):
+        """Get presigned POST to upload the original straight to S3, then call /upload-complete"""
+        form = upload_url_parser.parse_args()
+        current_user = get_jwt_identity()
+        extension = image_extension(form['filename_orig'])
+
+        try:
+            filename = secure_filename("{0}.{1}".format(new_photo_id(), extension))
+            post = presigned_post(filename, current_user['email'])
+            return make_response({'ok': True, 'filename': filename, 'url': post['url'], 'fields': post['fields']}, 200)
+        except Exception as e:
+            app.logger.error('ERROR:upload url failed:user_id:{}'.format(current_user['user_id']))
+            app.logger.error(e)
+            raise InternalServerError('Upload url creation failed: {0}'.format(e))
+
+
+@api.route('/upload-complete')
+@api.expect(upload_complete_parser)
+class UploadComplete(Resource):
+    @api.doc(
+        responses=
+        {
+            200: 'Photo saved',
+            400: 'File is not uploaded or is registered already',
+            500: 'Internal server error'
+        }
+    )
+    @jwt_required
+    def post(self):
+        """Save the photo uploaded with /upload-url, and make its thumbnails"""
+        form = upload_complete_parser.parse_args()
+        current_user = get_jwt_identity()
+        filename = check_filename(form['filename'])
+        image_extension(form['filename_orig'])
+        # The original of another photo would be shared without a content reference, and deleted with either.
+        if is_registered_filename(current_user['user_id'], filename):
+            raise BadRequest('File is registered already:{0}'.format(filename))
+
+        try:
+            filesize, image_info = complete_s3_upload(filename, current_user['email'])
+        except FileNotFoundError:
+            raise BadRequest('File is not uploaded:{0}'.format(filename))
+        except Exception as e:
+            app.logger.error('ERROR:upload complete failed:user_id:{}'.format(current_user['user_id']))
+            app.logger.error(e)
+            raise InternalServerError('File upload failed: {0}'.format(e))
+
+        try:
+            form['file'] = FileStorage(filename=form['filename_orig'])
+            apply_image_info(form, image_info)
+            solution_put_photo_info_ddb(current_user['user_id'], filename, form, filesize, formats=rendition_formats())
+            bump_photo_list_version(current_user['user_id'])
+            return make_response({'ok': True}, 200)
+        except Exception as e:
+            app.logger.error('ERROR:upload complete failed:user_id:{}'.format(current_user['user_id']))
+            app.logger.error(e)
+            raise InternalServerError('File upload failed: {0}'.format(e))
+
+
+@api.route('/uploads')
+@api.expect(upload_url_parser)
+class UploadSessions(Resource):
+    @api.doc(
+        responses=
+        {
+            200: 'Return the upload session',
+            400: 'File format is not supported',
+            500: 'Internal server error'
+        }
+    )
+    @jwt_required
+    def post(self):
+        """Start a resumable upload, PUT its chunks to /uploads/<filename>/<number> then call .../complete"""
+        form = upload_url_parser.parse_args()
+        current_user = get_jwt_identity()
+        extension = image_extension(form['filename_orig'])
+
+        try:
+            filename = secure_filename("{0}.{1}".format(new_photo_id(), extension))
+            upload_id = create_upload_session(filename, current_user['email'])
+            chunk_size = app.config['S3_MULTIPART_CHUNK_SIZE']
+            return make_response({'ok': True, 'filename': filename, 'upload_id': upload_id,
+                                  'chunk_size': chunk_size,
+                                  'max_chunks': max_chunks(chunk_size, app.config['S3_UPLOAD_MAX_SIZE']),
+                                  'expires_in': app.config['UPLOAD_SESSION_EXPIRE_TIME']}, 200)
+        except Exception as e:
+            app.logger.error('ERROR:upload session failed:user_id:{}'.format(current_user['user_id']))
+            app.logger.error(e)
+            raise InternalServerError('Upload session creation failed: {0}'.format(e))
+
+
+@api.route('/uploads/<filename>')
+@api.expect(upload_id_parser)
+class UploadSession(Resource):
+    @api.doc(
+        responses=
+        {
+            200: 'Return the chunks received, and the offset to resume from',
+            404: 'Upload session not found',
+            500: 'Internal server error'
+        }
+    )
+    @jwt_required
+    def get(self, filename):
+        """Get the chunks which the resumable upload received"""
+        args = upload_id_parser.parse_args()
+        current_user = get_jwt_identity()
+        check_filename(filename)
+
+        try:
+            chunks = list_chunks(filename, current_user['email'], args['upload_id'])
+        except FileNotFoundError:
+            raise NotFound('Upload session not found:{0}'.format(filename))
+        except Exception as e:
+            app.logger.error('ERROR:upload session failed:user_id:{}'.format(current_user['user_id']))
+            app.logger.error(e)
+            raise InternalServerError('Upload session retrieving failed: {0}'.format(e))
+
+        chunk_size = app.config['S3_MULTIPART_CHUNK_SIZE']
+        return make_response({'ok': True, 'chunk_size': chunk_size,
+                              'received': received_size([(number, size) for number, size, _ in chunks], chunk_size),
+                              'chunks': [{'number': number, 'size': size} for number, size, _ in chunks]}, 200)
+
+    @api.doc(
+        responses=
+        {
+            200: 'Upload session aborted',
+            404: 'Upload session not found',
+            500: 'Internal server error'
+        }
+    )
+    @jwt_required
+    def delete(self, filename):
+        """Abort the resumable upload"""
+        args = upload_id_parser.parse_args()
+        current_user = get_jwt_identity()
+        check_filename(filename)
+
+        try:
+            abort_upload_session(filename, current_user['email'], args['upload_id'])
+            return make_response({'ok': True}, 200)
+        except FileNotFoundError:
+            raise NotFound('Upload session not found:{0}'.format(filename))
+        except Exception as e:
+            app.logger.error('ERROR:upload session failed:user_id:{}'.format(current_user['user_id']))
+            app.logger.error(e)
+            raise InternalServerError('Upload session abort failed: {0}'.format(e))
+
+
+@api.route('/uploads/<filename>/<int:number>')
+@api.expect(upload_id_parser)
+class UploadChunk(Resource):
+    @api.doc(
+        responses=
+        {
+            200: 'Chunk received',
+            400: 'Invalid chunk',
+            404: 'Upload session not found',
+            500: 'Internal server error'
+        }
+    )
+    @jwt_required
+    def put(self, filename, number):
+        """Upload a chunk of the resumable upload, the request body is the chunk"""
+        args = upload_id_parser.parse_args()
+        current_user = get_jwt_identity()
+        check_filename(filename)
+        chunk_size = app.config['S3_MULTIPART_CHUNK_SIZE']
+        if not 1 <= number <= max_chunks(chunk_size, app.config['S3_UPLOAD_MAX_SIZE']):
+            raise BadRequest('Invalid chunk number:{0}'.format(number))
+        if (request.content_length or 0) > chunk_size:
+            raise BadRequest('Chunk is larger than {0} bytes'.format(chunk_size))
+        data = request.get_data(cache=False)
+        if not data or len(data) > chunk_size:
+            raise BadRequest('Chunk must be 1 to {0} bytes'.format(chunk_size))
+
+        try:
+            upload_chunk(filename, current_user['email'], args['upload_id'], number, data)
+            return make_response({'ok': True, 'number': number, 'size': len(data)}, 200)
+        except FileNotFoundError:
+            raise NotFound('Upload session not found:{0}'.format(filename))
+        except Exception as e:
+            app.logger.error('ERROR:chunk upload failed:user_id:{}'.format(current_user['user_id']))
+            app.logger.error(e)
+            raise InternalServerError('Chunk upload failed: {0}'.format(e))
+
+
+@api.route('/uploads/<filename>/complete')
+@api.expect(upload_finish_parser)
+class UploadSessionComplete(Resource):
+    @api.doc(
+        responses=
+        {
+            200: 'Photo saved',
+            400: 'Chunks are missing',
+            404: 'Upload session not found',
+            500: 'Internal server error'
+        }
+    )
+    @jwt_required
+    def post(self, filename):
+        """Assemble the chunks of the resumable upload into the photo, and make its thumbnails"""
+        form = upload_finish_parser.parse_args()
+        current_user = get_jwt_identity()
+        check_filename(filename)
+        image_extension(form['filename_orig'])
+
+        try:
+            filesize, image_info = finish_upload_session(filename, current_user['email'], form.pop('upload_id'))
+        except FileNotFoundError:
+            raise NotFound('Upload session not found:{0}'.format(filename))
+        except ValueError as e:
+            raise BadRequest('Upload is not complete:{0}'.format(e))
+        except Exception as e:
+            app.logger.error('ERROR:upload complete failed:user_id:{}'.format(current_user['user_id']))
+            app.logger.error(e)
+            raise InternalServerError('File upload failed: {0}'.format(e))
+
+        try:
+            form['file'] = FileStorage(filename=form['filename_orig'])
+            apply_image_info(form, image_info)
+            solution_put_photo_info_ddb(current_user['user_id'], filename, form, filesize, formats=rendition_formats())
+            bump_photo_list_version(current_user['user_id'])
+            return make_response({'ok': True, 'photo_id': filename}, 200)
+        except Exception as e:
+            app.logger.error('ERROR:upload complete failed:user_id:{}'.format(current_user['user_id']))
+            app.logger.error(e)
+            raise InternalServerError('File upload failed: {0}'.format(e))
+
+
 @api.route('/', strict_slashes=False)
 class List(Resource):
     @api.doc(
         responses=
         {
-            200: 'Return the whole photos list',
+            200: 'Return the photos list',
+            304: 'Photos list is not changed',
+            400: 'Invalid limit, cursor, order or dates',
             500: 'Internal server error'
         }
     )
     @jwt_required
+    @api.expect(photo_list_parser)
     def get(self):
-        """Get all photos as list"""
-
+        """
+        Get photos as list, a page of them when limit is given.
+        :queryparam limit: max number of photos of the page, up to PHOTO_LIST_MAX_LIMIT
+        :queryparam cursor: next_cursor of the previous page
+        :queryparam view: list(default) or full, see PHOTO_LIST_VIEWS
+        :queryparam order: upload_date(default) or taken_date, newest first, see PHOTO_LIST_ORDERS.
+                           taken_date leaves out the photos without taken_date
+        :queryparam since: the earliest date of the order, e.g. 2019, 2019-07, 2019-07-15 or 2019-07-15T09:46:46
+        :queryparam until: the latest date of the order, the whole period of it, e.g. 2019 is until the end of 2019
+        :header If-None-Match: ETag of the list the client has, 304 is returned when the list is not changed
+        :return: photos and next_cursor, which is None on the last page, streamed when PHOTO_LIST_STREAM is on
+        """
+        args = photo_list_parser.parse_args()
+        limit, cursor = page_args(args)
+        since, until = date_range_args(args)
         try:
             user = get_jwt_identity()
-            photos = Photo.query(get_jwt_identity()['user_id'])
-            data = {'photos': []}
-            [data['photos'].append(with_presigned_url(user, photo)) for photo in photos]
-            app.logger.debug("success:photos_list:{}".format(data))
-            return make_response({'ok': True, 'photos': data['photos']}, 200)
+            # The list view reads its attributes from the list index, the full view reads the whole items.
+            attributes = None if args['view'] == 'full' else PHOTO_LIST_ATTRIBUTES
+            accept = request.headers.get('Accept')
+            etag = photo_list_etag(user['user_id'], limit, cursor, args['view'], accept, args['order'],
+                                   args['since'], args['until'])
+            if etag and request.if_none_match.contains_weak(etag):
+                return with_etag(make_response('', 304), etag)
+            # The list index is read eventually consistent only, so it may be older than the version of the ETag.
+            # A list with ETag reads the table, or the local taken_date index, strongly consistent in place of it.
+            consistent = etag is not None
+            index = Photo.list_index if attributes and app.config['PHOTO_LIST_INDEX'] and not consistent else None
+            if app.config['PHOTO_LIST_STREAM']:
+                results = query_photos(user['user_id'], limit, cursor, attributes, index, args['order'], since, until,
+                                       consistent)
+                return with_etag(stream_photo_list(
+                    results, lambda photos: with_presigned_urls(user, photos, accept, attributes)), etag)
+            photos, next_cursor = query_photo_page(user['user_id'], limit, cursor, attributes, index,
+                                                   args['order'], since, until, consistent)
+            photos = with_presigned_urls(user, photos, accept, attributes)
+            app.logger.debug("success:photos_list:{}".format(photos))
+            data = dumps({'ok': True, 'photos': photos, 'next_cursor': next_cursor}, app.config['PHOTO_LIST_ORJSON'])
+            return with_etag(Response(data, mimetype='application/json'), etag)
 
         except Exception as e:
             app.logger.error('Photos list retrieving failed')
@@ -153,8 +708,11 @@ class OnePhoto(Resource):
         """one photo delete"""
         user = get_jwt_identity()
         try:
+            digest = Photo.get(user['user_id'], photo_id).digest
             filename = solution_delete_photo_from_ddb(user, photo_id)
-            file_deleted = delete_s3(filename, user['email'])
+            bump_photo_list_version(user['user_id'])
+            # Objects of the same content are kept while another photo refers to them.
+            file_deleted = delete_s3(filename, user['email']) if release_content(user['user_id'], digest) else True
 
             if file_deleted:
                 app.logger.debug('success:photo deleted: user_id:{}, photo_id:{}'.format(user['user_id'], photo_id))
@@ -182,13 +740,24 @@ class OnePhoto(Resource):
         Return image for thumbnail and original photo.
         :param photo_id: target photo id
         :queryparam mode: None(original) or thumbnail
+        :queryparam w: width of a sized rendition, made on demand
+        :queryparam h: height of a sized rendition
+        :queryparam fit: contain(default) or cover, see FITS
         :return: image url for authenticated user
         """
+        args = photo_get_parser.parse_args()
+        if args['w'] < 0 or args['h'] < 0:
+            raise BadRequest('Invalid size:{0}x{1}'.format(args['w'], args['h']))
         try:
             mode = request.args.get('mode')
             user = get_jwt_identity()
             email = user['email']
-            return presigned_url(photo_id, email, True if mode else False)
+            photo = Photo.get(user['user_id'], photo_id)
+            if args['w'] or args['h']:
+                format = best_format(request.headers.get('Accept'), rendition_formats())
+                return sized_presigned_url(photo.filename, email, (args['w'], args['h']), args['fit'], format)
+            format = best_format(request.headers.get('Accept'), photo_formats(photo))
+            return presigned_url(photo.filename, email, True if mode else False, format)
         except Exception as e:
             app.logger.error('ERROR:get photo failed:photo_id:{}'.format(photo_id))
             app.logger.error(e)
@@ -28,16 +28,88 @@ class BaseConfig:
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', os.path.join(os.getcwd(), '/tmp'))
     THUMBNAIL_WIDTH = os.getenv('THUMBNAIL_WIDTH', 300)
     THUMBNAIL_HEIGHT = os.getenv('THUMBNAIL_HEIGHT', 200)
+    # Renditions made from each upload, comma separated 'name:WIDTHxHEIGHT' (e.g. 'retina:600x400').
+    # A rendition is stored in the folder named after it, 'thumbnails' is the photo grid thumbnail.
+    THUMBNAIL_RENDITIONS = os.getenv('THUMBNAIL_RENDITIONS',
+                                     'thumbnails:{0}x{1}'.format(THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT))
+    # Processes making renditions, 0 makes them in the calling thread. Original image is handed over by shared
+    # memory, and at most THUMBNAIL_PROCESS_QUEUE images are submitted at once, further uploads wait for a slot.
+    THUMBNAIL_PROCESSES = int(os.getenv('THUMBNAIL_PROCESSES', '0'))
+    THUMBNAIL_PROCESS_QUEUE = int(os.getenv('THUMBNAIL_PROCESS_QUEUE', '16'))
+    # Renditions are also encoded in these formats next to the JPEG ones, the formats which Pillow cannot encode
+    # are skipped. Thumbnail URLs are of the smallest format in the Accept header of the request.
+    THUMBNAIL_FORMATS = os.getenv('THUMBNAIL_FORMATS', 'webp,avif')
+    # Sized renditions are made on demand by GET /photos/<id>?w=&h=&fit=, each edge rounded up to one of
+    # RENDITION_SIZES to bound the renditions per photo. They are made from a mezzanine decode of at most
+    # RENDITION_MEZZANINE_SIZE pixels, and mezzanines of the last RENDITION_MEZZANINE_CACHE photos are kept in memory.
+    RENDITION_SIZES = os.getenv('RENDITION_SIZES', '160,320,640,1280')
+    RENDITION_MEZZANINE_SIZE = int(os.getenv('RENDITION_MEZZANINE_SIZE', '2048'))
+    RENDITION_MEZZANINE_CACHE = int(os.getenv('RENDITION_MEZZANINE_CACHE', '8'))
 
     AWS_REGION = Session().region_name if environ.get('AWS_REGION') is None else environ.get('AWS_REGION')
 
     # DynamoDB
     DDB_RCU = int(os.getenv('DDB_RCU', '10'))
     DDB_WCU = int(os.getenv('DDB_WCU', '10'))
+    # Photo list returns pages of 'limit' photos when it is given, PHOTO_LIST_DEFAULT_LIMIT otherwise,
+    # 0 returns the whole list at once.
+    PHOTO_LIST_DEFAULT_LIMIT = int(os.getenv('PHOTO_LIST_DEFAULT_LIMIT', '0'))
+    PHOTO_LIST_MAX_LIMIT = int(os.getenv('PHOTO_LIST_MAX_LIMIT', '1000'))
+    # Photo list without ETag reads the 'photo-list-index' of the Photo table, which has the list attributes only.
+    # It is turned off at startup when the Photo table has not the index, the list reads the table then.
+    PHOTO_LIST_INDEX = os.getenv('PHOTO_LIST_INDEX', 'True') == 'True'
+    # Photo list in the taken_date order reads the 'photo-taken-date-index' of the Photo table. DynamoDB makes a
+    # local secondary index only with a new table, it is turned off at startup for a table created before it,
+    # which answers 400 then.
+    PHOTO_TAKEN_DATE_INDEX = os.getenv('PHOTO_TAKEN_DATE_INDEX', 'True') == 'True'
+    # Photo list is streamed batch by batch of PHOTO_LIST_STREAM_BATCH photos while it is read, so the first byte
+    # and the memory do not wait for the whole list.
+    PHOTO_LIST_STREAM = os.getenv('PHOTO_LIST_STREAM', 'False') == 'True'
+    PHOTO_LIST_STREAM_BATCH = int(os.getenv('PHOTO_LIST_STREAM_BATCH', '100'))
+    # Photo list answers ETag of the list version of the user, the same If-None-Match gets 304 after reading
+    # the version only. No ETag when S3_PRESIGNED_URL_WINDOW is 0, the URLs differ on every request then.
+    # A list with ETag reads the table strongly consistent in place of the list index, which is read
+    # eventually consistent only and may be older than the version, see PHOTO_LIST_INDEX.
+    PHOTO_LIST_ETAG = os.getenv('PHOTO_LIST_ETAG', 'True') == 'True'
+    # Photo list is encoded by orjson when it is installed, otherwise by json of the standard library.
+    PHOTO_LIST_ORJSON = os.getenv('PHOTO_LIST_ORJSON', 'True') == 'True'
 
     # S3
     S3_PHOTO_BUCKET = os.getenv('S3_PHOTO_BUCKET', None)
     S3_PRESIGNED_URL_EXPIRE_TIME = int(os.getenv('S3_PRESIGNED_URL_EXPIRE_TIME', '3600'))
+    # Photo list URLs are signed once per window of S3_PRESIGNED_URL_WINDOW seconds and expire at the end
+    # of the next window, so the same URL is given within a window and the browser caches the image.
+    # 0 signs a new URL on every request, valid for S3_PRESIGNED_URL_EXPIRE_TIME.
+    S3_PRESIGNED_URL_WINDOW = int(os.getenv('S3_PRESIGNED_URL_WINDOW', '1800'))
+    S3_PRESIGNED_URL_CACHE_SIZE = int(os.getenv('S3_PRESIGNED_URL_CACHE_SIZE', '10000'))
+    # URLs of a photo list are signed in the process at once, the same as botocore does one by one.
+    S3_LOCAL_PRESIGNER = os.getenv('S3_LOCAL_PRESIGNER', 'True') == 'True'
+    # Streaming upload sends the original with S3 multipart upload, one part at a time.
+    # Every part except the last one must be at least 5MB.
+    S3_STREAMING_UPLOAD = os.getenv('S3_STREAMING_UPLOAD', 'False') == 'True'
+    S3_MULTIPART_CHUNK_SIZE = max(int(os.getenv('S3_MULTIPART_CHUNK_SIZE', str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+    # Threads putting the original and its renditions concurrently, shared by all requests of the process.
+    S3_UPLOAD_WORKERS = int(os.getenv('S3_UPLOAD_WORKERS', '8'))
+    # Files of a /photos/files batch upload saved at once, shared by all requests of the process,
+    # and max number of files in one batch.
+    UPLOAD_BATCH_WORKERS = int(os.getenv('UPLOAD_BATCH_WORKERS', '4'))
+    UPLOAD_BATCH_MAX_FILES = int(os.getenv('UPLOAD_BATCH_MAX_FILES', '100'))
+    # Presigned POST lets the client upload the original straight to S3, see /photos/upload-url.
+    S3_PRESIGNED_POST_EXPIRE_TIME = int(os.getenv('S3_PRESIGNED_POST_EXPIRE_TIME', '600'))
+    S3_UPLOAD_MAX_SIZE = int(os.getenv('S3_UPLOAD_MAX_SIZE', str(50 * 1024 * 1024)))
+    # Resumable upload sends the original in chunks of S3_MULTIPART_CHUNK_SIZE to an S3 multipart upload,
+    # see /photos/uploads. Sessions older than UPLOAD_SESSION_EXPIRE_TIME are aborted, at most once per
+    # UPLOAD_SESSION_GC_INTERVAL in each process, 0 leaves them to 'manage.py collect_upload_sessions'.
+    UPLOAD_SESSION_EXPIRE_TIME = int(os.getenv('UPLOAD_SESSION_EXPIRE_TIME', str(24 * 60 * 60)))
+    UPLOAD_SESSION_GC_INTERVAL = int(os.getenv('UPLOAD_SESSION_GC_INTERVAL', '3600'))
+    # S3 compatible endpoint, e.g. a local S3 stand-in for tests. AWS S3 when it is not set.
+    S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL', None)
+
+    # AWS clients, one per service is shared by the process. Keep the pool larger than S3_UPLOAD_WORKERS.
+    AWS_MAX_POOL_CONNECTIONS = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', '20'))
+    AWS_CONNECT_TIMEOUT = int(os.getenv('AWS_CONNECT_TIMEOUT', '5'))
+    # Read timeout of each service, comma separated 'service:seconds'.
+    AWS_READ_TIMEOUTS = os.getenv('AWS_READ_TIMEOUTS', 's3:60,dynamodb:10,cognito-idp:10')
 
 
 class DevelopmentConfig(BaseConfig):
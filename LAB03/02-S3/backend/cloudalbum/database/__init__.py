@@ -8,7 +8,7 @@
     :license: MIT, see LICENSE for more details.
 """
 
-from cloudalbum.database.model_ddb import User, Photo
+from cloudalbum.database.model_ddb import User, Photo, PhotoContent, PhotoListVersion
 from flask import current_app as app
 
 
@@ -23,6 +23,33 @@ def create_table():
         Photo.create_table(read_capacity_units=app.config['DDB_RCU'],
                            write_capacity_units=app.config['DDB_WCU'],
                            wait=True)
+    if not PhotoContent.exists():
+        app.logger.debug('Creating DynamoDB PhotoContent table..')
+        PhotoContent.create_table(read_capacity_units=app.config['DDB_RCU'],
+                                  write_capacity_units=app.config['DDB_WCU'],
+                                  wait=True)
+    if not PhotoListVersion.exists():
+        app.logger.debug('Creating DynamoDB PhotoListVersion table..')
+        PhotoListVersion.create_table(read_capacity_units=app.config['DDB_RCU'],
+                                      write_capacity_units=app.config['DDB_WCU'],
+                                      wait=True)
+    check_photo_indexes()
+
+
+def check_photo_indexes():
+    """
+    Turn PHOTO_LIST_INDEX and PHOTO_TAKEN_DATE_INDEX off when the Photo table has not the index (yet),
+    e.g. a table created before it, so the photo list falls back to the table.
+    :return: None
+    """
+    table = Photo.describe_table()
+    # A global secondary index added to a table is not queried until it is ACTIVE, a local one has no status.
+    indexes = [index['IndexName'] for index in table.get('GlobalSecondaryIndexes', [])
+               + table.get('LocalSecondaryIndexes', []) if index.get('IndexStatus', 'ACTIVE') == 'ACTIVE']
+    for key, index in [('PHOTO_LIST_INDEX', Photo.list_index), ('PHOTO_TAKEN_DATE_INDEX', Photo.taken_date_index)]:
+        if app.config[key] and index.Meta.index_name not in indexes:
+            app.logger.warning('Photo table has no active {0}, {1} is turned off'.format(index.Meta.index_name, key))
+            app.config[key] = False
 
 
 def delete_table():
@@ -30,3 +57,7 @@ def delete_table():
         User.delete_table()
     if Photo.exists():
         Photo.delete_table()
+    if PhotoContent.exists():
+        PhotoContent.delete_table()
+    if PhotoListVersion.exists():
+        PhotoListVersion.delete_table()
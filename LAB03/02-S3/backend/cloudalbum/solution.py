@@ -28,28 +28,42 @@ def solution_get_user_data_with_idx(signin_data):
     return user_email[0]
 
 
-def solution_put_photo_info_ddb(user_id, filename, form, filesize):
-    new_photo = Photo(id=filename,
-                      user_id=user_id,
-                      filename=filename,
-                      filename_orig=form['file'].filename,
-                      filesize=filesize,
-                      upload_date=datetime.today(),
-                      tags=form['tags'],
-                      desc=form['desc'],
-                      geotag_lat=form['geotag_lat'],
-                      geotag_lng=form['geotag_lng'],
-                      taken_date=datetime.strptime(form['taken_date'], "%Y:%m:%d %H:%M:%S"),
-                      make=form['make'],
-                      model=form['model'],
-                      width=form['width'],
-                      height=form['height'],
-                      city=form['city'],
-                      nation=form['nation'],
-                      address=form['address'])
+def solution_make_photo(user_id, filename, form, filesize, digest=None, stored_filename=None, formats=None):
+    return Photo(id=filename,
+                 user_id=user_id,
+                 filename=stored_filename or filename,
+                 digest=digest,
+                 formats=','.join(formats) if formats else None,
+                 filename_orig=form['file'].filename,
+                 filesize=filesize,
+                 upload_date=datetime.today(),
+                 tags=form['tags'],
+                 desc=form['desc'],
+                 geotag_lat=form['geotag_lat'],
+                 geotag_lng=form['geotag_lng'],
+                 taken_date=datetime.strptime(form['taken_date'], "%Y:%m:%d %H:%M:%S")
+                 if form['taken_date'] else None,
+                 make=form['make'],
+                 model=form['model'],
+                 width=form['width'],
+                 height=form['height'],
+                 city=form['city'],
+                 nation=form['nation'],
+                 address=form['address'])
+
+
+def solution_put_photo_info_ddb(user_id, filename, form, filesize, digest=None, stored_filename=None, formats=None):
+    new_photo = solution_make_photo(user_id, filename, form, filesize, digest, stored_filename, formats)
     new_photo.save()
 
 
+def solution_put_photos_ddb(photos):
+    # BatchWriteItem of 25 items per request, unprocessed items are retried by pynamodb.
+    with Photo.batch_write() as batch:
+        for photo in photos:
+            batch.save(photo)
+
+
 def solution_delete_photo_from_ddb(user, photo_id):
     app.logger.info('RUNNING TODO#4 SOLUTION CODE:')
     app.logger.info('Delete a photo from photos list, and update!')
@@ -62,7 +76,7 @@ def solution_delete_photo_from_ddb(user, photo_id):
     return filename
 
 
-def solution_put_object_to_s3(s3_client, key, upload_file_stream):
+def solution_put_object_to_s3(s3_client, key, upload_file_stream, content_type='image/jpeg'):
     app.logger.info('RUNNING TODO#5 SOLUTION CODE:')
     app.logger.info('Put object into S3 bucket!')
     app.logger.info('Follow the steps in the lab guide to replace this method with your own implementation.')
@@ -71,7 +85,7 @@ def solution_put_object_to_s3(s3_client, key, upload_file_stream):
         Bucket=app.config['S3_PHOTO_BUCKET'],
         Key=key,
         Body=upload_file_stream,
-        ContentType='image/jpeg',
+        ContentType=content_type,
         StorageClass='STANDARD'
     )
 
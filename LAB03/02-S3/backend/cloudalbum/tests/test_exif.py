@@ -0,0 +1,96 @@
+"""
+    cloudalbum/tests/test_exif.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Test cases for photo information read from image header
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import struct
+import unittest
+from io import BytesIO
+from PIL import Image
+from cloudalbum.util.exif import read_image_info, apply_image_info, gps_degree
+
+
+def exif_segment(make, taken_date, lat, lng):
+    """
+    Build little endian EXIF with IFD0 (Make, ExifIFD, GPSInfo), ExifIFD (DateTimeOriginal) and GPS IFD.
+    """
+    data_offset = 8 + 42 + 18 + 54
+    data = b''
+    offsets = []
+    for value in [make.encode() + b'\x00', taken_date.encode() + b'\x00',
+                  struct.pack('<6I', *[v for d in lat[:3] for v in (d, 1)]),
+                  struct.pack('<6I', *[v for d in lng[:3] for v in (d, 1)])]:
+        offsets.append(data_offset + len(data))
+        data += value
+
+    ifd0 = struct.pack('<H', 3) + \
+        struct.pack('<HHII', 0x010F, 2, len(make) + 1, offsets[0]) + \
+        struct.pack('<HHII', 0x8769, 4, 1, 8 + 42) + \
+        struct.pack('<HHII', 0x8825, 4, 1, 8 + 42 + 18) + struct.pack('<I', 0)
+    exif_ifd = struct.pack('<H', 1) + struct.pack('<HHII', 0x9003, 2, len(taken_date) + 1, offsets[1]) + \
+        struct.pack('<I', 0)
+    gps_ifd = struct.pack('<H', 4) + \
+        struct.pack('<HHI4s', 1, 2, 2, lat[3].encode()) + struct.pack('<HHII', 2, 5, 3, offsets[2]) + \
+        struct.pack('<HHI4s', 3, 2, 2, lng[3].encode()) + struct.pack('<HHII', 4, 5, 3, offsets[3]) + \
+        struct.pack('<I', 0)
+    return b'Exif\x00\x00II*\x00' + struct.pack('<I', 8) + ifd0 + exif_ifd + gps_ifd + data
+
+
+class TestExif(unittest.TestCase):
+    """Tests for reading photo information from image header."""
+
+    def test_read_image_info(self):
+        """Ensure EXIF and dimensions are read from the head of a JPEG."""
+        original = BytesIO()
+        exif = exif_segment('SONY', '2012:07:15 09:46:46', (45, 26, 5, 'N'), (12, 20, 48, 'W'))
+        Image.new('RGB', (2048, 1371)).save(original, 'JPEG', exif=exif)
+
+        info = read_image_info(original.getvalue()[:4096])
+
+        self.assertEqual(info['width'], '2048')
+        self.assertEqual(info['height'], '1371')
+        self.assertEqual(info['make'], 'SONY')
+        self.assertEqual(info['taken_date'], '2012:07:15 09:46:46')
+        self.assertAlmostEqual(float(info['geotag_lat']), 45.434722, places=5)
+        self.assertAlmostEqual(float(info['geotag_lng']), -12.346667, places=5)
+
+    def test_read_image_info_without_exif(self):
+        """Ensure only dimensions are read from an image without EXIF, and nothing from broken bytes."""
+        original = BytesIO()
+        Image.new('RGB', (640, 480)).save(original, 'PNG')
+
+        self.assertEqual(read_image_info(original.getvalue()), {'width': '640', 'height': '480'})
+        self.assertEqual(read_image_info(b'my file contents'), {})
+
+    def test_read_image_info_placeholder_date(self):
+        """Ensure a blank or placeholder EXIF date is left out, so the date of the form is kept."""
+        for taken_date in ['0000:00:00 00:00:00', '    :  :     :  :  ']:
+            original = BytesIO()
+            exif = exif_segment('SONY', taken_date, (45, 26, 5, 'N'), (12, 20, 48, 'W'))
+            Image.new('RGB', (640, 480)).save(original, 'JPEG', exif=exif)
+
+            info = read_image_info(original.getvalue())
+            self.assertEqual(info['make'], 'SONY')
+            self.assertNotIn('taken_date', info)
+
+            form = apply_image_info({'taken_date': '2012:07:15 09:46:46'}, info)
+            self.assertEqual(form['taken_date'], '2012:07:15 09:46:46')
+
+    def test_apply_image_info(self):
+        """Ensure values of the image take precedence over the form."""
+        form = {'make': 'client', 'model': 'DSLR-A300', 'width': None, 'tags': 'TEST'}
+        apply_image_info(form, {'make': 'SONY', 'width': '2048'})
+        self.assertEqual(form, {'make': 'SONY', 'model': 'DSLR-A300', 'width': '2048', 'tags': 'TEST'})
+
+    def test_gps_degree(self):
+        """Ensure GPS rationals are converted to signed degree."""
+        self.assertAlmostEqual(gps_degree(((37, 1), (30, 1), (0, 1)), 'S'), -37.5)
+        self.assertAlmostEqual(gps_degree((127.0, 6.0, 36.0), 'E'), 127.11)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,6 +12,8 @@ import boto3
 import botocore
 from cloudalbum.tests.base import BaseTestCase
 from flask import current_app as app
+from cloudalbum.util import aws_client
+from cloudalbum.util.file_control import submit_s3, wait_s3_puts
 
 
 class TestS3Service(BaseTestCase):
@@ -33,6 +35,30 @@ class TestS3Service(BaseTestCase):
                 exists = False
                 self.assertEqual(exists, True, msg='Bucket is not exist!')
 
+    def test_put_rollback(self):
+        """Ensure objects put successfully are deleted when another concurrent PUT fails."""
+        class S3Client:
+            deleted = []
+
+            def delete_object(self, Bucket, Key):
+                self.deleted.append(Key)
+
+        def put(key):
+            if key == 'failed':
+                raise botocore.exceptions.EndpointConnectionError(endpoint_url=key)
+
+        s3_client = S3Client()
+        futures = {submit_s3(put, key): key for key in ['original', 'failed']}
+        with self.assertRaises(botocore.exceptions.EndpointConnectionError):
+            wait_s3_puts(s3_client, futures, done_keys=['uploaded'])
+        self.assertEqual(sorted(s3_client.deleted), ['original', 'uploaded'])
+
+    def test_shared_client(self):
+        """Ensure one S3 client is shared, with the read timeout of S3."""
+        self.assertIs(aws_client.s3(), aws_client.s3())
+        read_timeouts = aws_client.parse_timeouts(app.config['AWS_READ_TIMEOUTS'])
+        self.assertEqual(aws_client.s3().meta.config.read_timeout, read_timeouts['s3'])
+
 
 if __name__ == '__main__':
     unittest.main()
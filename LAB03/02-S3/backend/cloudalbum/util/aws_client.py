@@ -0,0 +1,121 @@
+"""
+    cloudalbum/util/aws_client.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Process-wide registry of AWS service clients.
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import threading
+import boto3
+from botocore.config import Config
+
+DEFAULT_READ_TIMEOUT = 60
+
+# Clients are thread-safe, so one client per service is shared by every request and worker thread
+# of the process, and keeps its connection pool warm. Sessions are not, so clients are created under the lock.
+_settings = {
+    'max_pool_connections': 20,
+    'connect_timeout': 5,
+    'read_timeouts': {},
+    'endpoint_urls': {},
+}
+_clients = {}
+_credentials = None
+_lock = threading.Lock()
+
+
+def parse_timeouts(value):
+    """
+    Parse comma separated 'service:seconds' string, e.g. 's3:60,cognito-idp:10'.
+    :param value: string
+    :return: dict, service name to seconds
+    """
+    timeouts = {}
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        service, seconds = item.rsplit(':', 1)
+        timeouts[service.strip()] = int(seconds)
+    return timeouts
+
+
+def configure(**settings):
+    """
+    Change settings of the clients, the clients already created are dropped.
+    :param settings: max_pool_connections, connect_timeout, read_timeouts, endpoint_urls
+    :return: None
+    """
+    global _credentials
+    with _lock:
+        _settings.update(settings)
+        _clients.clear()
+        _credentials = None
+
+
+def init_app(app):
+    configure(max_pool_connections=int(app.config['AWS_MAX_POOL_CONNECTIONS']),
+              connect_timeout=int(app.config['AWS_CONNECT_TIMEOUT']),
+              read_timeouts=parse_timeouts(app.config['AWS_READ_TIMEOUTS']),
+              endpoint_urls={'s3': app.config['S3_ENDPOINT_URL']} if app.config['S3_ENDPOINT_URL'] else {})
+
+
+def client_config(service_name):
+    """
+    Return botocore Config of the service client.
+    :param service_name: e.g. 's3'
+    :return: botocore.config.Config
+    """
+    options = dict(max_pool_connections=_settings['max_pool_connections'],
+                   connect_timeout=_settings['connect_timeout'],
+                   read_timeout=_settings['read_timeouts'].get(service_name, DEFAULT_READ_TIMEOUT))
+    if service_name == 's3':
+        # botocore presigns with signature version 2 in the regions which still accept it,
+        # the presigned URLs are version 4 everywhere as the local presigner signs them.
+        options['signature_version'] = 's3v4'
+    return Config(**options)
+
+
+def get_client(service_name):
+    """
+    Return the client of the service, which is created at the first call.
+    :param service_name: e.g. 's3'
+    :return: boto3 client
+    """
+    client = _clients.get(service_name)
+    if client is None:
+        with _lock:
+            client = _clients.get(service_name)
+            if client is None:
+                client = boto3.session.Session().client(service_name, config=client_config(service_name),
+                                                        endpoint_url=_settings['endpoint_urls'].get(service_name))
+                _clients[service_name] = client
+    return client
+
+
+def credentials():
+    """
+    Return credentials of the default provider chain, which the clients sign with.
+    Temporary credentials, e.g. of an instance role, are refreshed before they expire.
+    :return: botocore ReadOnlyCredentials, access_key, secret_key and token
+    """
+    global _credentials
+    if _credentials is None:
+        with _lock:
+            if _credentials is None:
+                _credentials = boto3.session.Session().get_credentials()
+    return _credentials.get_frozen_credentials()
+
+
+def s3():
+    return get_client('s3')
+
+
+def dynamodb():
+    return get_client('dynamodb')
+
+
+def cognito():
+    return get_client('cognito-idp')
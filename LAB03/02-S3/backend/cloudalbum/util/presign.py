@@ -0,0 +1,232 @@
+"""
+    cloudalbum/util/presign.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Presigned GET URLs of S3 objects, reused within fixed time windows and signed in bulk.
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import hmac
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit, urlunsplit, parse_qsl
+
+ALGORITHM = 'AWS4-HMAC-SHA256'
+TIMESTAMP_FORMAT = '%Y%m%dT%H%M%SZ'
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+# Key of the URL which botocore presigns once to tell the endpoint and the signing region, see get_sigv4_presigner().
+PROBE_KEY = 'presign-probe'
+
+
+def window_start(now, window):
+    """
+    Return the start of the fixed window which the time falls in.
+    :param now: epoch seconds
+    :param window: seconds
+    :return: epoch seconds
+    """
+    return int(now // window) * window
+
+
+def cache_control(window):
+    """
+    Return Cache-Control which S3 answers for the presigned URLs, so the browser keeps the image
+    while the photo list gives the same URL.
+    :param window: seconds
+    :return: string
+    """
+    return 'private, max-age={0}'.format(window)
+
+
+def percent_encode(value, safe='-_.~'):
+    return quote(str(value).encode('utf-8'), safe=safe)
+
+
+class PresignedUrlCache:
+    """
+    Presigned URLs by object key. A URL is signed once per window and expires at the end of the next window,
+    so every photo list of the window gets byte-identical URLs, which stay valid for one window at least.
+    """
+
+    def __init__(self, window, max_entries):
+        self.window = window
+        self.max_entries = max_entries
+        self.urls = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys, sign, now=None):
+        """
+        Return URLs of the keys signed in the current window, the keys which have none are signed in one call.
+        :param keys: list of cache keys, e.g. (bucket, object key)
+        :param sign: function of (keys, window start, expiry), times in epoch seconds, which returns new URLs
+        :param now: epoch seconds, the current time when it is None
+        :return: list of URLs
+        """
+        now = time.time() if now is None else now
+        start = window_start(now, self.window)
+        urls = [None] * len(keys)
+        with self.lock:
+            for i, key in enumerate(keys):
+                entry = self.urls.get(key)
+                if entry is not None and entry[0] == start:
+                    self.urls.move_to_end(key)
+                    urls[i] = entry[1]
+
+        # Signed out of the lock, a URL signed twice in a race is as good as the other.
+        missing = [i for i, url in enumerate(urls) if url is None]
+        if not missing:
+            return urls
+        signed = sign([keys[i] for i in missing], start, start + 2 * self.window)
+        with self.lock:
+            for i, url in zip(missing, signed):
+                urls[i] = url
+                self.urls[keys[i]] = (start, url)
+                self.urls.move_to_end(keys[i])
+            while len(self.urls) > self.max_entries:
+                self.urls.popitem(last=False)
+        return urls
+
+    def clear(self):
+        with self.lock:
+            self.urls.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_presigned_url_cache(window, max_entries):
+    """
+    Return the presigned URL cache of this process, which is created at the first call.
+    :param window: seconds
+    :param max_entries: max number of URLs kept
+    :return: PresignedUrlCache
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None or (_cache.window, _cache.max_entries) != (window, max_entries):
+            _cache = PresignedUrlCache(window, max_entries)
+        return _cache
+
+
+class SigV4Presigner:
+    """
+    Presigned S3 GET URLs signed in the process, the same as botocore generate_presigned_url() with
+    signature version 4. The signing key is derived once per day, and everything but the object key is
+    shared by the URLs of a batch, so a URL costs a SHA256 of the canonical request and an HMAC.
+    """
+
+    def __init__(self, base_url, region, service='s3'):
+        """
+        :param base_url: URL which the quoted object key is appended to, e.g. 'https://bucket.s3.amazonaws.com/'
+        :param region: signing region
+        :param service: signing service
+        """
+        parts = urlsplit(base_url)
+        self.origin = '{0}://{1}'.format(parts.scheme, parts.netloc)
+        self.prefix = parts.path
+        # Host header as botocore signs it, without the default port.
+        self.host = parts.hostname
+        if parts.port and parts.port != {'http': 80, 'https': 443}.get(parts.scheme):
+            self.host = '{0}:{1}'.format(self.host, parts.port)
+        self.region = region
+        self.service = service
+        self.signing_keys = {}
+
+    def signing_key(self, secret_key, datestamp):
+        """
+        Return SigV4 signing key of the day, derived at the first call.
+        :param secret_key: AWS secret access key
+        :param datestamp: 'YYYYMMDD'
+        :return: bytes
+        """
+        signing_key = self.signing_keys.get((secret_key, datestamp))
+        if signing_key is None:
+            signing_key = ('AWS4' + secret_key).encode('utf-8')
+            for msg in (datestamp, self.region, self.service, 'aws4_request'):
+                signing_key = hmac.new(signing_key, msg.encode('utf-8'), hashlib.sha256).digest()
+            # A key per day and credentials, old ones are of no use.
+            if len(self.signing_keys) >= 8:
+                self.signing_keys.clear()
+            self.signing_keys[(secret_key, datestamp)] = signing_key
+        return signing_key
+
+    def presign(self, credentials, keys, timestamp, expires_in, params=None):
+        """
+        Return presigned GET URLs of the keys.
+        :param credentials: access_key, secret_key and token, e.g. botocore frozen credentials
+        :param keys: S3 object keys
+        :param timestamp: epoch seconds which the URLs are signed at
+        :param expires_in: seconds from the timestamp
+        :param params: dict of query parameters of the request, e.g. {'response-cache-control': 'max-age=60'}
+        :return: list of URLs
+        """
+        amz_date = datetime.fromtimestamp(int(timestamp), timezone.utc).strftime(TIMESTAMP_FORMAT)
+        datestamp = amz_date[:8]
+        scope = '{0}/{1}/{2}/aws4_request'.format(datestamp, self.region, self.service)
+
+        # Parameters of the request first and then the authentication, in the order of botocore.
+        query = list((params or {}).items()) + [
+            ('X-Amz-Algorithm', ALGORITHM),
+            ('X-Amz-Credential', '{0}/{1}'.format(credentials.access_key, scope)),
+            ('X-Amz-Date', amz_date),
+            ('X-Amz-Expires', int(expires_in)),
+            ('X-Amz-SignedHeaders', 'host')]
+        if credentials.token is not None:
+            query.append(('X-Amz-Security-Token', credentials.token))
+        query = [(percent_encode(name), percent_encode(value)) for name, value in query]
+        query_string = '&'.join('{0}={1}'.format(name, value) for name, value in query)
+        canonical_query = '&'.join('{0}={1}'.format(name, value) for name, value in sorted(query))
+
+        # Everything but the path is the same for every key of the batch.
+        request_tail = '\n{0}\nhost:{1}\n\nhost\n{2}'.format(canonical_query, self.host, UNSIGNED_PAYLOAD)
+        string_to_sign_head = '{0}\n{1}\n{2}\n'.format(ALGORITHM, amz_date, scope)
+        signing_key = self.signing_key(credentials.secret_key, datestamp)
+        urls = []
+        for key in keys:
+            path = self.prefix + percent_encode(key, safe='/~')
+            digest = hashlib.sha256('GET\n{0}{1}'.format(path, request_tail).encode('utf-8')).hexdigest()
+            signature = hmac.new(signing_key, (string_to_sign_head + digest).encode('utf-8'),
+                                 hashlib.sha256).hexdigest()
+            urls.append('{0}{1}?{2}&X-Amz-Signature={3}'.format(self.origin, path, query_string, signature))
+        return urls
+
+
+def presigner_for(probe_url):
+    """
+    Return presigner of the endpoint of a URL which botocore presigned for PROBE_KEY.
+    :param probe_url: URL
+    :return: SigV4Presigner, None when the URL is not signed with signature version 4
+    """
+    parts = urlsplit(probe_url)
+    query = dict(parse_qsl(parts.query))
+    if query.get('X-Amz-Algorithm') != ALGORITHM or not parts.path.endswith('/' + PROBE_KEY):
+        return None
+    _, _, region, service, _ = query['X-Amz-Credential'].rsplit('/', 4)
+    base_url = urlunsplit((parts.scheme, parts.netloc, parts.path[:-len(PROBE_KEY)], '', ''))
+    return SigV4Presigner(base_url, region, service)
+
+
+_presigners = {}
+_presigners_lock = threading.Lock()
+
+
+def get_sigv4_presigner(s3_client, bucket):
+    """
+    Return presigner of the bucket, made at the first call from a URL which the client presigns,
+    so the endpoint, addressing style and signing region are the ones of botocore.
+    :param s3_client: boto3 S3 client
+    :param bucket: bucket name
+    :return: SigV4Presigner, None when the client does not sign with signature version 4
+    """
+    key = (bucket, s3_client.meta.endpoint_url, s3_client.meta.region_name)
+    with _presigners_lock:
+        if key not in _presigners:
+            probe_url = s3_client.generate_presigned_url('get_object', Params={'Bucket': bucket, 'Key': PROBE_KEY},
+                                                         ExpiresIn=60)
+            _presigners[key] = presigner_for(probe_url)
+        return _presigners[key]
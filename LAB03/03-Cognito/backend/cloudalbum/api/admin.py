@@ -15,7 +15,7 @@ from botocore.exceptions import ClientError
 from werkzeug.exceptions import InternalServerError
 import shutil
 import socket
-import boto3
+from cloudalbum.util import aws_client
 
 admin_blueprint = Blueprint('admin', __name__)
 api = Api(admin_blueprint, doc='/swagger/', title='Admin',
@@ -37,9 +37,9 @@ class HealthCheck(Resource):
     def get(self):
         try:
             # 1. Is database available?!
-            boto3.client('dynamodb').describe_table(TableName='Photo')
+            aws_client.dynamodb().describe_table(TableName='Photo')
             # User table is no more used.
-            # boto3.client('dynamodb').describe_table(TableName='User')
+            # aws_client.dynamodb().describe_table(TableName='User')
 
             # 2. Is disk have enough free space?!
             total, used, free = shutil.disk_usage('/')
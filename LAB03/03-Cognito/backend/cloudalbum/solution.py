@@ -7,42 +7,56 @@
     :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
     :license: MIT, see LICENSE for more details.
 """
-import boto3
 import base64
 from datetime import datetime
 from flask import current_app as app
 from werkzeug.exceptions import Unauthorized
 from cloudalbum.database.model_ddb import Photo
+from cloudalbum.util import aws_client
+
+
+def solution_make_photo(user_id, filename, form, filesize, digest=None, stored_filename=None, formats=None):
+    return Photo(id=filename,
+                 user_id=user_id,
+                 filename=stored_filename or filename,
+                 digest=digest,
+                 formats=','.join(formats) if formats else None,
+                 filename_orig=form['file'].filename,
+                 filesize=filesize,
+                 upload_date=datetime.today(),
+                 tags=form['tags'],
+                 desc=form['desc'],
+                 geotag_lat=form['geotag_lat'],
+                 geotag_lng=form['geotag_lng'],
+                 taken_date=datetime.strptime(form['taken_date'], "%Y:%m:%d %H:%M:%S")
+                 if form['taken_date'] else None,
+                 make=form['make'],
+                 model=form['model'],
+                 width=form['width'],
+                 height=form['height'],
+                 city=form['city'],
+                 nation=form['nation'],
+                 address=form['address'])
+
+
+def solution_put_photo_info_ddb(user_id, filename, form, filesize, digest=None, stored_filename=None, formats=None):
+    new_photo = solution_make_photo(user_id, filename, form, filesize, digest, stored_filename, formats)
+    new_photo.save()
 
 
-def solution_put_photo_info_ddb(user_id, filename, form, filesize):
-    new_photo = Photo(id=filename,
-                      user_id=user_id,
-                      filename=filename,
-                      filename_orig=form['file'].filename,
-                      filesize=filesize,
-                      upload_date=datetime.today(),
-                      tags=form['tags'],
-                      desc=form['desc'],
-                      geotag_lat=form['geotag_lat'],
-                      geotag_lng=form['geotag_lng'],
-                      taken_date=datetime.strptime(form['taken_date'], "%Y:%m:%d %H:%M:%S"),
-                      make=form['make'],
-                      model=form['model'],
-                      width=form['width'],
-                      height=form['height'],
-                      city=form['city'],
-                      nation=form['nation'],
-                      address=form['address'])
-    new_photo.save()
+def solution_put_photos_ddb(photos):
+    # BatchWriteItem of 25 items per request, unprocessed items are retried by pynamodb.
+    with Photo.batch_write() as batch:
+        for photo in photos:
+            batch.save(photo)
 
 
-def solution_put_object_to_s3(s3_client, key, upload_file_stream):
+def solution_put_object_to_s3(s3_client, key, upload_file_stream, content_type='image/jpeg'):
     s3_client.put_object(
         Bucket=app.config['S3_PHOTO_BUCKET'],
         Key=key,
         Body=upload_file_stream,
-        ContentType='image/jpeg',
+        ContentType=content_type,
         StorageClass='STANDARD'
     )
     app.logger.debug('success:put object into s3:key:{}'.format(key))
@@ -59,7 +73,7 @@ def solution_generate_s3_presigned_url(s3_client, key):
 
 
 def user_signup_confirm(id):
-    client = boto3.client('cognito-idp')
+    client = aws_client.cognito()
     client.admin_confirm_sign_up(
         UserPoolId=app.config['COGNITO_POOL_ID'],
         Username=id
@@ -72,7 +86,7 @@ def solution_signup_cognito(user, dig):
     app.logger.info('Enroll user into Cognito!')
     app.logger.info('Follow the steps in the lab guide to replace this method with your own implementation.')
 
-    client = boto3.client('cognito-idp')
+    client = aws_client.cognito()
     response = client.sign_up(
         ClientId=app.config['COGNITO_CLIENT_ID'],
         SecretHash=base64.b64encode(dig).decode(),
@@ -104,7 +118,7 @@ def solution_get_cognito_user_data(access_token):
     app.logger.info('RUNNING TODO#8 SOLUTION CODE:')
     app.logger.info('Get user data from Cognito!')
     app.logger.info('Follow the steps in the lab guide to replace this method with your own implementation.')
-    client = boto3.client('cognito-idp')
+    client = aws_client.cognito()
 
     try:
         cognito_user = client.get_user(AccessToken=access_token)
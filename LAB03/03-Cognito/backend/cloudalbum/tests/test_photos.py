@@ -9,13 +9,16 @@
 """
 import hmac
 import boto3
+import uuid
 import pytest
 import base64
 import hashlib
 import unittest
+import requests
 from io import BytesIO
+from PIL import Image
 from cloudalbum.api.users import cognito_signin
-from cloudalbum.database.model_ddb import Photo
+from cloudalbum.database.model_ddb import Photo, PhotoContent, is_photo_id
 from cloudalbum.tests.base import BaseTestCase, user as existed_user
 
 upload = dict(
@@ -91,6 +94,86 @@ class TestPhotoService(BaseTestCase):
         )
         self.assert200(response)
 
+    def test_list_pages(self):
+        """Ensure the /photos/?limit=&cursor= returns the whole list page by page."""
+        for _ in range(3):
+            upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+            response = self.client.post(
+                '/photos/file',
+                headers=self.test_header,
+                content_type='multipart/form-data',
+                data=upload
+            )
+            self.assert200(response)
+        response = self.client.get('/photos/', headers=self.test_header)
+        self.assert200(response)
+        self.assertIsNone(response.get_json()['next_cursor'])
+        photo_ids = [photo['id'] for photo in response.get_json()['photos']]
+
+        paged_ids = []
+        query = {'limit': 2}
+        while True:
+            response = self.client.get('/photos/', headers=self.test_header, query_string=query)
+            self.assert200(response)
+            self.assertLessEqual(len(response.get_json()['photos']), 2)
+            paged_ids.extend(photo['id'] for photo in response.get_json()['photos'])
+            if not response.get_json()['next_cursor']:
+                break
+            query['cursor'] = response.get_json()['next_cursor']
+        self.assertEqual(paged_ids, photo_ids)
+
+        for query in [{'limit': -1}, {'limit': 100000}, {'limit': 2, 'cursor': '%%%'}]:
+            response = self.client.get('/photos/', headers=self.test_header, query_string=query)
+            self.assert400(response)
+
+    def test_list_order(self):
+        """Ensure the /photos/?order=&since=&until= returns the photos newest first in the order, within the dates."""
+        for _ in range(3):
+            upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+            response = self.client.post(
+                '/photos/file',
+                headers=self.test_header,
+                content_type='multipart/form-data',
+                data=upload
+            )
+            self.assert200(response)
+        response = self.client.get('/photos/', headers=self.test_header)
+        self.assert200(response)
+        photo_ids = [photo['id'] for photo in response.get_json()['photos']]
+        self.assertEqual(photo_ids, sorted(photo_ids, reverse=True))
+        self.assertTrue(all(is_photo_id(photo_id) for photo_id in photo_ids))
+
+        for query, expected in [({'since': '2000'}, photo_ids), ({'since': '2999'}, []),
+                                ({'order': 'taken_date', 'since': '2012-07', 'until': '2012-07'}, photo_ids),
+                                ({'order': 'taken_date', 'until': '2012-07-14'}, [])]:
+            response = self.client.get('/photos/', headers=self.test_header, query_string=query)
+            self.assert200(response)
+            self.assertEqual(sorted(photo['id'] for photo in response.get_json()['photos']), sorted(expected))
+
+        paged_ids = []
+        query = {'order': 'taken_date', 'limit': 2}
+        while True:
+            response = self.client.get('/photos/', headers=self.test_header, query_string=query)
+            self.assert200(response)
+            paged_ids.extend(photo['id'] for photo in response.get_json()['photos'])
+            if not response.get_json()['next_cursor']:
+                break
+            query['cursor'] = response.get_json()['next_cursor']
+        self.assertEqual(sorted(paged_ids), sorted(photo_ids))
+
+        response = self.client.get('/photos/', headers=self.test_header, query_string={'limit': 1})
+        cursor = response.get_json()['next_cursor']
+        for query in [{'since': 'x'}, {'since': '2020', 'until': '2019'}, {'order': 'name'},
+                      {'order': 'taken_date', 'limit': 1, 'cursor': cursor}]:
+            response = self.client.get('/photos/', headers=self.test_header, query_string=query)
+            self.assert400(response)
+        self.app.config['PHOTO_TAKEN_DATE_INDEX'] = False
+        try:
+            response = self.client.get('/photos/', headers=self.test_header, query_string={'order': 'taken_date'})
+            self.assert400(response)
+        finally:
+            self.app.config['PHOTO_TAKEN_DATE_INDEX'] = True
+
     def test_upload(self):
         """Ensure the /photos/file behaves correctly."""
         upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
@@ -102,6 +185,276 @@ class TestPhotoService(BaseTestCase):
         )
         self.assert200(response)
 
+    def test_list_stream(self):
+        """Ensure the /photos/ streams the same list batch by batch when PHOTO_LIST_STREAM is on."""
+        for _ in range(3):
+            upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+            response = self.client.post(
+                '/photos/file',
+                headers=self.test_header,
+                content_type='multipart/form-data',
+                data=upload
+            )
+            self.assert200(response)
+        response = self.client.get('/photos/', headers=self.test_header, query_string={'limit': 3})
+        self.assert200(response)
+        expected = response.get_json()
+
+        self.app.config.update(PHOTO_LIST_STREAM=True, PHOTO_LIST_STREAM_BATCH=2)
+        try:
+            response = self.client.get('/photos/', headers=self.test_header, query_string={'limit': 3})
+        finally:
+            self.app.config.update(PHOTO_LIST_STREAM=False, PHOTO_LIST_STREAM_BATCH=100)
+        self.assert200(response)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual([photo['id'] for photo in response.get_json()['photos']],
+                         [photo['id'] for photo in expected['photos']])
+        self.assertEqual(response.get_json()['next_cursor'], expected['next_cursor'])
+
+    def test_list_view(self):
+        """Ensure the /photos/ returns the list attributes only unless view=full is given."""
+        upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+        response = self.client.post(
+            '/photos/file',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=upload
+        )
+        self.assert200(response)
+        photo_id = response.get_json()['photo_id']
+
+        # Reads the table, the list index is updated asynchronously.
+        self.app.config['PHOTO_LIST_INDEX'] = False
+        try:
+            views = {}
+            for view in ['list', 'full']:
+                response = self.client.get('/photos/', headers=self.test_header, query_string={'view': view})
+                self.assert200(response)
+                views[view] = next(photo for photo in response.get_json()['photos'] if photo['id'] == photo_id)
+        finally:
+            self.app.config['PHOTO_LIST_INDEX'] = True
+        self.assertEqual(views['list']['address'], upload['address'])
+        self.assertIn('thumbSrc', views['list'])
+        self.assertNotIn('make', views['list'])
+        self.assertEqual(views['full']['make'], upload['make'])
+
+        response = self.client.get('/photos/', headers=self.test_header, query_string={'view': 'grid'})
+        self.assert400(response)
+
+    def test_list_etag(self):
+        """Ensure the default /photos/ returns 304 for the ETag of the list until a photo is uploaded or deleted."""
+        response = self.client.get('/photos/', headers=self.test_header)
+        self.assert200(response)
+        etag = response.headers['ETag']
+        headers = dict(self.test_header, **{'If-None-Match': etag})
+        response = self.client.get('/photos/', headers=headers)
+        self.assertStatus(response, 304)
+        response = self.client.get('/photos/', headers=headers, query_string={'view': 'full'})
+        self.assert200(response)
+
+        upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+        response = self.client.post(
+            '/photos/file',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=upload
+        )
+        self.assert200(response)
+        photo_id = response.get_json()['photo_id']
+        response = self.client.get('/photos/', headers=headers)
+        self.assert200(response)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        headers['If-None-Match'] = response.headers['ETag']
+        response = self.client.delete('/photos/{}'.format(photo_id), headers=self.test_header)
+        self.assert200(response)
+        response = self.client.get('/photos/', headers=headers)
+        self.assert200(response)
+
+        # Without ETag the list reads the list index.
+        self.app.config['PHOTO_LIST_ETAG'] = False
+        try:
+            response = self.client.get('/photos/', headers=headers)
+            self.assert200(response)
+            self.assertNotIn('ETag', response.headers)
+        finally:
+            self.app.config['PHOTO_LIST_ETAG'] = True
+
+    def test_upload_streaming(self):
+        """Ensure the /photos/file behaves correctly with S3 multipart streaming upload."""
+        self.app.config['S3_STREAMING_UPLOAD'] = True
+        upload['file'] = (BytesIO(b'my file contents'), 'test_image.jpg')
+        try:
+            response = self.client.post(
+                '/photos/file',
+                headers=self.test_header,
+                content_type='multipart/form-data',
+                data=upload
+            )
+        finally:
+            self.app.config['S3_STREAMING_UPLOAD'] = False
+        self.assert200(response)
+
+    def test_upload_url(self):
+        """Ensure the /photos/upload-url and /photos/upload-complete upload straight to S3."""
+        response = self.client.post(
+            '/photos/upload-url',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data={'filename_orig': 'test_image.jpg'}
+        )
+        self.assert200(response)
+        post = response.get_json()
+        fields = dict(post['fields'], **{'Content-Type': 'image/jpeg'})
+        response = requests.post(post['url'], data=fields, files={'file': BytesIO(b'my file contents')})
+        self.assertEqual(response.status_code, 204)
+
+        data = {key: value for key, value in upload.items() if key != 'file'}
+        data['filename'] = post['filename']
+        response = self.client.post(
+            '/photos/upload-complete',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=data
+        )
+        self.assert200(response)
+
+        # The original is registered to the photo now, completing it again would share it.
+        response = self.client.post(
+            '/photos/upload-complete',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=data
+        )
+        self.assert400(response)
+
+    def test_upload_session(self):
+        """Ensure the /photos/uploads receives chunks, reports the offset to resume from, and saves the photo."""
+        response = self.client.post(
+            '/photos/uploads',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data={'filename_orig': 'test_image.jpg'}
+        )
+        self.assert200(response)
+        session = response.get_json()
+        url = '/photos/uploads/{0}'.format(session['filename'])
+        query = {'upload_id': session['upload_id']}
+        data = dict({key: value for key, value in upload.items() if key != 'file'}, upload_id=session['upload_id'])
+
+        # Nothing is received yet.
+        response = self.client.post(url + '/complete', headers=self.test_header,
+                                    content_type='multipart/form-data', data=data)
+        self.assert400(response)
+
+        response = self.client.put(url + '/1', headers=self.test_header, query_string=query,
+                                   data=b'my file contents')
+        self.assert200(response)
+        response = self.client.get(url, headers=self.test_header, query_string=query)
+        self.assert200(response)
+        self.assertEqual(response.get_json()['received'], len(b'my file contents'))
+
+        response = self.client.post(url + '/complete', headers=self.test_header,
+                                    content_type='multipart/form-data', data=data)
+        self.assert200(response)
+        response = self.client.get(url, headers=self.test_header, query_string=query)
+        self.assert404(response)
+
+    def test_upload_files(self):
+        """Ensure the /photos/files saves several photos in one request, with the result of each file."""
+        data = {key: value for key, value in upload.items() if key != 'file'}
+        data['files'] = [(BytesIO(uuid.uuid4().bytes), 'test_first.jpg'),
+                         (BytesIO(uuid.uuid4().bytes), 'test_second.png'),
+                         (BytesIO(b'not an image'), 'test_notes.txt')]
+        response = self.client.post(
+            '/photos/files',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=data
+        )
+        self.assert200(response)
+        files = response.get_json()['files']
+        self.assertEqual([item['ok'] for item in files], [True, True, False])
+        self.assertEqual([item['filename_orig'] for item in files],
+                         ['test_first.jpg', 'test_second.png', 'test_notes.txt'])
+
+    def test_upload_duplicate(self):
+        """Ensure the same content uploaded again shares the stored objects."""
+        contents = uuid.uuid4().bytes
+        photos = []
+        for _ in range(2):
+            upload['file'] = (BytesIO(contents), 'test_image.jpg')
+            response = self.client.post(
+                '/photos/file',
+                headers=self.test_header,
+                content_type='multipart/form-data',
+                data=upload
+            )
+            self.assert200(response)
+            photos.append(response.get_json())
+        self.assertEqual([photo['duplicate'] for photo in photos], [False, True])
+        # The photo sharing the stored objects has their renditions
+        formats = [item.formats for photo in photos
+                   for item in Photo.scan(Photo.id == photo['photo_id'], attributes_to_get=['formats'])]
+        self.assertEqual(len(formats), 2)
+        self.assertEqual(formats[1], formats[0])
+
+        # Deleting one photo keeps the objects of the other
+        response = self.client.delete(
+            '/photos/{}'.format(photos[0]['photo_id']),
+            headers=self.test_header,
+            content_type='application/json',
+        )
+        self.assert200(response)
+        response = self.client.delete(
+            '/photos/{}'.format(photos[1]['photo_id']),
+            headers=self.test_header,
+            content_type='application/json',
+        )
+        self.assert200(response)
+
+    def test_digest_check(self):
+        """Ensure the /photos/digest saves a photo without file transfer when the content is stored."""
+        contents = uuid.uuid4().bytes
+        data = {key: value for key, value in upload.items() if key != 'file'}
+        data['digest'] = hashlib.sha256(contents).hexdigest()
+        response = self.client.post(
+            '/photos/digest',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=data
+        )
+        self.assert200(response)
+        self.assertFalse(response.get_json()['exists'])
+
+        upload['file'] = (BytesIO(contents), 'test_image.jpg')
+        response = self.client.post(
+            '/photos/file',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=upload
+        )
+        self.assert200(response)
+
+        response = self.client.post(
+            '/photos/digest',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=data
+        )
+        self.assert200(response)
+        self.assertTrue(response.get_json()['exists'])
+
+        # A photo which could not be saved releases its reference to the content
+        response = self.client.post(
+            '/photos/digest',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=dict(data, taken_date='not a date')
+        )
+        self.assert500(response)
+        self.assertEqual([item.ref_count for item in PhotoContent.scan(PhotoContent.digest == data['digest'])], [2])
+
     def test_delete(self):
         """Ensure the /photos/<photo_id> route behaves correctly."""
         # 1. upload
@@ -153,6 +506,34 @@ class TestPhotoService(BaseTestCase):
         )
         self.assert200(response)
 
+    def test_get_sized(self):
+        """Ensure the /photos/<photo_id>?w=&h=&fit= makes a rendition of the size rounded up to RENDITION_SIZES."""
+        original = BytesIO()
+        Image.new('RGB', (1200, 800), (120, 80, 40)).save(original, 'JPEG')
+        original.seek(0)
+        upload['file'] = (original, 'test_image.jpg')
+        response = self.client.post(
+            '/photos/file',
+            headers=self.test_header,
+            content_type='multipart/form-data',
+            data=upload
+        )
+        self.assert200(response)
+        photo_id = response.get_json()['photo_id']
+
+        for query, size in [({'w': 300}, (320, 213)), ({'w': 100, 'h': 100, 'fit': 'cover'}, (160, 160))]:
+            response = self.client.get(
+                '/photos/{}'.format(photo_id),
+                headers=self.test_header,
+                query_string=query
+            )
+            self.assert200(response)
+            self.assertEqual(Image.open(BytesIO(requests.get(response.get_json()).content)).size, size)
+
+        response = self.client.get('/photos/{}'.format(photo_id), headers=self.test_header,
+                                   query_string={'w': 100, 'fit': 'stretch'})
+        self.assert400(response)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -8,11 +8,25 @@
     :license: MIT, see LICENSE for more details.
 """
 import os
-import boto3
-from io import BytesIO
+import hashlib
 from flask import current_app as app
-from PIL import Image
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait
+from botocore.exceptions import ClientError
+from pynamodb.exceptions import PutError, UpdateError, DeleteError
+from cloudalbum.database.model_ddb import PhotoContent
+from cloudalbum.util import aws_client
+from cloudalbum.util.rendition import parse_renditions, make_renditions, get_rendition_pool, supported_formats, \
+    rendition_key, rendition_path, content_type, best_format, parse_sizes, quantize_size, sized_rendition_path, \
+    get_rendition_cache, RENDITION_FORMATS, SIZED_FOLDER
+from cloudalbum.util.exif import read_image_info, HEADER_SIZE
+from cloudalbum.util.presign import get_presigned_url_cache, get_sigv4_presigner, cache_control
+from cloudalbum.util.serializer import FieldPlan
+from tempfile import SpooledTemporaryFile
 from cloudalbum.solution import solution_put_object_to_s3, solution_generate_s3_presigned_url
 
 
@@ -20,43 +34,283 @@ def email_normalize(email):
     return email.replace('@', '_at_').replace('.', '_dot_')
 
 
+_io_executor = None
+_io_workers = None
+_io_executor_lock = threading.Lock()
+
+
+def get_io_executor(workers):
+    """
+    Return the S3 I/O executor of this process, which is created at the first call.
+    :param workers: max number of S3 requests in flight
+    :return: ThreadPoolExecutor
+    """
+    global _io_executor, _io_workers
+    with _io_executor_lock:
+        if _io_executor is None or _io_workers != workers:
+            if _io_executor is not None:
+                _io_executor.shutdown(wait=False)
+            _io_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='s3-io')
+            _io_workers = workers
+        return _io_executor
+
+
+_batch_executor = None
+_batch_workers = None
+_batch_executor_lock = threading.Lock()
+
+
+def get_batch_executor(workers):
+    """
+    Return the executor saving files of batch uploads, which is created at the first call.
+    It is not the S3 I/O executor, since each file waits there for its own PUTs.
+    :param workers: max number of files saved at once
+    :return: ThreadPoolExecutor
+    """
+    global _batch_executor, _batch_workers
+    with _batch_executor_lock:
+        if _batch_executor is None or _batch_workers != workers:
+            if _batch_executor is not None:
+                _batch_executor.shutdown(wait=False)
+            _batch_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload-batch')
+            _batch_workers = workers
+        return _batch_executor
+
+
+def run_in_app_context(application, func, *args):
+    with application.app_context():
+        return func(*args)
+
+
+def submit_s3(func, *args):
+    """
+    Run func(*args) on the S3 I/O executor, within the application context of the caller.
+    :return: concurrent.futures.Future
+    """
+    executor = get_io_executor(int(app.config['S3_UPLOAD_WORKERS']))
+    return executor.submit(run_in_app_context, app._get_current_object(), func, *args)
+
+
+def map_batch(func, items):
+    """
+    Run func(item) for each item on the batch executor, within the application context of the caller.
+    At most UPLOAD_BATCH_WORKERS items run at once in the process.
+    :return: list of (result, exception) in the order of items
+    """
+    executor = get_batch_executor(int(app.config['UPLOAD_BATCH_WORKERS']))
+    futures = [executor.submit(run_in_app_context, app._get_current_object(), func, item) for item in items]
+    wait(futures)
+    return [(None, future.exception()) if future.exception() is not None else (future.result(), None)
+            for future in futures]
+
+
+def wait_s3_puts(s3_client, futures, done_keys=()):
+    """
+    Wait for the PUTs submitted by submit_s3(). When any of them failed, the objects which were
+    put successfully, and done_keys already uploaded before, are deleted and the error is raised.
+    :param s3_client: boto3 S3 client
+    :param futures: dict, future to S3 key
+    :param done_keys: S3 keys already uploaded by the caller
+    :return: None
+    """
+    wait(futures)
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if not errors:
+        return
+
+    keys = list(done_keys) + [key for future, key in futures.items() if future.exception() is None]
+    for key in keys:
+        try:
+            s3_client.delete_object(Bucket=app.config['S3_PHOTO_BUCKET'], Key=key)
+            app.logger.debug('rollback: s3://{0}/{1} deleted'.format(app.config['S3_PHOTO_BUCKET'], key))
+        except Exception as e:
+            app.logger.error('ERROR:rollback of s3://{0}/{1} failed:{2}'.format(app.config['S3_PHOTO_BUCKET'],
+                                                                                key, e))
+    raise errors[0]
+
+
+def find_content_ref(user_id, digest):
+    """
+    Take a reference to the content already stored by the user, see PhotoContent.
+    :param user_id: user id
+    :param digest: SHA-256 hex digest of the original
+    :return: PhotoContent of the stored original, or None when the content is not stored
+    """
+    if not user_id or not digest:
+        return None
+    content = PhotoContent(user_id, digest.lower())
+    try:
+        content.update(actions=[PhotoContent.ref_count.add(1)], condition=PhotoContent.digest.exists())
+    except UpdateError as e:
+        if e.cause_response_code == 'ConditionalCheckFailedException':
+            return None
+        raise e
+    return content
+
+
+def index_content(user_id, digest, filename, filesize, email, formats=()):
+    """
+    Register the stored original in the user's content index. When the same content was registered
+    by a concurrent upload meanwhile, the objects just stored are deleted and the registered ones are used.
+    :param user_id: user id
+    :param digest: SHA-256 hex digest of the original
+    :param filename: secure filename of the stored original
+    :param filesize: file size (byte)
+    :param email: user email address
+    :param formats: extra formats of the stored renditions, see rendition_formats()
+    :return: PhotoContent of the stored original, not saved when user_id is not given
+    """
+    content = PhotoContent(user_id, digest, filename=filename, filesize=filesize, ref_count=1,
+                           formats=','.join(formats) or None)
+    if not user_id:
+        return content
+    try:
+        content.save(condition=PhotoContent.digest.does_not_exist())
+        return content
+    except PutError as e:
+        if e.cause_response_code != 'ConditionalCheckFailedException':
+            raise e
+
+    stored = find_content_ref(user_id, digest)
+    if stored is None:
+        return index_content(user_id, digest, filename, filesize, email, formats)
+    delete_s3(filename, email)
+    return stored
+
+
+def release_content(user_id, digest):
+    """
+    Drop a reference to the content of a deleted photo.
+    :param user_id: user id
+    :param digest: SHA-256 hex digest of the original, None for a photo out of the content index
+    :return: Boolean, True when no photo refers to the stored objects any more
+    """
+    if not digest:
+        return True
+    content = PhotoContent(user_id, digest)
+    try:
+        content.update(actions=[PhotoContent.ref_count.add(-1)], condition=PhotoContent.digest.exists())
+    except UpdateError as e:
+        if e.cause_response_code == 'ConditionalCheckFailedException':
+            return True
+        raise e
+    if content.ref_count > 0:
+        return False
+    try:
+        content.delete(condition=PhotoContent.ref_count <= 0)
+    except DeleteError as e:
+        if e.cause_response_code == 'ConditionalCheckFailedException':
+            # A concurrent upload took a reference meanwhile.
+            return False
+        raise e
+    return True
+
+
+def release_upload(user_id, digest, filename, email):
+    """
+    Drop the reference taken by save_s3() or find_content_ref() for a photo which is not saved,
+    the stored objects are deleted when no photo refers to them. Errors are logged only, the error
+    of the upload is the one to report.
+    :param user_id: user id
+    :param digest: SHA-256 hex digest of the original
+    :param filename: secure filename of the stored original
+    :param email: user email address
+    :return: None
+    """
+    try:
+        if release_content(user_id, digest):
+            delete_s3(filename, email)
+    except Exception as e:
+        app.logger.error('ERROR:rollback of content {0} failed:{1}'.format(filename, e))
+
+
+def rendition_formats():
+    """
+    Return extra formats of renditions made for uploads, see THUMBNAIL_FORMATS.
+    :return: list of format names
+    """
+    return supported_formats(app.config['THUMBNAIL_FORMATS'])
+
+
+def photo_formats(photo):
+    """
+    Return extra formats of the photo renditions, photos uploaded before THUMBNAIL_FORMATS have none.
+    :param photo: Photo or PhotoContent
+    :return: list of format names
+    """
+    return [format for format in (photo.formats or '').split(',') if format]
+
+
+def render_renditions(file_p, renditions, formats=()):
+    """
+    Make renditions, in the rendition process pool when THUMBNAIL_PROCESSES is set.
+    :param file_p: pathlib.Path or file object of original image
+    :param renditions: list of (name, (width, height)), see parse_renditions()
+    :param formats: extra formats, see rendition_formats()
+    :return: dict, rendition key to image bytes, see rendition_key()
+    """
+    processes = int(app.config['THUMBNAIL_PROCESSES'])
+    if processes <= 0:
+        return make_renditions(file_p, renditions, formats=formats)
+
+    data = file_p.read_bytes() if isinstance(file_p, Path) else file_p.read()
+    pool = get_rendition_pool(processes, int(app.config['THUMBNAIL_PROCESS_QUEUE']))
+    return pool.make_renditions(data, renditions, formats=formats)
+
+
 def make_thumbnail(path, filename):
     """
-    Generate thumbnail from original image file.
+    Generate thumbnail and the other renditions from original image file.
+    Each rendition is saved in the folder named after it, e.g. 'thumbnails'.
     :param path: pathlib.Path, which pointing a original file directory
     :param filename: secure file name
     :return: None
     """
-    thumb_path = path / 'thumbnails'
-    thumb_file_location = thumb_path / filename
-
     try:
-        if not thumb_path.exists():
-            thumb_path.mkdir()
-            app.logger.info("Create folder for thumbnails: %s", str(thumb_path))
-
-        im = Image.open(path / filename)
-        im = im.convert('RGB')
-        im.thumbnail((300, 200, Image.ANTIALIAS))
-        im.save(thumb_file_location)
-        app.logger.debug("success:thumbnail saved!:{}".format(str(thumb_file_location)))
+        renditions = render_renditions(path / filename, parse_renditions(app.config['THUMBNAIL_RENDITIONS']))
+        for name, image_bytes in renditions.items():
+            rendition_path = path / name
+            if not rendition_path.exists():
+                rendition_path.mkdir()
+                app.logger.info("Create folder for %s: %s", name, str(rendition_path))
+
+            (rendition_path / filename).write_bytes(image_bytes)
+            app.logger.debug("success:{0} saved!:{1}".format(name, str(rendition_path / filename)))
     except Exception as e:
-        app.logger.error("ERROR:Thumbnails creation error:{}".format(str(thumb_file_location)))
+        app.logger.error("ERROR:Thumbnails creation error:{}".format(str(path / filename)))
         app.logger.error(e)
 
 
 def make_thumbnails_s3(file_p):
-    result_bytes_stream = BytesIO()
-
+    """
+    Generate thumbnail and the other renditions from original image, decoding it only once.
+    Each rendition is also encoded in the formats of THUMBNAIL_FORMATS.
+    :param file_p: file object of original image
+    :return: dict, rendition key to image bytes, see rendition_key()
+    """
+    renditions = parse_renditions(app.config['THUMBNAIL_RENDITIONS'])
     try:
-        im = Image.open(file_p)
-        im = im.convert('RGB')
-        im.thumbnail((app.config['THUMBNAIL_WIDTH'], app.config['THUMBNAIL_HEIGHT'], Image.ANTIALIAS))
-        im.save(result_bytes_stream, 'JPEG')
+        return render_renditions(file_p, renditions, rendition_formats())
     except Exception as e:
         app.logger.debug(e)
 
-    return result_bytes_stream.getvalue()
+    return {name: b'' for name, _ in renditions}
+
+
+def put_thumbnails_s3(s3_client, prefix, filename, renditions):
+    """
+    Start uploads of renditions made by make_thumbnails_s3(), each one under the prefix named after it.
+    :param s3_client: boto3 S3 client
+    :param prefix: S3 prefix of user photos
+    :param filename: secure filename
+    :param renditions: dict, rendition key to image bytes
+    :return: dict, future to S3 key, see wait_s3_puts()
+    """
+    futures = {}
+    for name, image_bytes in renditions.items():
+        key = "{0}{1}".format(prefix, rendition_path(name, filename))
+        futures[submit_s3(solution_put_object_to_s3, s3_client, key, image_bytes, content_type(name))] = key
+    return futures
 
 
 def delete(filename, email):
@@ -68,14 +322,15 @@ def delete(filename, email):
     """
     try:
         base_path = Path(app.config['UPLOAD_DIR']) / email_normalize(email)
-        thumbnail_file_location = base_path / 'thumbnails' / filename
         original_file_location = base_path / filename
 
-        if thumbnail_file_location.exists():
-            Path.unlink(thumbnail_file_location)
-            app.logger.debug('success:thumbnail file deleted:filepath:{}'.format(thumbnail_file_location))
-        else:
-            app.logger.debug('DEBUG:thumbnail file not exist:filepath:{}'.format(thumbnail_file_location))
+        for name, _ in parse_renditions(app.config['THUMBNAIL_RENDITIONS']):
+            thumbnail_file_location = base_path / name / filename
+            if thumbnail_file_location.exists():
+                Path.unlink(thumbnail_file_location)
+                app.logger.debug('success:thumbnail file deleted:filepath:{}'.format(thumbnail_file_location))
+            else:
+                app.logger.debug('DEBUG:thumbnail file not exist:filepath:{}'.format(thumbnail_file_location))
 
         if original_file_location.exists():
             Path.unlink(original_file_location)
@@ -93,15 +348,20 @@ def delete(filename, email):
 
 def delete_s3(filename, email):
     prefix = "photos/{0}/".format(email_normalize(email))
-    prefix_thumb = "photos/{0}/thumbnails/".format(email_normalize(email))
-
     key = "{0}{1}".format(prefix, filename)
-    key_thumb = "{0}{1}".format(prefix_thumb, filename)
 
-    s3_client = boto3.client('s3')
+    s3_client = aws_client.s3()
     try:
         s3_client.delete_object(Bucket=app.config['S3_PHOTO_BUCKET'], Key=key)
-        s3_client.delete_object(Bucket=app.config['S3_PHOTO_BUCKET'], Key=key_thumb)
+        for name, _ in parse_renditions(app.config['THUMBNAIL_RENDITIONS']):
+            for format in RENDITION_FORMATS:
+                s3_client.delete_object(Bucket=app.config['S3_PHOTO_BUCKET'],
+                                        Key=prefix + rendition_path(rendition_key(name, format), filename))
+        sized_prefix = '{0}{1}/{2}/'.format(prefix, SIZED_FOLDER, filename)
+        for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=app.config['S3_PHOTO_BUCKET'],
+                                                                        Prefix=sized_prefix):
+            for item in page.get('Contents', []):
+                s3_client.delete_object(Bucket=app.config['S3_PHOTO_BUCKET'], Key=item['Key'])
         app.logger.debug("success:s3 file delete done:{}".format(filename))
         return True
     except Exception as e:
@@ -140,39 +400,408 @@ def save(upload_file, filename, email):
         raise e
 
 
-def save_s3(upload_file_stream, filename, email):
-    prefix = "photos/{0}/".format(email_normalize(email))
-    prefix_thumb = "photos/{0}/thumbnails/".format(email_normalize(email))
+def save_s3(upload_file_stream, filename, email, user_id=None):
+    """
+    Upload input file (photo) to S3 with its thumbnail files.
+    When user_id is given, the content which the user already stored is not uploaded again.
+    Photo information is read from the head of the original on the way, see read_image_info().
+    :param upload_file_stream: file object
+    :param filename: secure filename for upload
+    :param email: user email address
+    :param user_id: user id of the content index, see PhotoContent
+    :return: (file size (byte), PhotoContent of the stored original, SHA-256 hex digest, photo information dict)
+    """
+    if app.config['S3_STREAMING_UPLOAD']:
+        return save_s3_stream(upload_file_stream, filename, email, user_id)
 
+    prefix = "photos/{0}/".format(email_normalize(email))
     key = "{0}{1}".format(prefix, filename)
-    key_thumb = "{0}{1}".format(prefix_thumb, filename)
 
-    s3_client = boto3.client('s3')
+    s3_client = aws_client.s3()
     original_bytes = upload_file_stream.stream.read()
+    digest = hashlib.sha256(original_bytes).hexdigest()
+    image_info = read_image_info(original_bytes[:HEADER_SIZE])
+    stored = find_content_ref(user_id, digest)
+    if stored is not None:
+        app.logger.debug('success: same content is stored:{0}'.format(stored.filename))
+        return len(original_bytes), stored, digest, image_info
 
     try:
-        solution_put_object_to_s3(s3_client, key, original_bytes)
+        futures = {submit_s3(solution_put_object_to_s3, s3_client, key, original_bytes): key}
 
+        # Make thumbnail files while the original is uploading
+        futures.update(put_thumbnails_s3(s3_client, prefix, filename, make_thumbnails_s3(BytesIO(original_bytes))))
+        wait_s3_puts(s3_client, futures)
         app.logger.debug('success: s3://{0}/{1} uploaded'.format(app.config['S3_PHOTO_BUCKET'], key))
 
-        # Save thumbnail file
-        upload_file_stream.stream.seek(0)
-        solution_put_object_to_s3(s3_client, key_thumb, make_thumbnails_s3(upload_file_stream))
+        stored = index_content(user_id, digest, filename, len(original_bytes), email, rendition_formats())
+        return len(original_bytes), stored, digest, image_info
+    except Exception as e:
+        app.logger.error('Error occurred while saving file to S3:%s', e)
+        raise e
+
+
+def presigned_post(filename, email):
+    """
+    Return presigned POST policy, which lets the client upload the original straight to S3.
+    The policy is scoped to the key of the photo and accepts only images up to S3_UPLOAD_MAX_SIZE.
+    :param filename: secure filename for upload
+    :param email: user email address
+    :return: dict, 'url' and 'fields' of the form to POST
+    """
+    key = "photos/{0}/{1}".format(email_normalize(email), filename)
+    return aws_client.s3().generate_presigned_post(
+        Bucket=app.config['S3_PHOTO_BUCKET'],
+        Key=key,
+        Conditions=[['starts-with', '$Content-Type', 'image/'],
+                    ['content-length-range', 1, app.config['S3_UPLOAD_MAX_SIZE']]],
+        ExpiresIn=app.config['S3_PRESIGNED_POST_EXPIRE_TIME'])
+
+
+def complete_s3_upload(filename, email):
+    """
+    Make and upload thumbnail files of the original which the client uploaded with presigned_post(),
+    and read photo information from its head.
+    :param filename: secure filename of the upload
+    :param email: user email address
+    :return: (file size (byte), photo information dict)
+    """
+    prefix = "photos/{0}/".format(email_normalize(email))
+    key = "{0}{1}".format(prefix, filename)
+
+    s3_client = aws_client.s3()
+    try:
+        original_bytes = s3_client.get_object(Bucket=app.config['S3_PHOTO_BUCKET'], Key=key)['Body'].read()
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            raise FileNotFoundError(key)
+        raise e
+
+    try:
+        futures = put_thumbnails_s3(s3_client, prefix, filename, make_thumbnails_s3(BytesIO(original_bytes)))
+        wait_s3_puts(s3_client, futures, done_keys=[key])
+        app.logger.debug('success: s3://{0}/{1} upload completed'.format(app.config['S3_PHOTO_BUCKET'], key))
+        return len(original_bytes), read_image_info(original_bytes[:HEADER_SIZE])
+    except Exception as e:
+        app.logger.error('Error occurred while completing upload to S3:%s', e)
+        raise e
 
-        app.logger.debug('s3://{0}/{1} uploaded'.format(app.config['S3_PHOTO_BUCKET'], key_thumb))
 
-        return len(original_bytes)
+def no_such_upload(e):
+    return isinstance(e, ClientError) and e.response['Error']['Code'] in ('NoSuchUpload', '404')
+
+
+def max_chunks(chunk_size, max_size):
+    """
+    Return max number of chunks of a resumable upload, S3 multipart upload takes 10,000 parts at most.
+    :param chunk_size: size of a chunk (byte)
+    :param max_size: max size of the original (byte)
+    :return: int
+    """
+    return min(-(-max_size // chunk_size), 10000)
+
+
+def received_size(chunks, chunk_size):
+    """
+    Return size of the head of the file which is received without a gap, the client resumes from there.
+    :param chunks: list of (chunk number, size) sorted by chunk number, numbers start from 1
+    :param chunk_size: size of a chunk (byte)
+    :return: offset (byte)
+    """
+    size = 0
+    for expected, (number, chunk_len) in enumerate(chunks, 1):
+        if number != expected:
+            break
+        size += chunk_len
+        if chunk_len < chunk_size:
+            break
+    return size
+
+
+def check_chunks(chunks, chunk_size):
+    """
+    Check the chunks make up the whole file, numbered from 1 without a gap and of chunk_size except the last one.
+    :param chunks: list of (chunk number, size) sorted by chunk number
+    :param chunk_size: size of a chunk (byte)
+    :return: file size (byte)
+    :raise ValueError: when a chunk is missing or of a wrong size
+    """
+    if not chunks:
+        raise ValueError('No chunk is received')
+    for expected, (number, chunk_len) in enumerate(chunks, 1):
+        if number != expected:
+            raise ValueError('Chunk {0} is missing'.format(expected))
+        if chunk_len != chunk_size and expected != len(chunks):
+            raise ValueError('Chunk {0} is {1} bytes, not {2}'.format(number, chunk_len, chunk_size))
+    return sum(chunk_len for _, chunk_len in chunks)
+
+
+def create_upload_session(filename, email):
+    """
+    Start a resumable upload of the original, backed by S3 multipart upload. Each chunk is a part of
+    S3_MULTIPART_CHUNK_SIZE bytes, the last one may be smaller. Stale sessions are aborted on the way,
+    see collect_stale_uploads().
+    :param filename: secure filename for upload
+    :param email: user email address
+    :return: S3 upload id of the session
+    """
+    maybe_collect_stale_uploads()
+    key = "photos/{0}/{1}".format(email_normalize(email), filename)
+    upload_id = aws_client.s3().create_multipart_upload(Bucket=app.config['S3_PHOTO_BUCKET'], Key=key,
+                                                        ContentType='image/jpeg',
+                                                        StorageClass='STANDARD')['UploadId']
+    app.logger.debug('success: upload session of s3://{0}/{1} created'.format(app.config['S3_PHOTO_BUCKET'], key))
+    return upload_id
+
+
+def upload_chunk(filename, email, upload_id, number, data):
+    """
+    Upload a chunk of the resumable upload, a chunk received before is replaced.
+    :param filename: secure filename of the upload
+    :param email: user email address
+    :param upload_id: S3 upload id, see create_upload_session()
+    :param number: chunk number, starts from 1
+    :param data: bytes of the chunk
+    :return: None
+    :raise FileNotFoundError: when the session is finished, aborted or unknown
+    """
+    key = "photos/{0}/{1}".format(email_normalize(email), filename)
+    try:
+        aws_client.s3().upload_part(Bucket=app.config['S3_PHOTO_BUCKET'], Key=key, UploadId=upload_id,
+                                    PartNumber=number, Body=data)
+    except ClientError as e:
+        if no_such_upload(e):
+            raise FileNotFoundError(key)
+        raise e
+
+
+def list_chunks(filename, email, upload_id):
+    """
+    Return the chunks which the resumable upload received.
+    :param filename: secure filename of the upload
+    :param email: user email address
+    :param upload_id: S3 upload id, see create_upload_session()
+    :return: list of (chunk number, size, ETag) sorted by chunk number
+    :raise FileNotFoundError: when the session is finished, aborted or unknown
+    """
+    key = "photos/{0}/{1}".format(email_normalize(email), filename)
+    paginator = aws_client.s3().get_paginator('list_parts')
+    try:
+        return [(part['PartNumber'], part['Size'], part['ETag'])
+                for page in paginator.paginate(Bucket=app.config['S3_PHOTO_BUCKET'], Key=key, UploadId=upload_id)
+                for part in page.get('Parts', [])]
+    except ClientError as e:
+        if no_such_upload(e):
+            raise FileNotFoundError(key)
+        raise e
+
+
+def finish_upload_session(filename, email, upload_id):
+    """
+    Assemble the chunks of the resumable upload into the original, then make its thumbnails
+    and read photo information as complete_s3_upload() does.
+    :param filename: secure filename of the upload
+    :param email: user email address
+    :param upload_id: S3 upload id, see create_upload_session()
+    :return: (file size (byte), photo information dict)
+    :raise FileNotFoundError: when the session is finished, aborted or unknown
+    :raise ValueError: when a chunk is missing or of a wrong size, the session is kept to resume
+    """
+    chunks = list_chunks(filename, email, upload_id)
+    check_chunks([(number, size) for number, size, _ in chunks], app.config['S3_MULTIPART_CHUNK_SIZE'])
+
+    key = "photos/{0}/{1}".format(email_normalize(email), filename)
+    try:
+        aws_client.s3().complete_multipart_upload(
+            Bucket=app.config['S3_PHOTO_BUCKET'], Key=key, UploadId=upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': etag} for number, _, etag in chunks]})
+    except ClientError as e:
+        if no_such_upload(e):
+            raise FileNotFoundError(key)
+        raise e
+    app.logger.debug('success: s3://{0}/{1} assembled: {2} chunks'.format(app.config['S3_PHOTO_BUCKET'], key,
+                                                                           len(chunks)))
+    return complete_s3_upload(filename, email)
+
+
+def abort_upload_session(filename, email, upload_id):
+    """
+    Abort the resumable upload and drop the chunks received.
+    :param filename: secure filename of the upload
+    :param email: user email address
+    :param upload_id: S3 upload id, see create_upload_session()
+    :return: None
+    :raise FileNotFoundError: when the session is finished, aborted or unknown
+    """
+    key = "photos/{0}/{1}".format(email_normalize(email), filename)
+    try:
+        aws_client.s3().abort_multipart_upload(Bucket=app.config['S3_PHOTO_BUCKET'], Key=key, UploadId=upload_id)
+    except ClientError as e:
+        if no_such_upload(e):
+            raise FileNotFoundError(key)
+        raise e
+
+
+def collect_stale_uploads(max_age):
+    """
+    Abort multipart uploads of photos started more than max_age seconds ago. Parts of an unfinished
+    multipart upload are stored (and billed) until it is aborted.
+    :param max_age: seconds
+    :return: number of aborted uploads
+    """
+    bucket = app.config['S3_PHOTO_BUCKET']
+    s3_client = aws_client.s3()
+    expired = datetime.now(timezone.utc) - timedelta(seconds=max_age)
+    aborted = 0
+    for page in s3_client.get_paginator('list_multipart_uploads').paginate(Bucket=bucket, Prefix='photos/'):
+        for upload in page.get('Uploads', []):
+            if upload['Initiated'] >= expired:
+                continue
+            try:
+                s3_client.abort_multipart_upload(Bucket=bucket, Key=upload['Key'], UploadId=upload['UploadId'])
+                aborted += 1
+            except ClientError as e:
+                if not no_such_upload(e):
+                    raise e
+    return aborted
+
+
+_last_collected = 0
+_collect_lock = threading.Lock()
+
+
+def maybe_collect_stale_uploads():
+    """
+    Run collect_stale_uploads() for UPLOAD_SESSION_EXPIRE_TIME, at most once per UPLOAD_SESSION_GC_INTERVAL
+    in the process. A failure is logged only, the next interval tries again.
+    :return: None
+    """
+    global _last_collected
+    interval = app.config['UPLOAD_SESSION_GC_INTERVAL']
+    with _collect_lock:
+        if interval <= 0 or time.time() - _last_collected < interval:
+            return
+        _last_collected = time.time()
+    try:
+        aborted = collect_stale_uploads(app.config['UPLOAD_SESSION_EXPIRE_TIME'])
+        app.logger.debug('success: {0} stale upload sessions aborted'.format(aborted))
+    except Exception as e:
+        app.logger.error('ERROR:collecting stale upload sessions failed:%s', e)
+
+
+def read_part(stream, part_size):
+    """
+    Read exactly part_size bytes from stream unless it reaches end of the stream.
+    :param stream: file like object
+    :param part_size: size of a part (byte)
+    :return: bytes
+    """
+    chunks = []
+    remain = part_size
+    while remain > 0:
+        chunk = stream.read(remain)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remain -= len(chunk)
+    return b''.join(chunks)
+
+
+def save_s3_stream(upload_file_stream, filename, email, user_id=None):
+    """
+    Upload input file (photo) to S3 with multipart upload, one fixed-size part at a time.
+    Each part is teed into a spool file for the thumbnail decoder, unless the upload
+    stream itself can be rewound, so peak memory stays around one part per request. Parts are hashed on
+    the way, and the multipart upload is aborted when the user already stored the same content.
+    Photo information is read from the first part, see read_image_info().
+    :param upload_file_stream: file object
+    :param filename: secure filename for upload
+    :param email: user email address
+    :param user_id: user id of the content index, see PhotoContent
+    :return: (file size (byte), PhotoContent of the stored original, SHA-256 hex digest, photo information dict)
+    """
+    prefix = "photos/{0}/".format(email_normalize(email))
+    key = "{0}{1}".format(prefix, filename)
+
+    bucket = app.config['S3_PHOTO_BUCKET']
+    part_size = app.config['S3_MULTIPART_CHUNK_SIZE']
+    s3_client = aws_client.s3()
+    stream = upload_file_stream.stream
+    rewindable = getattr(stream, 'seekable', lambda: False)()
+    spool = None if rewindable else SpooledTemporaryFile(max_size=part_size)
+
+    upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key,
+                                                  ContentType='image/jpeg',
+                                                  StorageClass='STANDARD')['UploadId']
+    try:
+        parts = []
+        file_size = 0
+        digest = hashlib.sha256()
+        image_info = {}
+        while True:
+            chunk = read_part(stream, part_size)
+            if not chunk and parts:
+                break
+            part_number = len(parts) + 1
+            resp = s3_client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id,
+                                         PartNumber=part_number, Body=chunk)
+            parts.append({'PartNumber': part_number, 'ETag': resp['ETag']})
+            digest.update(chunk)
+            if part_number == 1:
+                image_info = read_image_info(chunk[:HEADER_SIZE])
+            if spool is not None:
+                spool.write(chunk)
+            file_size += len(chunk)
+            if len(chunk) < part_size:
+                break
+
+        digest = digest.hexdigest()
+        stored = find_content_ref(user_id, digest)
+        if stored is not None:
+            try:
+                s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            except Exception as e:
+                # The reference is taken already, collect_stale_uploads() aborts the upload later.
+                app.logger.error('ERROR:abort of s3://{0}/{1} failed:{2}'.format(bucket, key, e))
+            app.logger.debug('success: same content is stored:{0}'.format(stored.filename))
+            if spool is not None:
+                spool.close()
+            return file_size, stored, digest, image_info
+
+        s3_client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                            MultipartUpload={'Parts': parts})
+        app.logger.debug('success: s3://{0}/{1} uploaded: {2} parts'.format(bucket, key, len(parts)))
+    except Exception as e:
+        app.logger.error('Error occurred while saving file to S3:%s', e)
+        s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        if spool is not None:
+            spool.close()
+        raise e
+
+    try:
+        # Save thumbnail file
+        thumb_source = stream if spool is None else spool
+        thumb_source.seek(0)
+        futures = put_thumbnails_s3(s3_client, prefix, filename, make_thumbnails_s3(thumb_source))
+        wait_s3_puts(s3_client, futures, done_keys=[key])
+
+        stored = index_content(user_id, digest, filename, file_size, email, rendition_formats())
+        return file_size, stored, digest, image_info
     except Exception as e:
         app.logger.error('Error occurred while saving file to S3:%s', e)
         raise e
+    finally:
+        if spool is not None:
+            spool.close()
 
 
-def presigned_url(filename, email, Thumbnail=True):
+def presigned_url(filename, email, Thumbnail=True, format='jpeg'):
     try:
-        s3_client = boto3.client('s3')
+        s3_client = aws_client.s3()
         key = None
         if Thumbnail:
-            key = "photos/{0}/thumbnails/{1}".format(email_normalize(email), filename)
+            key = "photos/{0}/{1}".format(email_normalize(email),
+                                          rendition_path(rendition_key('thumbnails', format), filename))
         else:
             key = "photos/{0}/{1}".format(email_normalize(email), filename)
         url = solution_generate_s3_presigned_url(s3_client, key)
@@ -182,59 +811,139 @@ def presigned_url(filename, email, Thumbnail=True):
         raise e
 
 
-def presigned_url_both(filename, email):
+def sized_presigned_url(filename, email, size, fit, format='jpeg'):
+    """
+    Return presigned URL of the sized rendition of the photo, which is made from the mezzanine
+    and put to S3 at the first request.
+    :param filename: secure filename of the original
+    :param email: user email address
+    :param size: requested (width, height), 0 leaves the edge free. It is rounded up to RENDITION_SIZES
+    :param fit: one of FITS
+    :param format: format of the rendition, see best_format()
+    :return: presigned URL
+    """
+    size = quantize_size(size[0], size[1], parse_sizes(app.config['RENDITION_SIZES']))
+    prefix = "photos/{0}/".format(email_normalize(email))
+    key = "{0}{1}".format(prefix, sized_rendition_path(filename, size, fit, format))
+
+    s3_client = aws_client.s3()
+    try:
+        s3_client.head_object(Bucket=app.config['S3_PHOTO_BUCKET'], Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise e
+
+        def load_original():
+            return BytesIO(s3_client.get_object(Bucket=app.config['S3_PHOTO_BUCKET'],
+                                                Key=prefix + filename)['Body'].read())
+
+        def put_rendition(image_bytes):
+            solution_put_object_to_s3(s3_client, key, image_bytes, RENDITION_FORMATS[format][1])
+            app.logger.debug('success: s3://{0}/{1} uploaded'.format(app.config['S3_PHOTO_BUCKET'], key))
+
+        cache = get_rendition_cache(app.config['RENDITION_MEZZANINE_SIZE'], app.config['RENDITION_MEZZANINE_CACHE'])
+        cache.make(prefix + filename, load_original, size, fit, format, save=put_rendition)
+
+    return solution_generate_s3_presigned_url(s3_client, key)
+
+
+def presigned_url_both(filename, email, format='jpeg'):
     """
     Return presigned urls both original image url and thumbnail image url
     :param filename:
     :param email:
+    :param format: format of the thumbnail, see best_format()
     :return:
     """
+    thumb_url, origin_url = cached_presigned_urls(photo_url_keys(filename, email, format))
+    return thumb_url, origin_url
+
+
+def photo_url_keys(filename, email, format='jpeg'):
+    """
+    Return S3 keys of the thumbnail and the original of the photo.
+    :param filename:
+    :param email:
+    :param format: format of the thumbnail, see best_format()
+    :return: (thumbnail key, original key)
+    """
     prefix = "photos/{0}/".format(email_normalize(email))
-    prefix_thumb = "photos/{0}/thumbnails/".format(email_normalize(email))
-    key_thumb = "{0}{1}".format(prefix_thumb, filename)
+    key_thumb = "{0}{1}".format(prefix, rendition_path(rendition_key('thumbnails', format), filename))
     key_origin = "{0}{1}".format(prefix, filename)
-    try:
-        s3_client = boto3.client('s3')
-        thumb_url = s3_client.generate_presigned_url(
+    return key_thumb, key_origin
+
+
+def cached_presigned_urls(keys):
+    """
+    Return presigned GET URLs of the keys, the same URLs within a window of S3_PRESIGNED_URL_WINDOW seconds,
+    so the browser gets a cache hit on the images of the photo list. 0 signs new URLs on every call.
+    The URLs missing in the cache are signed at once by the local SigV4 presigner unless S3_LOCAL_PRESIGNER is off,
+    dated at the start of the window, so every process gives the same URLs in the window.
+    :param keys: list of S3 object keys
+    :return: list of URLs
+    """
+    bucket = app.config['S3_PHOTO_BUCKET']
+    window = app.config['S3_PRESIGNED_URL_WINDOW']
+    s3_client = aws_client.s3()
+    if window <= 0:
+        return [s3_client.generate_presigned_url(
             'get_object',
-            Params={'Bucket': app.config['S3_PHOTO_BUCKET'], 'Key': key_thumb},
-            ExpiresIn=app.config['S3_PRESIGNED_URL_EXPIRE_TIME'])
-        origin_url = s3_client.generate_presigned_url(
+            Params={'Bucket': bucket, 'Key': key},
+            ExpiresIn=app.config['S3_PRESIGNED_URL_EXPIRE_TIME']) for key in keys]
+
+    def sign(cache_keys, start, expires):
+        presigner = get_sigv4_presigner(s3_client, bucket) if app.config['S3_LOCAL_PRESIGNER'] else None
+        if presigner is not None:
+            return presigner.presign(aws_client.credentials(), [key for _, key in cache_keys], start,
+                                     expires - start, {'response-cache-control': cache_control(window)})
+        return [s3_client.generate_presigned_url(
             'get_object',
-            Params={'Bucket': app.config['S3_PHOTO_BUCKET'], 'Key': key_origin},
-            ExpiresIn=app.config['S3_PRESIGNED_URL_EXPIRE_TIME'])
-    except Exception as e:
-        raise e
-    return thumb_url, origin_url
+            Params={'Bucket': bucket, 'Key': key, 'ResponseCacheControl': cache_control(window)},
+            ExpiresIn=int(expires - time.time())) for _, key in cache_keys]
+
+    cache = get_presigned_url_cache(window, app.config['S3_PRESIGNED_URL_CACHE_SIZE'])
+    return cache.get_many([(bucket, key) for key in keys], sign)
+
+
+# Fields of Photo with presigned URLs, datetimes are formatted as JSONEncoder does.
+PRESIGNED_PHOTO_JSON_PLAN = FieldPlan(['address', 'city', 'desc', 'filename', 'filename_orig', 'filesize',
+                                       'geotag_lat', 'geotag_lng', 'height', 'id', 'make', 'model', 'nation', 'tags',
+                                       'taken_date', 'upload_date', 'user_id', 'width'],
+                                      {'geotag_lat': float, 'geotag_lng': float, 'taken_date': str,
+                                       'upload_date': str}, values='attribute_values')
 
 
-def with_presigned_url(current_user, photo):
+def with_presigned_urls(current_user, photos, accept=None, attributes=None):
+    """
+    Return the photos with additional attributes for presigned URL access, the URLs of all photos are signed at once.
+    :param current_user:
+    :param photos: iterable of Photo
+    :param accept: Accept header, see with_presigned_url()
+    :param attributes: names of the photo attributes returned, every attribute when it is None
+    :return: list of dict
+    """
+    photos = list(photos)
+    keys = []
+    for photo in photos:
+        keys.extend(photo_url_keys(photo.filename, current_user['email'], best_format(accept, photo_formats(photo))))
+    urls = cached_presigned_urls(keys)
+    photos_json = PRESIGNED_PHOTO_JSON_PLAN.only(attributes).many(photos)
+    for i, photo_json in enumerate(photos_json):
+        photo_json['thumbSrc'], photo_json['originalSrc'] = urls[2 * i:2 * i + 2]
+    return photos_json
+
+
+def with_presigned_url(current_user, photo, accept=None, urls=None):
     """
     Append additional attributes for presigned URL access.
     :param current_user:
     :param photo:
+    :param accept: Accept header, thumbSrc is of the smallest format listed in it
+    :param urls: (thumbnail URL, original URL) signed beforehand, see with_presigned_urls()
     :return:
     """
-    thumbSrc, originalSrc = presigned_url_both(photo.filename, current_user['email'])
-    temp = {}
-    temp['address'] = photo.address
-    temp['city'] = photo.city
-    temp['desc'] = photo.desc
-    temp['filename'] = photo.filename
-    temp['filename_orig'] = photo.filename_orig
-    temp['filesize'] = photo.filesize
-    temp['geotag_lat'] = float(photo.geotag_lat)
-    temp['geotag_lng'] = float(photo.geotag_lng)
-    temp['height'] = photo.height
-    temp['id'] = photo.id
-    temp['make'] = photo.make
-    temp['model'] = photo.model
-    temp['nation'] = photo.nation
-    temp['tags'] = photo.tags
-    temp['taken_date'] = photo.taken_date
-    temp['upload_date'] = photo.upload_date
-    temp['user_id'] = photo.user_id
-    temp['width'] = photo.width
-    temp['thumbSrc'] = thumbSrc
-    temp['originalSrc'] = originalSrc
-    return temp
+    if urls is None:
+        urls = presigned_url_both(photo.filename, current_user['email'], best_format(accept, photo_formats(photo)))
+    photo_json = PRESIGNED_PHOTO_JSON_PLAN.one(photo)
+    photo_json['thumbSrc'], photo_json['originalSrc'] = urls
+    return photo_json
@@ -0,0 +1,467 @@
+"""
+    cloudalbum/util/rendition.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Generate resized renditions (grid thumbnail, retina, lightbox ...) of an uploaded image.
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import io
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, Future
+from PIL import Image, ImageOps
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8, image bytes are pickled to the pool process instead.
+    shared_memory = None
+
+# Formats of renditions: name to (Pillow format, content type, save options).
+# JPEG ones are named after the original, the other formats are siblings with the extension appended.
+RENDITION_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', {}),
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'avif': ('AVIF', 'image/avif', {'quality': 60, 'speed': 8}),
+}
+
+# Preference of content negotiation, the smallest first.
+PREFERRED_FORMATS = ['avif', 'webp', 'jpeg']
+
+# Shrink with integer box reduction while the image is larger than REDUCING_GAP times of the target,
+# then finish with ANTIALIAS resampling.
+REDUCING_GAP = 2.0
+
+# Fits of sized renditions: 'contain' keeps the whole image within the size, 'cover' fills the size and crops.
+FITS = ['contain', 'cover']
+
+# Sized renditions of a photo are in the folder named after the original under this one.
+SIZED_FOLDER = 'sized'
+
+
+def parse_renditions(spec):
+    """
+    Parse rendition list from configuration value.
+    :param spec: comma separated 'name:WIDTHxHEIGHT', e.g. 'thumbnails:300x200,retina:600x400'
+    :return: list of (name, (width, height)), largest first
+    """
+    renditions = []
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        name, size = item.strip().split(':')
+        width, height = size.lower().split('x')
+        renditions.append((name.strip(), (int(width), int(height))))
+    return sorted(renditions, key=lambda r: r[1][0] * r[1][1], reverse=True)
+
+
+def supported_formats(spec):
+    """
+    Parse extra formats of renditions from configuration value, keeping the ones which Pillow can encode.
+    :param spec: comma separated format names, e.g. 'webp,avif'
+    :return: list of format names
+    """
+    Image.init()
+    formats = []
+    for name in spec.lower().split(','):
+        name = name.strip()
+        if name in RENDITION_FORMATS and name != 'jpeg' and RENDITION_FORMATS[name][0] in Image.SAVE \
+                and name not in formats:
+            formats.append(name)
+    return formats
+
+
+def rendition_key(name, format='jpeg'):
+    """
+    Return key of a rendition in the result of make_renditions(), e.g. 'thumbnails' or 'thumbnails.webp'.
+    """
+    return name if format == 'jpeg' else '{0}.{1}'.format(name, format)
+
+
+def rendition_path(key, filename):
+    """
+    Return relative path of a rendition file, e.g. 'thumbnails/<filename>' or 'thumbnails/<filename>.webp'.
+    :param key: rendition key, see rendition_key()
+    :param filename: secure filename of the original
+    :return: string
+    """
+    name, _, format = key.partition('.')
+    if format:
+        return '{0}/{1}.{2}'.format(name, filename, format)
+    return '{0}/{1}'.format(name, filename)
+
+
+def content_type(key):
+    """
+    Return content type of a rendition key.
+    """
+    return RENDITION_FORMATS[key.partition('.')[2] or 'jpeg'][1]
+
+
+def best_format(accept, formats):
+    """
+    Pick the smallest format which the client accepts, by the Accept header.
+    Only explicitly listed types count, since '*/*' is sent by clients which cannot decode WebP either.
+    :param accept: Accept header value, may be None
+    :param formats: extra formats available, see supported_formats()
+    :return: format name, 'jpeg' when none of them is accepted
+    """
+    accepted = set()
+    for item in (accept or '').split(','):
+        media_type, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(media_type.strip().lower())
+
+    for format in PREFERRED_FORMATS:
+        if format in formats and RENDITION_FORMATS[format][1] in accepted:
+            return format
+    return 'jpeg'
+
+
+def parse_sizes(spec):
+    """
+    Parse allowed edge lengths of sized renditions from configuration value.
+    :param spec: comma separated pixels, e.g. '160,320,640,1280'
+    :return: sorted list of int
+    """
+    return sorted({int(item) for item in spec.split(',') if item.strip()})
+
+
+def quantize_size(width, height, sizes):
+    """
+    Round requested size of a sized rendition up to the allowed edge lengths, so a handful of renditions
+    per photo serve every client. An edge larger than all of them gets the largest one.
+    :param width: requested width, 0 leaves the width free
+    :param height: requested height, 0 leaves the height free
+    :param sizes: allowed edge lengths, see parse_sizes()
+    :return: (width, height)
+    """
+    def quantize(value):
+        if not value:
+            return 0
+        return next((size for size in sizes if size >= value), sizes[-1])
+
+    return quantize(width), quantize(height)
+
+
+def sized_rendition_path(filename, size, fit, format='jpeg'):
+    """
+    Return relative path of a sized rendition, e.g. 'sized/<filename>/320x0-contain.jpg'.
+    Sized renditions of a photo share a folder, so they are deleted together.
+    :param filename: secure filename of the original
+    :param size: (width, height), see quantize_size()
+    :param fit: one of FITS
+    :param format: one of RENDITION_FORMATS
+    :return: string
+    """
+    return '{0}/{1}/{2}x{3}-{4}.{5}'.format(SIZED_FOLDER, filename, size[0], size[1], fit,
+                                           'jpg' if format == 'jpeg' else format)
+
+
+def encode(image, format):
+    """
+    Encode an image in one of RENDITION_FORMATS.
+    :return: bytes
+    """
+    pillow_format, _, options = RENDITION_FORMATS[format]
+    result_bytes_stream = BytesIO()
+    image.save(result_bytes_stream, pillow_format, **options)
+    return result_bytes_stream.getvalue()
+
+
+def make_renditions(file_p, renditions, format='JPEG', formats=()):
+    """
+    Decode the original image once and generate every rendition from it.
+    JPEG decoder scales down by DCT while decoding (draft mode) to the smallest scale which still
+    covers the largest rendition, so the full resolution bitmap is never allocated.
+    Each smaller rendition is reduced from the smallest one already made which is big enough.
+    :param file_p: path or file object of original image
+    :param renditions: list of (name, (width, height)), see parse_renditions()
+    :param format: image format of renditions
+    :param formats: extra formats which each rendition is also encoded in, see supported_formats()
+    :return: dict, rendition name to image bytes, extra formats under rendition_key()
+    """
+    im = Image.open(file_p)
+    im.draft('RGB', (max(size[0] for _, size in renditions), max(size[1] for _, size in renditions)))
+    im = im.convert('RGB')
+
+    sources = [im]
+    result = {}
+    for name, size in sorted(renditions, key=lambda r: r[1][0] * r[1][1], reverse=True):
+        source = im
+        for candidate in reversed(sources):
+            if candidate.width >= size[0] * REDUCING_GAP and candidate.height >= size[1] * REDUCING_GAP:
+                source = candidate
+                break
+
+        rendition = source.copy()
+        rendition.thumbnail(size, Image.ANTIALIAS, reducing_gap=REDUCING_GAP)
+        sources.append(rendition)
+
+        result_bytes_stream = BytesIO()
+        rendition.save(result_bytes_stream, format)
+        result[name] = result_bytes_stream.getvalue()
+        for extra in formats:
+            result[rendition_key(name, extra)] = encode(rendition, extra)
+
+    return result
+
+
+def make_mezzanine(file_p, size):
+    """
+    Decode the original into the intermediate image which sized renditions are made from,
+    at most size pixels on each edge. JPEG is scaled by DCT while decoding, see make_renditions().
+    :param file_p: path or file object of original image
+    :param size: max edge length of the mezzanine
+    :return: PIL.Image in RGB
+    """
+    im = Image.open(file_p)
+    im.draft('RGB', (size, size))
+    im = im.convert('RGB')
+    im.thumbnail((size, size), Image.ANTIALIAS, reducing_gap=REDUCING_GAP)
+    return im
+
+
+def make_sized(mezzanine, size, fit, format='jpeg'):
+    """
+    Make a sized rendition from the mezzanine.
+    :param mezzanine: PIL.Image, see make_mezzanine()
+    :param size: (width, height), 0 leaves the edge free. 'cover' of a free edge is square
+    :param fit: one of FITS
+    :param format: one of RENDITION_FORMATS
+    :return: image bytes
+    """
+    width, height = size
+    if fit == 'cover':
+        image = ImageOps.fit(mezzanine, (width or height, height or width), Image.ANTIALIAS)
+    else:
+        image = mezzanine.copy()
+        image.thumbnail((width or mezzanine.width, height or mezzanine.height), Image.ANTIALIAS,
+                        reducing_gap=REDUCING_GAP)
+    return encode(image, format)
+
+
+class RenditionCache:
+    """
+    Make sized renditions on demand. Mezzanines of the photos requested recently are kept in memory (LRU),
+    so the original is not decoded again for each size, and concurrent requests for the same missing
+    rendition wait for the one making it instead of resizing again.
+    """
+
+    def __init__(self, mezzanine_size, max_mezzanines):
+        self.mezzanine_size = mezzanine_size
+        self.max_mezzanines = max_mezzanines
+        self.mezzanines = OrderedDict()
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def single_flight(self, key, func):
+        """
+        Run func() once for the concurrent callers of the same key, the others wait and share its result or error.
+        :param key: hashable key of the work
+        :param func: function without argument
+        :return: result of func()
+        """
+        with self.lock:
+            future = self.flights.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.flights[key] = future
+        if not leader:
+            return future.result()
+
+        try:
+            result = func()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise e
+        finally:
+            with self.lock:
+                del self.flights[key]
+
+    def mezzanine(self, key, load):
+        """
+        Return the mezzanine of the original, which is decoded at the first call.
+        :param key: key of the original, e.g. its path
+        :param load: function returning path or file object of the original
+        :return: PIL.Image, see make_mezzanine()
+        """
+        with self.lock:
+            image = self.mezzanines.get(key)
+            if image is not None:
+                self.mezzanines.move_to_end(key)
+                return image
+
+        image = self.single_flight(('mezzanine', key), lambda: make_mezzanine(load(), self.mezzanine_size))
+        with self.lock:
+            self.mezzanines[key] = image
+            while len(self.mezzanines) > self.max_mezzanines:
+                self.mezzanines.popitem(last=False)
+        return image
+
+    def make(self, key, load, size, fit, format='jpeg', save=None):
+        """
+        Make a sized rendition of the original, concurrent calls for the same rendition resize once.
+        :param key: key of the original, see mezzanine()
+        :param load: function returning path or file object of the original
+        :param size: (width, height), see quantize_size()
+        :param fit: one of FITS
+        :param format: one of RENDITION_FORMATS
+        :param save: function storing the rendition bytes, called once by the call making it
+        :return: image bytes
+        """
+        def run():
+            data = make_sized(self.mezzanine(key, load), size, fit, format)
+            if save is not None:
+                save(data)
+            return data
+
+        return self.single_flight((key, size, fit, format), run)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_rendition_cache(mezzanine_size, max_mezzanines):
+    """
+    Return the rendition cache of this process, which is created at the first call.
+    :param mezzanine_size: max edge length of mezzanines
+    :param max_mezzanines: number of mezzanines kept in memory
+    :return: RenditionCache
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None or (_cache.mezzanine_size, _cache.max_mezzanines) != (mezzanine_size, max_mezzanines):
+            _cache = RenditionCache(mezzanine_size, max_mezzanines)
+        return _cache
+
+
+class MemoryReader(io.RawIOBase):
+    """
+    Read-only file over a buffer, e.g. a memoryview of a shared memory block.
+    Each read copies the bytes it returns only, while BytesIO copies the whole buffer when it is made.
+    """
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.buf[self.pos:self.pos + len(b)]
+        n = len(data)
+        b[:n] = data
+        self.pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += len(self.buf)
+        if offset < 0:
+            raise ValueError('Negative seek position:{0}'.format(offset))
+        self.pos = offset
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+
+def _make_renditions_shared(name, size, renditions, format, formats):
+    """
+    Pool process side of RenditionPool, which decodes original image straight from the shared memory block.
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        buf = shm.buf[:size]
+        try:
+            with MemoryReader(buf) as reader:
+                return make_renditions(reader, renditions, format, formats)
+        finally:
+            buf.release()
+    finally:
+        shm.close()
+
+
+def _make_renditions_bytes(data, renditions, format, formats):
+    return make_renditions(BytesIO(data), renditions, format, formats)
+
+
+class RenditionPool:
+    """
+    Make renditions in a pool of processes, so resizing is not limited to the one core of a worker.
+    Original image is handed over in a shared memory block rather than pickled through the pipe,
+    and at most max_pending images are submitted at once. Callers beyond that wait (backpressure).
+    """
+
+    def __init__(self, processes, max_pending):
+        self.processes = processes
+        self.max_pending = max_pending
+        self.executor = ProcessPoolExecutor(max_workers=processes)
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    def make_renditions(self, data, renditions, format='JPEG', formats=()):
+        """
+        Same as make_renditions(), but runs in the pool.
+        :param data: bytes of original image
+        :param renditions: list of (name, (width, height)), see parse_renditions()
+        :param format: image format of renditions
+        :param formats: extra formats, see supported_formats()
+        :return: dict, rendition name to image bytes
+        """
+        with self.slots:
+            if shared_memory is None:
+                return self.executor.submit(_make_renditions_bytes, data, renditions, format, formats).result()
+
+            shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+            try:
+                shm.buf[:len(data)] = data
+                return self.executor.submit(_make_renditions_shared, shm.name, len(data), renditions,
+                                            format, formats).result()
+            finally:
+                shm.close()
+                shm.unlink()
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_rendition_pool(processes, max_pending):
+    """
+    Return the rendition pool of this process, which is created at the first call.
+    :param processes: number of pool processes
+    :param max_pending: max number of images submitted at once
+    :return: RenditionPool
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or (_pool.processes, _pool.max_pending) != (processes, max_pending):
+            if _pool is not None:
+                _pool.shutdown()
+            _pool = RenditionPool(processes, max_pending)
+        return _pool
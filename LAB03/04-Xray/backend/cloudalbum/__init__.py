@@ -20,6 +20,7 @@ from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from flask_bcrypt import Bcrypt
 from cloudalbum.database import create_table
+from cloudalbum.util import aws_client
 
 
 class JSONEncoder(json.JSONEncoder):
@@ -66,6 +67,7 @@ def create_app(script_info=None):
     # set config
     app_settings = os.getenv('APP_SETTINGS')
     app.config.from_object(app_settings)
+    aws_client.init_app(app)
 
     # set logger to STDOUT
     app.logger.addHandler(logging.StreamHandler(sys.stdout))
@@ -13,7 +13,7 @@ from flask_restplus import Api, Resource
 from botocore.exceptions import ClientError
 import shutil
 import socket
-import boto3
+from cloudalbum.util import aws_client
 from werkzeug.exceptions import InternalServerError
 
 admin_blueprint = Blueprint('admin', __name__)
@@ -36,9 +36,9 @@ class HealthCheck(Resource):
     def get(self):
         try:
             # 1. Is database available?!
-            boto3.client('dynamodb').describe_table(TableName='Photo')
+            aws_client.dynamodb().describe_table(TableName='Photo')
             # User table is no more used.
-            # boto3.client('dynamodb').describe_table(TableName='User')
+            # aws_client.dynamodb().describe_table(TableName='User')
 
             # 2. Is disk have enough free space?!
             total, used, free = shutil.disk_usage("/")
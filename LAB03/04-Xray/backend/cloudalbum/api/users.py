@@ -8,7 +8,7 @@
     :license: MIT, see LICENSE for more details.
 """
 import hashlib
-import boto3, hmac, base64
+import hmac, base64
 from botocore.exceptions import ClientError
 from flask import Blueprint, request
 from flask import current_app as app
@@ -19,6 +19,7 @@ from werkzeug.exceptions import InternalServerError, BadRequest, Conflict
 
 from cloudalbum.schemas import validate_user
 from cloudalbum.solution import solution_signup_cognito
+from cloudalbum.util import aws_client
 from cloudalbum.util.jwt_helper import get_token_from_header, cog_jwt_required
 
 
@@ -66,7 +67,7 @@ class UsersList(Resource):
     def get(self):
         """Get all users as list"""
         try:
-            client = boto3.client('cognito-idp')
+            client = aws_client.cognito()
             response = client.list_users(
                 UserPoolId=app.config['COGNITO_POOL_ID'],
                 AttributesToGet=['sub', 'email', 'name']
@@ -98,7 +99,7 @@ class Users(Resource):
             })
     def get(self, user_id):
         """Get a single user details"""
-        client = boto3.client('cognito-idp')
+        client = aws_client.cognito()
         try:
             response = client.admin_get_user(
                 UserPoolId=app.config['COGNITO_POOL_ID'],
@@ -189,7 +190,7 @@ class Signin(Resource):
     def post(self):
         """user signin"""
         req_data = request.get_json()
-        client = boto3.client('cognito-idp')
+        client = aws_client.cognito()
         try:
             signin_data = validate_user(req_data)['data']
             access_token, refresh_token = cognito_signin(client, signin_data)
@@ -226,7 +227,7 @@ class Signout(Resource):
         """user signout"""
         token = get_token_from_header(request)
         try:
-            client = boto3.client('cognito-idp')
+            client = aws_client.cognito()
             response = client.global_sign_out(
                 AccessToken=token
             )
@@ -7,15 +7,62 @@
     :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
     :license: MIT, see LICENSE for more details.
 """
-from datetime import datetime
+import json
+import base64
+import secrets
+from datetime import datetime, timedelta, timezone
 from pynamodb.models import Model
 from pynamodb.attributes import UnicodeAttribute, NumberAttribute, UTCDateTimeAttribute
+from pynamodb.indexes import GlobalSecondaryIndex, LocalSecondaryIndex, IncludeProjection
 from tzlocal import get_localzone
+from cloudalbum.util.serializer import FieldPlan
+from cloudalbum.config import BaseConfig
 import boto3
 
 AWS_REGION = boto3.session.Session().region_name
 
 
+# Attributes of a photo which the photo list answers, the rest are read only for the full view.
+# The list indexes project them, so every backend of the Photo table has the same ones.
+PHOTO_LIST_ATTRIBUTES = ['user_id', 'id', 'filename', 'formats', 'upload_date', 'tags', 'desc',
+                         'geotag_lat', 'geotag_lng', 'address']
+# Orders of the photo list, newest first. upload_date is the order of the photo ids, see new_photo_id().
+PHOTO_LIST_ORDERS = ['upload_date', 'taken_date']
+# Key attributes of the last photo of a page in each order except user_id, which the cursor is made of.
+PHOTO_LIST_KEYS = {'upload_date': ['id'], 'taken_date': ['id', 'taken_date']}
+
+
+class PhotoListIndex(GlobalSecondaryIndex):
+    """
+    Photos of a user with PHOTO_LIST_ATTRIBUTES only. Query consumes read capacity for the whole items read,
+    which a projection expression does not change, so the photo list reads this narrower copy of the table.
+    """
+
+    class Meta:
+        index_name = 'photo-list-index'
+        # The list reads the index in place of the table, so it has the capacity of the table.
+        read_capacity_units = BaseConfig.DDB_RCU
+        write_capacity_units = BaseConfig.DDB_WCU
+        projection = IncludeProjection([name for name in PHOTO_LIST_ATTRIBUTES if name not in ('user_id', 'id')])
+
+    user_id = UnicodeAttribute(hash_key=True)
+    id = UnicodeAttribute(range_key=True)
+
+
+class PhotoTakenDateIndex(LocalSecondaryIndex):
+    """
+    Photos of a user in the order of taken_date with PHOTO_LIST_ATTRIBUTES, a photo without taken_date is not in it.
+    DynamoDB makes a local secondary index only with a new table.
+    """
+
+    class Meta:
+        index_name = 'photo-taken-date-index'
+        projection = IncludeProjection([name for name in PHOTO_LIST_ATTRIBUTES if name not in ('user_id', 'id')])
+
+    user_id = UnicodeAttribute(hash_key=True)
+    taken_date = UTCDateTimeAttribute(range_key=True)
+
+
 class Photo(Model):
     """
     Photo table for DynamoDB
@@ -27,6 +74,8 @@ class Photo(Model):
 
     user_id = UnicodeAttribute(hash_key=True)
     id = UnicodeAttribute(range_key=True)
+    list_index = PhotoListIndex()
+    taken_date_index = PhotoTakenDateIndex()
     tags = UnicodeAttribute(null=True)
     desc = UnicodeAttribute(null=True)
     filename_orig = UnicodeAttribute(null=True)
@@ -43,27 +92,294 @@ class Photo(Model):
     city = UnicodeAttribute(null=True)
     nation = UnicodeAttribute(null=True)
     address = UnicodeAttribute(null=True)
+    # SHA-256 of the original, see PhotoContent
+    digest = UnicodeAttribute(null=True)
+    # Extra formats of the renditions, comma separated, see THUMBNAIL_FORMATS
+    formats = UnicodeAttribute(null=True)
+
 
+class PhotoContent(Model):
+    """
+    Content index of user photos, keyed by SHA-256 of the original.
+    Photos of the same content share the stored objects, ref_count is the number of those photos.
+    """
+
+    class Meta:
+        table_name = 'PhotoContent'
+        region = AWS_REGION
+
+    user_id = UnicodeAttribute(hash_key=True)
+    digest = UnicodeAttribute(range_key=True)
+    filename = UnicodeAttribute(null=False)
+    filesize = NumberAttribute(null=True)
+    ref_count = NumberAttribute(default=1)
+    # Extra formats of the stored renditions, comma separated, see Photo.formats
+    formats = UnicodeAttribute(null=True)
+
+
+class PhotoListVersion(Model):
+    """
+    Version of the photo list of a user, bumped on every change of the photos of the user.
+    A client which has the list of the current version gets it again without a query, see photo_list_etag().
+    """
+
+    class Meta:
+        table_name = 'PhotoListVersion'
+        region = AWS_REGION
+
+    user_id = UnicodeAttribute(hash_key=True)
+    version = NumberAttribute(default=0)
+
+
+# Fields of Photo in the responses, datetimes are formatted as JSONEncoder does.
+PHOTO_JSON_PLAN = FieldPlan(['user_id', 'id', 'filename', 'filename_orig', 'filesize', 'upload_date', 'tags',
+                             'desc', 'geotag_lat', 'geotag_lng', 'taken_date', 'make', 'model', 'width', 'height',
+                             'city', 'nation', 'address'],
+                            {'upload_date': str, 'taken_date': str}, values='attribute_values')
+
+
+def photo_deserialize(photo, attributes=None):
+    """
+    Return the photo as dict.
+    :param photo: Photo
+    :param attributes: names of the attributes returned, every attribute when it is None
+    :return: dict
+    """
+    return PHOTO_JSON_PLAN.only(attributes).one(photo)
+
+
+# Crockford's base32, which sorts in the same order as the numbers it encodes.
+CROCKFORD_BASE32 = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_base32(number, length):
+    """
+    Return the number in Crockford's base32 of the length, padded with '0'.
+    :param number: int, less than 32 ** length
+    :param length: number of characters
+    :return: string
+    """
+    chars = []
+    for _ in range(length):
+        number, digit = divmod(number, 32)
+        chars.append(CROCKFORD_BASE32[digit])
+    return ''.join(reversed(chars))
+
+
+def photo_id_bound(date, upper=False):
+    """
+    Return the lower bound of the ids of the photos made in the millisecond of the date, see new_photo_id().
+    :param date: datetime, a naive one is UTC as UTCDateTimeAttribute stores it
+    :param upper: the upper bound is returned instead
+    :return: string
+    """
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    prefix = encode_base32((date - EPOCH) // timedelta(milliseconds=1), 10)
+    # '~' sorts after every character of an id, the base32 characters and the '.' of a file name.
+    return prefix + '~' if upper else prefix
 
-def photo_deserialize(photo):
-    photo_json = {}
-    photo_json['user_id'] = photo.user_id
-    photo_json['id'] = photo.id
-    photo_json['filename'] = photo.filename
-    photo_json['filename_orig'] = photo.filename_orig
-    photo_json['filesize'] = photo.filesize
-    photo_json['upload_date'] = photo.upload_date
-    photo_json['tags'] = photo.tags
-    photo_json['desc'] = photo.desc
-    photo_json['geotag_lat'] = photo.geotag_lat
-    photo_json['geotag_lng'] = photo.geotag_lng
-    photo_json['taken_date'] = photo.taken_date
-    photo_json['make'] = photo.make
-    photo_json['model'] = photo.model
-    photo_json['width'] = photo.width
-    photo_json['height'] = photo.height
-    photo_json['city'] = photo.city
-    photo_json['nation'] = photo.nation
-    photo_json['address'] = photo.address
-    return photo_json
 
+def new_photo_id(date=None):
+    """
+    Return id of a new photo, a ULID: 10 characters of the milliseconds since the epoch and 16 random ones,
+    in Crockford's base32. Ids of the photos of a user sort in the order of the time they are made, so the range
+    key of Photo orders the photo list by upload date, see query_photos().
+    :param date: time of the id, now when it is None
+    :return: string of 26 characters
+    """
+    return photo_id_bound(date or datetime.now(timezone.utc)) + encode_base32(secrets.randbits(80), 16)
+
+
+def is_photo_id(photo_id):
+    """
+    Return True when the photo id is made by new_photo_id(), possibly followed by the extension of the file.
+    Photos stored before have uuid ids, see 'manage.py backfill_photo_ids'.
+    :param photo_id: string
+    :return: bool
+    """
+    return len(photo_id) >= 26 and all(c in CROCKFORD_BASE32 for c in photo_id[:26]) and \
+        photo_id[26:27] in ('', '.')
+
+
+# Formats of since and until of the photo list, each with the start of the period after a date of it.
+LIST_DATE_FORMATS = [
+    ('%Y-%m-%dT%H:%M:%S', lambda date: date + timedelta(seconds=1)),
+    ('%Y-%m-%d', lambda date: date + timedelta(days=1)),
+    ('%Y-%m', lambda date: date.replace(year=date.year + date.month // 12, month=date.month % 12 + 1)),
+    ('%Y', lambda date: date.replace(year=date.year + 1)),
+]
+
+
+def parse_list_date(value, until=False):
+    """
+    Return the date of since or until of the photo list, UTC as the dates of Photo are stored.
+    :param value: e.g. '2019', '2019-07', '2019-07-15' or '2019-07-15T09:46:46'
+    :param until: the value is until, which is the end of its period, e.g. the last moment of 2019 for '2019'
+    :return: datetime
+    :raise ValueError: when the value is not of LIST_DATE_FORMATS
+    """
+    for date_format, next_start in LIST_DATE_FORMATS:
+        try:
+            date = datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+        if until:
+            date = next_start(date) - timedelta(microseconds=1)
+        return date.replace(tzinfo=timezone.utc)
+    raise ValueError('Invalid date:{0}'.format(value))
+
+
+def parse_list_dates(since=None, until=None):
+    """
+    Return since and until of the photo list, see parse_list_date().
+    :param since: string, None for no lower bound
+    :param until: string, None for no upper bound
+    :return: (since, until), datetime or None each
+    :raise ValueError: when a date is broken or since is after until
+    """
+    since = parse_list_date(since) if since else None
+    until = parse_list_date(until, True) if until else None
+    if since is not None and until is not None and since > until:
+        raise ValueError('since is after until')
+    return since, until
+
+
+def range_key_condition(order, since=None, until=None):
+    """
+    Return key condition of the photos of the order between since and until.
+    The upload_date order is the order of the photo ids, see new_photo_id().
+    :param order: one of PHOTO_LIST_ORDERS
+    :param since: datetime, None for no lower bound
+    :param until: datetime, None for no upper bound
+    :return: condition, None for every photo
+    """
+    if order == 'taken_date':
+        key, low, high = Photo.taken_date, since, until
+    else:
+        key = Photo.id
+        low = photo_id_bound(since) if since else None
+        high = photo_id_bound(until, upper=True) if until else None
+    if low is not None and high is not None:
+        return key.between(low, high)
+    if low is not None:
+        return key >= low
+    if high is not None:
+        return key <= high
+    return None
+
+
+def encode_cursor(key):
+    """
+    Return opaque cursor of a page of photos, which starts after the photo of the key.
+    :param key: dict of the names of the key attributes except user_id, to their values
+    :return: string
+    """
+    return base64.urlsafe_b64encode(json.dumps(key, sort_keys=True).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, order=PHOTO_LIST_ORDERS[0]):
+    """
+    Return key of the photo which the page of the cursor starts after, see encode_cursor().
+    :param cursor: string
+    :param order: one of PHOTO_LIST_ORDERS
+    :return: dict of the names of the key attributes to their values
+    :raise ValueError: when the cursor is broken or of another order
+    """
+    key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+    if not isinstance(key, dict) or sorted(key) != PHOTO_LIST_KEYS[order] or \
+            not all(isinstance(value, str) and value for value in key.values()):
+        raise ValueError('Cursor of another order')
+    return key
+
+
+def query_photos(user_id, limit=None, cursor=None, attributes=None, index=None, order=PHOTO_LIST_ORDERS[0],
+                 since=None, until=None, consistent_read=False):
+    """
+    Query a page of the photos of the user newest first in the order, read lazily page by page of DynamoDB.
+    The order and the dates are the key condition of the query, so only the photos of the page are read.
+    :param user_id: user id
+    :param limit: max number of photos, every photo when it is None
+    :param cursor: next cursor of the previous page, from the first photo when it is None
+    :param attributes: names of the attributes read, every attribute when it is None
+    :param index: index which has the attributes, e.g. Photo.list_index, the table when it is None.
+                  The taken_date order reads Photo.taken_date_index, which has no photo without taken_date.
+    :param order: one of PHOTO_LIST_ORDERS
+    :param since: the earliest date of the order, see parse_list_dates(), None for no lower bound
+    :param until: the latest date of the order, None for no upper bound
+    :param consistent_read: strongly consistent read, which Photo.list_index has not, a global secondary index
+    :return: iterator of Photo, see next_page_cursor()
+    :raise ValueError: when the cursor is broken or of another order
+    """
+    last_evaluated_key = None
+    if cursor:
+        last_evaluated_key = {name: {'S': value} for name, value in decode_cursor(cursor, order).items()}
+        last_evaluated_key['user_id'] = {'S': user_id}
+    if order == 'taken_date':
+        index = Photo.taken_date_index
+        # An attribute out of the projection is read from the table when it is asked for by name.
+        attributes = attributes or list(Photo.get_attributes())
+    query = Photo.query if index is None else index.query
+    return query(user_id, range_key_condition(order, since, until), scan_index_forward=False, limit=limit,
+                 last_evaluated_key=last_evaluated_key, attributes_to_get=attributes, consistent_read=consistent_read)
+
+
+def next_page_cursor(results):
+    """
+    Return cursor of the page after the photos which query_photos() returned, once they are all read.
+    :param results: iterator of query_photos()
+    :return: cursor, None on the last page
+    """
+    # Key of the last photo read when the limit is reached, None when the query is over.
+    next_key = results.last_evaluated_key
+    if not next_key:
+        return None
+    return encode_cursor({name: value['S'] for name, value in next_key.items() if name != 'user_id'})
+
+
+def query_photo_page(user_id, limit=None, cursor=None, attributes=None, index=None, order=PHOTO_LIST_ORDERS[0],
+                     since=None, until=None, consistent_read=False):
+    """
+    Query a page of the photos of the user newest first in the order, see query_photos().
+    :return: (list of Photo, cursor of the next page, None on the last page)
+    :raise ValueError: when the cursor is broken or of another order
+    """
+    results = query_photos(user_id, limit, cursor, attributes, index, order, since, until, consistent_read)
+    photos = list(results)
+    return photos, next_page_cursor(results)
+
+
+def is_registered_filename(user_id, filename):
+    """
+    Return True when a photo of the user refers to the stored original of the filename, including a photo which
+    shares the content of another one, see PhotoContent. The photos of the user are read until one matches.
+    :param user_id: user id
+    :param filename: filename of the stored original
+    :return: bool
+    """
+    photos = Photo.query(user_id, filter_condition=Photo.filename == filename, attributes_to_get=['id'])
+    return next(iter(photos), None) is not None
+
+
+def get_photo_list_version(user_id):
+    """
+    Return version of the photo list of the user, a strongly consistent read of a single item.
+    :param user_id: user id
+    :return: int, 0 when the photos of the user never changed
+    """
+    try:
+        return int(PhotoListVersion.get(user_id, consistent_read=True, attributes_to_get=['version']).version)
+    except PhotoListVersion.DoesNotExist:
+        return 0
+
+
+def bump_photo_list_version(user_id):
+    """
+    Increase version of the photo list of the user by one, call it after the photos of the user are changed.
+    :param user_id: user id
+    :return: new version
+    """
+    item = PhotoListVersion(user_id)
+    item.update(actions=[PhotoListVersion.version.add(1)])
+    return int(item.version)
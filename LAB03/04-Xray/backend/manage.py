@@ -8,15 +8,32 @@
     :license: MIT, see LICENSE for more details.
 """
 import sys
+import time
+import json
+import click
 import hmac
 import boto3
 import base64
 import hashlib
 import unittest
+import uuid
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from datetime import datetime, timedelta, timezone
 from flask.cli import FlaskGroup
-from cloudalbum import create_app
+from cloudalbum import create_app, JSONEncoder
 from cloudalbum.tests.base import user
+from cloudalbum.util import aws_client
+from cloudalbum.util.file_control import collect_stale_uploads, presigned_url_both, photo_url_keys, \
+    cached_presigned_urls, PRESIGNED_PHOTO_JSON_PLAN
+from cloudalbum.util.presign import get_presigned_url_cache
+from cloudalbum.util.serializer import dumps, orjson
+from cloudalbum.util.rendition import parse_renditions, make_renditions, get_rendition_pool, supported_formats, \
+    encode
 from cloudalbum.database import delete_table
+from cloudalbum.database.model_ddb import Photo, PHOTO_LIST_ATTRIBUTES, \
+    is_photo_id, new_photo_id, bump_photo_list_version
 
 
 app = create_app()
@@ -72,5 +89,240 @@ def seed_db():
     print(user)
 
 
+@cli.command('collect_upload_sessions')
+@click.option('--max-age', default=None, type=int, help='Seconds. (default: UPLOAD_SESSION_EXPIRE_TIME)')
+def collect_upload_sessions(max_age):
+    """
+    Abort resumable uploads left unfinished, e.g. from a cron job when UPLOAD_SESSION_GC_INTERVAL is 0.
+    :return:
+    """
+    aborted = collect_stale_uploads(app.config['UPLOAD_SESSION_EXPIRE_TIME'] if max_age is None else max_age)
+    print('{0} upload sessions aborted'.format(aborted))
+
+
+@cli.command('benchmark_rendition')
+@click.option('--image', default=None, help='JPEG file to resize. (default: synthetic 4000x3000 photo)')
+@click.option('--rounds', default=10, help='Number of uploads to measure.')
+@click.option('--processes', default=0, help='Also measure wall time of concurrent uploads in the process pool.')
+def benchmark_rendition(image, rounds, processes):
+    """
+    Compare CPU time per upload of the rendition engine against decoding once per rendition,
+    and encode cost and bytes of the renditions per format which Pillow supports.
+    :return:
+    """
+    if image is None:
+        photo = Image.effect_mandelbrot((4000, 3000), (-2.0, -1.5, 1.0, 1.5), 100).convert('RGB')
+        buf = BytesIO()
+        photo.save(buf, 'JPEG', quality=90)
+        original = buf.getvalue()
+    else:
+        with open(image, 'rb') as f:
+            original = f.read()
+
+    renditions = parse_renditions(app.config['THUMBNAIL_RENDITIONS'])
+
+    def decode_per_rendition():
+        for _, size in renditions:
+            im = Image.open(BytesIO(original))
+            im = im.convert('RGB')
+            im.thumbnail(size, Image.ANTIALIAS)
+            im.save(BytesIO(), 'JPEG')
+
+    def decode_once():
+        make_renditions(BytesIO(original), renditions)
+
+    print('renditions: {0}, original: {1} bytes, rounds: {2}'.format(renditions, len(original), rounds))
+    for label, func in [('decode per rendition', decode_per_rendition), ('decode once', decode_once)]:
+        started = time.process_time()
+        for _ in range(rounds):
+            func()
+        print('{0:>24}: {1:8.1f} ms CPU per upload'.format(label, (time.process_time() - started) * 1000 / rounds))
+
+    if processes > 0:
+        pool = get_rendition_pool(processes, processes * 2)
+        with ThreadPoolExecutor(max_workers=processes * 2) as executor:
+            started = time.time()
+            list(executor.map(lambda _: pool.make_renditions(original, renditions), range(rounds)))
+            elapsed = time.time() - started
+        pool.shutdown()
+        print('{0:>24}: {1:8.1f} ms wall per upload'.format('pool of {0}'.format(processes), elapsed * 1000 / rounds))
+
+    # Encode cost and size of the renditions per format, resized once beforehand.
+    resized = []
+    for _, size in renditions:
+        im = Image.open(BytesIO(original)).convert('RGB')
+        im.thumbnail(size, Image.ANTIALIAS)
+        resized.append(im)
+    jpeg_bytes = None
+    for format in ['jpeg'] + supported_formats('webp,avif'):
+        started = time.process_time()
+        for _ in range(rounds):
+            total = sum(len(encode(im, format)) for im in resized)
+        encode_ms = (time.process_time() - started) * 1000 / rounds
+        jpeg_bytes = jpeg_bytes or total
+        print('{0:>24}: {1:8.1f} ms CPU per upload, {2} bytes, {3:5.1f}% saved'.format(
+            'encode ' + format, encode_ms, total, (1 - total / jpeg_bytes) * 100))
+
+
+@cli.command('benchmark_aws_client')
+@click.option('--calls', default=200, help='Number of calls to measure.')
+def benchmark_aws_client(calls):
+    """
+    Compare calls/sec of presigning an S3 URL with a fresh client per call against the shared client.
+    :return:
+    """
+    params = {'Bucket': app.config['S3_PHOTO_BUCKET'] or 'cloudalbum-benchmark', 'Key': 'photos/benchmark.jpg'}
+
+    def fresh_client():
+        boto3.client('s3').generate_presigned_url('get_object', Params=params, ExpiresIn=60)
+
+    def shared_client():
+        aws_client.s3().generate_presigned_url('get_object', Params=params, ExpiresIn=60)
+
+    print('calls: {0}'.format(calls))
+    for label, func in [('client per call', fresh_client), ('shared client', shared_client)]:
+        started = time.time()
+        for _ in range(calls):
+            func()
+        print('{0:>24}: {1:8.1f} calls/sec'.format(label, calls / (time.time() - started)))
+
+
+@cli.command('benchmark_presign')
+@click.option('--photos', default=5000, help='Number of photos in the list.')
+def benchmark_presign(photos):
+    """
+    Compare URLs/sec of the photo list signed by presigned_url_both() with botocore one by one against
+    the local SigV4 presigner signing the whole list at once, and the list cached in the window.
+    :return:
+    """
+    email = 'benchmark@example.com'
+    filenames = ['{0}.jpg'.format(uuid.uuid4().hex) for _ in range(photos)]
+    keys = [key for filename in filenames for key in photo_url_keys(filename, email)]
+    with app.app_context():
+        app.config['S3_PHOTO_BUCKET'] = app.config['S3_PHOTO_BUCKET'] or 'cloudalbum-benchmark'
+        window = app.config['S3_PRESIGNED_URL_WINDOW'] or 1800
+        cache = get_presigned_url_cache(window, max(app.config['S3_PRESIGNED_URL_CACHE_SIZE'], len(keys)))
+
+        def botocore_per_url():
+            app.config['S3_PRESIGNED_URL_WINDOW'] = 0
+            for filename in filenames:
+                presigned_url_both(filename, email)
+
+        def local_presigner():
+            app.config.update(S3_PRESIGNED_URL_WINDOW=window, S3_LOCAL_PRESIGNER=True)
+            cache.clear()
+            cached_presigned_urls(keys)
+
+        def cached():
+            cached_presigned_urls(keys)
+
+        print('photos: {0}, URLs: {1}'.format(photos, len(keys)))
+        for label, func in [('botocore per URL', botocore_per_url), ('local presigner', local_presigner),
+                            ('cached', cached)]:
+            started = time.time()
+            func()
+            print('{0:>24}: {1:10.1f} URLs/sec'.format(label, len(keys) / (time.time() - started)))
+
+
+@cli.command('benchmark_photo_list')
+@click.option('--user-id', required=True, help='User whose photos are listed.')
+def benchmark_photo_list(user_id):
+    """
+    Compare read capacity units consumed by the whole photo list of the user, read as whole items,
+    with a projection expression and from the list index.
+    :return:
+    """
+    connection = Photo._get_connection()
+    for label, attributes, index_name in [('whole items', None, None),
+                                          ('projection expression', PHOTO_LIST_ATTRIBUTES, None),
+                                          ('list index', PHOTO_LIST_ATTRIBUTES, Photo.list_index.Meta.index_name)]:
+        photos, units, start_key = 0, 0.0, None
+        while True:
+            page = connection.query(user_id, attributes_to_get=attributes, index_name=index_name,
+                                    exclusive_start_key=start_key, return_consumed_capacity='TOTAL')
+            photos += page['Count']
+            units += page['ConsumedCapacity']['CapacityUnits']
+            start_key = page.get('LastEvaluatedKey')
+            if not start_key:
+                break
+        print('{0:>24}: {1} photos, {2:8.1f} RCU'.format(label, photos, units))
+
+@cli.command('backfill_photo_ids')
+@click.option('--dry-run', is_flag=True, help='Count the photos to re-key without changing them.')
+def backfill_photo_ids(dry_run):
+    """
+    Re-key the photos stored with uuid ids to ids of new_photo_id() at their upload date, so the photo list
+    orders them by upload date too. The file names of the photos are kept, each photo is copied to its new id
+    before the old item is deleted.
+    :return:
+    """
+    index_name = Photo.taken_date_index.Meta.index_name
+    if index_name not in [index['IndexName'] for index in Photo.describe_table().get('LocalSecondaryIndexes', [])]:
+        print('Photo table has no {0}, set PHOTO_TAKEN_DATE_INDEX=False or create the table again'.format(index_name))
+    scanned, rekeyed, users = 0, 0, set()
+    for photo in Photo.scan():
+        scanned += 1
+        if is_photo_id(photo.id):
+            continue
+        rekeyed += 1
+        if dry_run:
+            continue
+        old_id = photo.id
+        _, dot, extension = old_id.partition('.')
+        photo.id = new_photo_id(photo.upload_date) + dot + extension
+        photo.save(condition=Photo.id.does_not_exist())
+        Photo(photo.user_id, old_id).delete()
+        users.add(photo.user_id)
+    for user_id in users:
+        bump_photo_list_version(user_id)
+    print('{0} photos scanned, {1} {2}'.format(scanned, rekeyed, 'to re-key' if dry_run else 're-keyed'))
+
+
+@cli.command('benchmark_serializer')
+@click.option('--photos', default=10000, help='Number of photos in the list.')
+@click.option('--rounds', default=5, help='Number of lists to measure.')
+def benchmark_serializer(photos, rounds):
+    """
+    Compare ms per photo list of the dicts built field by field and encoded with JSONEncoder.default() for every
+    datetime, against the field plan encoded by json and by orjson.
+    :return:
+    """
+    day = datetime(2019, 1, 1, tzinfo=timezone.utc)
+    items = [Photo('benchmark', uuid.uuid4().hex, tags='ITA, Venezia, SONY', desc='photo {0}'.format(i),
+                   filename_orig='IMG_{0:05d}.jpg'.format(i), filename='{0}.jpg'.format(uuid.uuid4()),
+                   filesize=2000000 + i, geotag_lat='45.4347', geotag_lng='12.3467',
+                   upload_date=day + timedelta(minutes=i), taken_date=day - timedelta(days=1, seconds=i),
+                   make='SONY', model='DSLR-A300', width='2048', height='1371', city='Venezia', nation='ITA',
+                   address='Campo Bandiera e Moro o de la Bragora 3608, 30122, Venezia, ITA') for i in range(photos)]
+
+    def field_by_field():
+        photos_json = []
+        for photo in items:
+            photo_json = {name: getattr(photo, name) for name in PRESIGNED_PHOTO_JSON_PLAN.names}
+            photo_json['geotag_lat'] = float(photo.geotag_lat)
+            photo_json['geotag_lng'] = float(photo.geotag_lng)
+            photos_json.append(photo_json)
+        return json.dumps({'ok': True, 'photos': photos_json}, cls=JSONEncoder)
+
+    def field_plan_json():
+        return dumps({'ok': True, 'photos': PRESIGNED_PHOTO_JSON_PLAN.many(items)}, fast=False)
+
+    def field_plan_orjson():
+        return dumps({'ok': True, 'photos': PRESIGNED_PHOTO_JSON_PLAN.many(items)})
+
+    variants = [('field by field', field_by_field), ('field plan + json', field_plan_json)]
+    if orjson is not None:
+        variants.append(('field plan + orjson', field_plan_orjson))
+    expected = json.loads(field_by_field())
+    print('photos: {0}, rounds: {1}'.format(photos, rounds))
+    for label, func in variants:
+        if json.loads(func()) != expected:
+            raise AssertionError('{0} differs from field by field'.format(label))
+        started = time.perf_counter()
+        for _ in range(rounds):
+            func()
+        print('{0:>24}: {1:8.1f} ms per list'.format(label, (time.perf_counter() - started) * 1000 / rounds))
+
+
 if __name__ == '__main__':
     cli()
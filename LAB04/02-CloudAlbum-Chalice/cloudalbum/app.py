@@ -8,15 +8,17 @@
     :license: MIT, see LICENSE for more details.
 """
 
-import uuid
-import json
-import boto3
 import base64
 import logging
-from chalicelib import cognito
-from chalicelib.config import cors_config
-from chalicelib.util import pp, save_s3_chalice, get_parts, delete_s3
-from chalicelib.model_ddb import Photo, create_photo_info, ModelEncoder, with_presigned_url
+from functools import partial
+from chalicelib import cognito, aws_client
+from chalicelib.config import conf, cors_config
+from chalicelib.json_stream import batched, iter_json_object
+from chalicelib.serializer import dumps
+from chalicelib.util import pp, save_s3_chalice, get_parts, get_photo_info, delete_s3, etag_matches
+from chalicelib.model_ddb import Photo, create_photo_info, check_photo_info, with_presigned_urls, \
+    query_photos, next_page_cursor, decode_cursor, PHOTO_LIST_ATTRIBUTES, PHOTO_LIST_ORDERS, photo_list_etag, \
+    bump_photo_list_version, new_photo_id, parse_list_dates
 from chalice import Chalice, Response, ConflictError, BadRequestError, AuthResponse, ChaliceViewError
 from botocore.exceptions import ParamValidationError
 
@@ -24,6 +26,10 @@ app = Chalice(app_name='cloudalbum')
 app.debug = True
 app.log.setLevel(logging.DEBUG)
 
+# Image content types uploaded as raw binary body, API Gateway passes them through as binary media types.
+IMAGE_CONTENT_TYPES = ['image/jpeg', 'image/png', 'image/gif', 'image/bmp']
+app.api.binary_types.extend(t for t in IMAGE_CONTENT_TYPES if t not in app.api.binary_types)
+
 
 @app.authorizer()
 def jwt_auth(auth_request):
@@ -45,40 +51,93 @@ def jwt_auth(auth_request):
            authorizer=jwt_auth, content_types=['application/json'])
 def photo_list():
     """
-    Retrieve Photo table items with signed URL attribute.
-    :return:
+    Retrieve Photo table items with signed URL attribute, a page of them when limit is given.
+    :queryparam limit: max number of photos of the page, up to PHOTO_LIST_MAX_LIMIT
+    :queryparam cursor: next_cursor of the previous page
+    :queryparam view: list(default) returns PHOTO_LIST_ATTRIBUTES of the photos, full every attribute
+    :queryparam order: upload_date(default) or taken_date, newest first, see PHOTO_LIST_ORDERS.
+                       taken_date leaves out the photos without taken_date
+    :queryparam since: the earliest date of the order, e.g. 2019, 2019-07, 2019-07-15 or 2019-07-15T09:46:46
+    :queryparam until: the latest date of the order, the whole period of it, e.g. 2019 is until the end of 2019
+    :header If-None-Match: ETag of the list the client has, 304 is returned when the list is not changed
+    :return: photos and next_cursor, which is None on the last page
     """
     current_user = cognito.user_info(cognito.get_token(app.current_request))
+    params = app.current_request.query_params or {}
     try:
-        photos = Photo.query(current_user['user_id'])
-        data = {'ok': True, 'photos': []}
-        [data['photos'].append(with_presigned_url(current_user, photo)) for photo in photos]
-        body = json.dumps(data, cls=ModelEncoder)
-        return Response(status_code=200, body=body,
-                        headers={'Content-Type': 'application/json'})
+        limit = int(params.get('limit') or conf['PHOTO_LIST_DEFAULT_LIMIT'])
+        if limit < 0 or limit > int(conf['PHOTO_LIST_MAX_LIMIT']):
+            raise ValueError('limit is out of range')
+        order = params.get('order', PHOTO_LIST_ORDERS[0])
+        if order not in PHOTO_LIST_ORDERS or (order == 'taken_date' and str(conf['PHOTO_TAKEN_DATE_INDEX']) != 'True'):
+            raise ValueError('order is not supported')
+        if params.get('cursor'):
+            decode_cursor(params['cursor'], order)
+        if params.get('view', 'list') not in ('list', 'full'):
+            raise ValueError('view is not list or full')
+        since, until = parse_list_dates(params.get('since'), params.get('until'))
+    except ValueError as e:
+        raise BadRequestError('Invalid limit, cursor, view, order or dates: {0}'.format(e))
+    try:
+        # The list view reads its attributes from the list index, the full view reads the whole items.
+        attributes = None if params.get('view') == 'full' else PHOTO_LIST_ATTRIBUTES
+        etag = photo_list_etag(current_user['user_id'], limit or None, params.get('cursor'),
+                               params.get('view', 'list'), order, params.get('since'), params.get('until'))
+        headers = {'Content-Type': 'application/json'}
+        if etag:
+            headers.update({'ETag': '"{0}"'.format(etag), 'Cache-Control': 'private, no-cache'})
+        if etag_matches(app.current_request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, body='', headers=headers)
+        # The list index is read eventually consistent only, so it may be older than the version of the ETag.
+        # A list with ETag reads the table, or the local taken_date index, strongly consistent in place of it.
+        consistent = etag is not None
+        index = Photo.list_index if attributes and str(conf['PHOTO_LIST_INDEX']) == 'True' and not consistent else None
+        results = query_photos(current_user['user_id'], limit or None, params.get('cursor'), attributes, index,
+                               order, since, until, consistent)
+        batches = (with_presigned_urls(current_user, batch, attributes)
+                   for batch in batched(results, int(conf['PHOTO_LIST_STREAM_BATCH'])))
+        # Encoded batch by batch, the dicts of the whole list are never in memory at once.
+        body = ''.join(iter_json_object({'ok': True}, 'photos', batches,
+                                        lambda: {'next_cursor': next_page_cursor(results)},
+                                        partial(dumps, fast=str(conf['PHOTO_LIST_ORJSON']) == 'True')))
+        return Response(status_code=200, body=body, headers=headers)
     except Exception as e:
         raise ChaliceViewError(e)
 
 
-@app.route('/photos/file', methods=['POST'], cors=cors_config,
-           authorizer=jwt_auth, content_types=['multipart/form-data'])
+@app.route('/photos/file', methods=['POST'], cors=cors_config, authorizer=jwt_auth,
+           content_types=['multipart/form-data'] + IMAGE_CONTENT_TYPES)
 def upload():
     """
-    File upload with multipart/form data.
+    File upload with raw image body, photo information is in the X-Photo-Info header.
+    Multipart/form data with base64 encoded image is still accepted.
     :return:
     """
-    form = get_parts(app)
-    filename_orig = form['filename_orig'][0].decode('utf-8')
-    extension = (filename_orig.rsplit('.', 1)[1]).lower()
-    base64_image = form['base64_image'][0].decode('utf-8').replace('data:image/jpeg;base64,', '')
-    imgdata = base64.b64decode(base64_image)
+    content_type = app.current_request.headers['content-type'].split(';')[0].strip().lower()
+    if content_type in IMAGE_CONTENT_TYPES:
+        try:
+            form = get_photo_info(app)
+            extension = check_photo_info(form)
+        except (KeyError, ValueError) as e:
+            raise BadRequestError('Invalid X-Photo-Info header: {0}'.format(e))
+        imgdata = app.current_request.raw_body
+    else:
+        try:
+            form = get_parts(app)
+            extension = check_photo_info(form)
+            base64_image = form['base64_image'][0].decode('utf-8').replace('data:image/jpeg;base64,', '')
+            imgdata = base64.b64decode(base64_image)
+        except (KeyError, ValueError) as e:
+            # binascii.Error of a broken base64 image is a ValueError too.
+            raise BadRequestError('Invalid photo information: {0}'.format(e))
 
     try:
         current_user = cognito.user_info(cognito.get_token(app.current_request))
-        filename = "{0}.{1}".format(uuid.uuid4(), extension)
+        filename = "{0}.{1}".format(new_photo_id(), extension)
         filesize = save_s3_chalice(imgdata, filename, current_user['email'], app.log)
         new_photo = create_photo_info(current_user['user_id'], filename, filesize, form)
         new_photo.save()
+        bump_photo_list_version(current_user['user_id'])
         return Response(status_code=200, body={'ok': True},
                         headers={'Content-Type': 'application/json'})
     except Exception as e:
@@ -98,6 +157,7 @@ def delete(photo_id):
         photo = Photo.get(current_user['user_id'], photo_id)
         file_deleted = delete_s3(app.log, photo.filename, current_user)
         photo.delete()
+        bump_photo_list_version(current_user['user_id'])
         body = data = {'ok': True, 'photo_id': photo_id}
         return Response(status_code=200, body=body,
                         headers={'Content-Type': 'application/json'})
@@ -114,7 +174,7 @@ def signin():
     """
     req_data = app.current_request.json_body
     auth = cognito.generate_auth(req_data)
-    client = boto3.client('cognito-idp')
+    client = aws_client.cognito()
     try:
         body = cognito.generate_token(client, auth, req_data)
         return Response(status_code=200, body=body, headers={'Content-Type': 'application/json'})
@@ -133,7 +193,7 @@ def signup():
     """
     req_data = app.current_request.json_body
     dig = cognito.generate_digest(req_data)
-    client = boto3.client('cognito-idp')
+    client = aws_client.cognito()
     try:
         cognito.signup(client, req_data, dig)
         return Response(status_code=201, body={'ok': True},
@@ -157,7 +217,7 @@ def signout():
     :return:
     """
     access_token = cognito.get_token(app.current_request)
-    client = boto3.client('cognito-idp')
+    client = aws_client.cognito()
     response = client.global_sign_out(
         AccessToken=access_token
     )
@@ -0,0 +1,95 @@
+"""
+    cloudalbum/chalicelib/aws_client.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Process-wide registry of AWS service clients.
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import threading
+import boto3
+from botocore.config import Config
+from chalicelib.config import conf
+
+DEFAULT_READ_TIMEOUT = 60
+
+# Clients are thread-safe, so one client per service is shared by every invocation of a warm container,
+# and keeps its connection pool warm. Sessions are not, so clients are created under the lock.
+_clients = {}
+_credentials = None
+_lock = threading.Lock()
+
+
+def parse_timeouts(value):
+    """
+    Parse comma separated 'service:seconds' string, e.g. 's3:60,cognito-idp:10'.
+    :param value: string
+    :return: dict, service name to seconds
+    """
+    timeouts = {}
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        service, seconds = item.rsplit(':', 1)
+        timeouts[service.strip()] = int(seconds)
+    return timeouts
+
+
+def client_config(service_name):
+    """
+    Return botocore Config of the service client.
+    :param service_name: e.g. 's3'
+    :return: botocore.config.Config
+    """
+    options = dict(max_pool_connections=int(conf['AWS_MAX_POOL_CONNECTIONS']),
+                   connect_timeout=int(conf['AWS_CONNECT_TIMEOUT']),
+                   read_timeout=parse_timeouts(conf['AWS_READ_TIMEOUTS']).get(service_name, DEFAULT_READ_TIMEOUT))
+    if service_name == 's3':
+        # botocore presigns with signature version 2 in the regions which still accept it,
+        # the presigned URLs are version 4 everywhere as the local presigner signs them.
+        options['signature_version'] = 's3v4'
+    return Config(**options)
+
+
+def get_client(service_name):
+    """
+    Return the client of the service, which is created at the first call.
+    :param service_name: e.g. 's3'
+    :return: boto3 client
+    """
+    client = _clients.get(service_name)
+    if client is None:
+        with _lock:
+            client = _clients.get(service_name)
+            if client is None:
+                client = boto3.session.Session().client(service_name, config=client_config(service_name))
+                _clients[service_name] = client
+    return client
+
+
+def credentials():
+    """
+    Return credentials of the default provider chain, which the clients sign with.
+    Temporary credentials of the Lambda execution role are refreshed before they expire.
+    :return: botocore ReadOnlyCredentials, access_key, secret_key and token
+    """
+    global _credentials
+    if _credentials is None:
+        with _lock:
+            if _credentials is None:
+                _credentials = boto3.session.Session().get_credentials()
+    return _credentials.get_frozen_credentials()
+
+
+def s3():
+    return get_client('s3')
+
+
+def dynamodb():
+    return get_client('dynamodb')
+
+
+def cognito():
+    return get_client('cognito-idp')
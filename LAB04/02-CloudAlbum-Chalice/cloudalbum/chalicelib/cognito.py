@@ -12,10 +12,10 @@ import hashlib
 import hmac
 import json
 import time
-import boto3
 import requests
 from jose import jwk, jwt
 from chalicelib.config import conf
+from chalicelib import aws_client
 from chalice import UnauthorizedError
 from jose.utils import base64url_decode
 
@@ -172,7 +172,7 @@ def user_info(access_token):
     :param access_token:
     :return:
     """
-    client = boto3.client('cognito-idp')
+    client = aws_client.cognito()
     try:
         cognito_user = client.get_user(AccessToken=access_token)
         user_info = {}
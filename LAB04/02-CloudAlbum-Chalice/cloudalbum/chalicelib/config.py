@@ -26,6 +26,47 @@ def get_param_path(param_path):
 # store configuration values for Cloudalbum
 conf = get_param_path('/cloudalbum/')
 
+# Photo list returns pages of 'limit' photos when it is given, PHOTO_LIST_DEFAULT_LIMIT otherwise,
+# 0 returns the whole list at once.
+conf.setdefault('PHOTO_LIST_DEFAULT_LIMIT', 0)
+conf.setdefault('PHOTO_LIST_MAX_LIMIT', 1000)
+# Photo list without ETag reads the 'photo-list-index' of the Photo table, which has the list attributes only.
+# It is turned off at startup when the Photo table has not the index, the list reads the table then.
+conf.setdefault('PHOTO_LIST_INDEX', 'True')
+# Photo list in the taken_date order reads the 'photo-taken-date-index' of the Photo table. DynamoDB makes a local
+# secondary index only with a new table, it is turned off at startup for a table created before it, which answers
+# 400 then.
+conf.setdefault('PHOTO_TAKEN_DATE_INDEX', 'True')
+# Photo list body is encoded batch by batch of PHOTO_LIST_STREAM_BATCH photos while it is read, so only a batch
+# of photos is in memory besides the body. API Gateway takes the whole body, it is not streamed to the client.
+conf.setdefault('PHOTO_LIST_STREAM_BATCH', 100)
+# Photo list answers ETag of the list version of the user, the same If-None-Match gets 304 after reading
+# the version only. No ETag when S3_PRESIGNED_URL_WINDOW is 0, the URLs differ on every request then.
+# A list with ETag reads the table strongly consistent in place of the list index, which is read
+# eventually consistent only and may be older than the version, see PHOTO_LIST_INDEX.
+conf.setdefault('PHOTO_LIST_ETAG', 'True')
+# Photo list is encoded by orjson when it is installed, otherwise by json of the standard library.
+conf.setdefault('PHOTO_LIST_ORJSON', 'True')
+# Renditions made from each upload, comma separated 'name:WIDTHxHEIGHT' (e.g. 'retina:600x400').
+# A rendition is stored under the prefix named after it, 'thumbnails' is the photo grid thumbnail.
+conf.setdefault('THUMBNAIL_RENDITIONS', 'thumbnails:{0}x{1}'.format(conf.get('THUMBNAIL_WIDTH', 300),
+                                                                    conf.get('THUMBNAIL_HEIGHT', 200)))
+# Threads putting the original and its renditions to S3 concurrently.
+conf.setdefault('S3_UPLOAD_WORKERS', 8)
+# Photo list URLs are signed once per window of S3_PRESIGNED_URL_WINDOW seconds and expire at the end
+# of the next window, so the same URL is given within a warm container and the browser caches the image.
+# 0 signs a new URL on every request, valid for S3_PRESIGNED_EXP.
+conf.setdefault('S3_PRESIGNED_URL_WINDOW', 1800)
+conf.setdefault('S3_PRESIGNED_URL_CACHE_SIZE', 10000)
+# URLs of a photo list are signed in the container at once, the same as botocore does one by one.
+conf.setdefault('S3_LOCAL_PRESIGNER', 'True')
+
+# AWS clients, one per service is shared by the container. Keep the pool larger than S3_UPLOAD_WORKERS.
+conf.setdefault('AWS_MAX_POOL_CONNECTIONS', 20)
+conf.setdefault('AWS_CONNECT_TIMEOUT', 5)
+# Read timeout of each service, comma separated 'service:seconds'.
+conf.setdefault('AWS_READ_TIMEOUTS', 's3:60,dynamodb:10,cognito-idp:10')
+
 
 def get_param(param_name):
     """
@@ -8,12 +8,59 @@
     :license: MIT, see LICENSE for more details.
 """
 import json
-from datetime import datetime
+import time
+import base64
+import secrets
+import hashlib
+from datetime import datetime, timedelta, timezone
 from tzlocal import get_localzone
 from pynamodb.models import Model
 from chalicelib.config import conf
-from chalicelib.util import presigned_url_both
+from chalicelib.util import presigned_url_both, photo_url_keys, cached_presigned_urls
+from chalicelib.presign import window_start
+from chalicelib.serializer import FieldPlan
 from pynamodb.attributes import UnicodeAttribute, NumberAttribute, UTCDateTimeAttribute
+from pynamodb.indexes import GlobalSecondaryIndex, LocalSecondaryIndex, IncludeProjection
+
+
+# Attributes of a photo which the photo list answers, the rest are read only for the full view.
+# The list indexes project them, so every backend of the Photo table has the same ones.
+PHOTO_LIST_ATTRIBUTES = ['user_id', 'id', 'filename', 'formats', 'upload_date', 'tags', 'desc',
+                         'geotag_lat', 'geotag_lng', 'address']
+# Orders of the photo list, newest first. upload_date is the order of the photo ids, see new_photo_id().
+PHOTO_LIST_ORDERS = ['upload_date', 'taken_date']
+# Key attributes of the last photo of a page in each order except user_id, which the cursor is made of.
+PHOTO_LIST_KEYS = {'upload_date': ['id'], 'taken_date': ['id', 'taken_date']}
+
+
+class PhotoListIndex(GlobalSecondaryIndex):
+    """
+    Photos of a user with PHOTO_LIST_ATTRIBUTES only. Query consumes read capacity for the whole items read,
+    which a projection expression does not change, so the photo list reads this narrower copy of the table.
+    """
+
+    class Meta:
+        index_name = 'photo-list-index'
+        read_capacity_units = conf['DDB_RCU']
+        write_capacity_units = conf['DDB_WCU']
+        projection = IncludeProjection([name for name in PHOTO_LIST_ATTRIBUTES if name not in ('user_id', 'id')])
+
+    user_id = UnicodeAttribute(hash_key=True)
+    id = UnicodeAttribute(range_key=True)
+
+
+class PhotoTakenDateIndex(LocalSecondaryIndex):
+    """
+    Photos of a user in the order of taken_date with PHOTO_LIST_ATTRIBUTES, a photo without taken_date is not in it.
+    DynamoDB makes a local secondary index only with a new table.
+    """
+
+    class Meta:
+        index_name = 'photo-taken-date-index'
+        projection = IncludeProjection([name for name in PHOTO_LIST_ATTRIBUTES if name not in ('user_id', 'id')])
+
+    user_id = UnicodeAttribute(hash_key=True)
+    taken_date = UTCDateTimeAttribute(range_key=True)
 
 
 class Photo(Model):
@@ -27,6 +74,8 @@ class Photo(Model):
 
     user_id = UnicodeAttribute(hash_key=True)
     id = UnicodeAttribute(range_key=True)
+    list_index = PhotoListIndex()
+    taken_date_index = PhotoTakenDateIndex()
     tags = UnicodeAttribute(null=True)
     desc = UnicodeAttribute(null=True)
     filename_orig = UnicodeAttribute(null=True)
@@ -43,6 +92,44 @@ class Photo(Model):
     city = UnicodeAttribute(null=True)
     nation = UnicodeAttribute(null=True)
     address = UnicodeAttribute(null=True)
+    # Extra formats of the renditions, comma separated
+    formats = UnicodeAttribute(null=True)
+
+
+class PhotoListVersion(Model):
+    """
+    Version of the photo list of a user, bumped on every change of the photos of the user.
+    A client which has the list of the current version gets it again without a query, see photo_list_etag().
+    """
+
+    class Meta:
+        table_name = 'PhotoListVersion'
+        region = conf['AWS_REGION']
+
+    user_id = UnicodeAttribute(hash_key=True)
+    version = NumberAttribute(default=0)
+
+
+# Fields of the photo information of an upload which create_photo_info() reads.
+PHOTO_INFO_FIELDS = ['filename_orig', 'tags', 'desc', 'geotag_lat', 'geotag_lng', 'taken_date', 'make', 'model',
+                     'width', 'height', 'city', 'nation', 'address']
+
+
+def check_photo_info(form):
+    """
+    Check the photo information of an upload before the image is stored.
+    :param form: dict of get_parts() or get_photo_info(), field name to list of bytes
+    :return: extension of the original file name, lower case
+    :raise ValueError: when a field is missing, the file name has no extension or taken_date is broken
+    """
+    missing = [name for name in PHOTO_INFO_FIELDS if not form.get(name)]
+    if missing:
+        raise ValueError('missing {0}'.format(', '.join(missing)))
+    filename_orig = form['filename_orig'][0].decode('utf-8')
+    if '.' not in filename_orig:
+        raise ValueError('file name has no extension:{0}'.format(filename_orig))
+    datetime.strptime(form['taken_date'][0].decode('utf-8'), "%Y:%m:%d %H:%M:%S")
+    return filename_orig.rsplit('.', 1)[1].lower()
 
 
 def create_photo_info(user_id, filename, filesize, form):
@@ -80,34 +167,315 @@ if not Photo.exists():
     Photo.create_table(read_capacity_units=conf['DDB_RCU'], write_capacity_units=conf['DDB_WCU'], wait=True)
     print('DynamoDB Photo table created!')
 
+if not PhotoListVersion.exists():
+    PhotoListVersion.create_table(read_capacity_units=conf['DDB_RCU'], write_capacity_units=conf['DDB_WCU'],
+                                  wait=True)
+    print('DynamoDB PhotoListVersion table created!')
+
+
+def check_photo_indexes():
+    """
+    Turn PHOTO_LIST_INDEX and PHOTO_TAKEN_DATE_INDEX off when the Photo table has not the index (yet),
+    e.g. a table created before it, so the photo list falls back to the table.
+    :return: None
+    """
+    table = Photo.describe_table()
+    # A global secondary index added to a table is not queried until it is ACTIVE, a local one has no status.
+    indexes = [index['IndexName'] for index in table.get('GlobalSecondaryIndexes', [])
+               + table.get('LocalSecondaryIndexes', []) if index.get('IndexStatus', 'ACTIVE') == 'ACTIVE']
+    for key, index in [('PHOTO_LIST_INDEX', Photo.list_index), ('PHOTO_TAKEN_DATE_INDEX', Photo.taken_date_index)]:
+        if str(conf[key]) == 'True' and index.Meta.index_name not in indexes:
+            print('Photo table has no active {0}, {1} is turned off'.format(index.Meta.index_name, key))
+            conf[key] = 'False'
+
+
+check_photo_indexes()
+
+
+# Crockford's base32, which sorts in the same order as the numbers it encodes.
+CROCKFORD_BASE32 = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_base32(number, length):
+    """
+    Return the number in Crockford's base32 of the length, padded with '0'.
+    :param number: int, less than 32 ** length
+    :param length: number of characters
+    :return: string
+    """
+    chars = []
+    for _ in range(length):
+        number, digit = divmod(number, 32)
+        chars.append(CROCKFORD_BASE32[digit])
+    return ''.join(reversed(chars))
+
+
+def photo_id_bound(date, upper=False):
+    """
+    Return the lower bound of the ids of the photos made in the millisecond of the date, see new_photo_id().
+    :param date: datetime, a naive one is UTC as UTCDateTimeAttribute stores it
+    :param upper: the upper bound is returned instead
+    :return: string
+    """
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    prefix = encode_base32((date - EPOCH) // timedelta(milliseconds=1), 10)
+    # '~' sorts after every character of an id, the base32 characters and the '.' of a file name.
+    return prefix + '~' if upper else prefix
+
+
+def new_photo_id(date=None):
+    """
+    Return id of a new photo, a ULID: 10 characters of the milliseconds since the epoch and 16 random ones,
+    in Crockford's base32. Ids of the photos of a user sort in the order of the time they are made, so the range
+    key of Photo orders the photo list by upload date, see query_photos().
+    :param date: time of the id, now when it is None
+    :return: string of 26 characters
+    """
+    return photo_id_bound(date or datetime.now(timezone.utc)) + encode_base32(secrets.randbits(80), 16)
+
+
+def is_photo_id(photo_id):
+    """
+    Return True when the photo id is made by new_photo_id(), possibly followed by the extension of the file.
+    Photos stored before have uuid ids, see 'manage.py backfill_photo_ids'.
+    :param photo_id: string
+    :return: bool
+    """
+    return len(photo_id) >= 26 and all(c in CROCKFORD_BASE32 for c in photo_id[:26]) and \
+        photo_id[26:27] in ('', '.')
+
+
+# Formats of since and until of the photo list, each with the start of the period after a date of it.
+LIST_DATE_FORMATS = [
+    ('%Y-%m-%dT%H:%M:%S', lambda date: date + timedelta(seconds=1)),
+    ('%Y-%m-%d', lambda date: date + timedelta(days=1)),
+    ('%Y-%m', lambda date: date.replace(year=date.year + date.month // 12, month=date.month % 12 + 1)),
+    ('%Y', lambda date: date.replace(year=date.year + 1)),
+]
+
+
+def parse_list_date(value, until=False):
+    """
+    Return the date of since or until of the photo list, UTC as the dates of Photo are stored.
+    :param value: e.g. '2019', '2019-07', '2019-07-15' or '2019-07-15T09:46:46'
+    :param until: the value is until, which is the end of its period, e.g. the last moment of 2019 for '2019'
+    :return: datetime
+    :raise ValueError: when the value is not of LIST_DATE_FORMATS
+    """
+    for date_format, next_start in LIST_DATE_FORMATS:
+        try:
+            date = datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+        if until:
+            date = next_start(date) - timedelta(microseconds=1)
+        return date.replace(tzinfo=timezone.utc)
+    raise ValueError('Invalid date:{0}'.format(value))
+
+
+def parse_list_dates(since=None, until=None):
+    """
+    Return since and until of the photo list, see parse_list_date().
+    :param since: string, None for no lower bound
+    :param until: string, None for no upper bound
+    :return: (since, until), datetime or None each
+    :raise ValueError: when a date is broken or since is after until
+    """
+    since = parse_list_date(since) if since else None
+    until = parse_list_date(until, True) if until else None
+    if since is not None and until is not None and since > until:
+        raise ValueError('since is after until')
+    return since, until
+
+
+def range_key_condition(order, since=None, until=None):
+    """
+    Return key condition of the photos of the order between since and until.
+    The upload_date order is the order of the photo ids, see new_photo_id().
+    :param order: one of PHOTO_LIST_ORDERS
+    :param since: datetime, None for no lower bound
+    :param until: datetime, None for no upper bound
+    :return: condition, None for every photo
+    """
+    if order == 'taken_date':
+        key, low, high = Photo.taken_date, since, until
+    else:
+        key = Photo.id
+        low = photo_id_bound(since) if since else None
+        high = photo_id_bound(until, upper=True) if until else None
+    if low is not None and high is not None:
+        return key.between(low, high)
+    if low is not None:
+        return key >= low
+    if high is not None:
+        return key <= high
+    return None
+
+
+def encode_cursor(key):
+    """
+    Return opaque cursor of a page of photos, which starts after the photo of the key.
+    :param key: dict of the names of the key attributes except user_id, to their values
+    :return: string
+    """
+    return base64.urlsafe_b64encode(json.dumps(key, sort_keys=True).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, order=PHOTO_LIST_ORDERS[0]):
+    """
+    Return key of the photo which the page of the cursor starts after, see encode_cursor().
+    :param cursor: string
+    :param order: one of PHOTO_LIST_ORDERS
+    :return: dict of the names of the key attributes to their values
+    :raise ValueError: when the cursor is broken or of another order
+    """
+    key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+    if not isinstance(key, dict) or sorted(key) != PHOTO_LIST_KEYS[order] or \
+            not all(isinstance(value, str) and value for value in key.values()):
+        raise ValueError('Cursor of another order')
+    return key
+
+
+def query_photos(user_id, limit=None, cursor=None, attributes=None, index=None, order=PHOTO_LIST_ORDERS[0],
+                 since=None, until=None, consistent_read=False):
+    """
+    Query a page of the photos of the user newest first in the order, read lazily page by page of DynamoDB.
+    The order and the dates are the key condition of the query, so only the photos of the page are read.
+    :param user_id: user id
+    :param limit: max number of photos, every photo when it is None
+    :param cursor: next cursor of the previous page, from the first photo when it is None
+    :param attributes: names of the attributes read, every attribute when it is None
+    :param index: index which has the attributes, e.g. Photo.list_index, the table when it is None.
+                  The taken_date order reads Photo.taken_date_index, which has no photo without taken_date.
+    :param order: one of PHOTO_LIST_ORDERS
+    :param since: the earliest date of the order, see parse_list_dates(), None for no lower bound
+    :param until: the latest date of the order, None for no upper bound
+    :param consistent_read: strongly consistent read, which Photo.list_index has not, a global secondary index
+    :return: iterator of Photo, see next_page_cursor()
+    :raise ValueError: when the cursor is broken or of another order
+    """
+    last_evaluated_key = None
+    if cursor:
+        last_evaluated_key = {name: {'S': value} for name, value in decode_cursor(cursor, order).items()}
+        last_evaluated_key['user_id'] = {'S': user_id}
+    if order == 'taken_date':
+        index = Photo.taken_date_index
+        # An attribute out of the projection is read from the table when it is asked for by name.
+        attributes = attributes or list(Photo.get_attributes())
+    query = Photo.query if index is None else index.query
+    return query(user_id, range_key_condition(order, since, until), scan_index_forward=False, limit=limit,
+                 last_evaluated_key=last_evaluated_key, attributes_to_get=attributes, consistent_read=consistent_read)
+
+
+def next_page_cursor(results):
+    """
+    Return cursor of the page after the photos which query_photos() returned, once they are all read.
+    :param results: iterator of query_photos()
+    :return: cursor, None on the last page
+    """
+    # Key of the last photo read when the limit is reached, None when the query is over.
+    next_key = results.last_evaluated_key
+    if not next_key:
+        return None
+    return encode_cursor({name: value['S'] for name, value in next_key.items() if name != 'user_id'})
+
+
+def query_photo_page(user_id, limit=None, cursor=None, attributes=None, index=None, order=PHOTO_LIST_ORDERS[0],
+                     since=None, until=None, consistent_read=False):
+    """
+    Query a page of the photos of the user newest first in the order, see query_photos().
+    :return: (list of Photo, cursor of the next page, None on the last page)
+    :raise ValueError: when the cursor is broken or of another order
+    """
+    results = query_photos(user_id, limit, cursor, attributes, index, order, since, until, consistent_read)
+    photos = list(results)
+    return photos, next_page_cursor(results)
+
+
+def get_photo_list_version(user_id):
+    """
+    Return version of the photo list of the user, a strongly consistent read of a single item.
+    :param user_id: user id
+    :return: int, 0 when the photos of the user never changed
+    """
+    try:
+        return int(PhotoListVersion.get(user_id, consistent_read=True, attributes_to_get=['version']).version)
+    except PhotoListVersion.DoesNotExist:
+        return 0
+
+
+def bump_photo_list_version(user_id):
+    """
+    Increase version of the photo list of the user by one, call it after the photos of the user are changed.
+    :param user_id: user id
+    :return: new version
+    """
+    item = PhotoListVersion(user_id)
+    item.update(actions=[PhotoListVersion.version.add(1)])
+    return int(item.version)
+
+
+def photo_list_etag(user_id, limit, cursor, view, order=PHOTO_LIST_ORDERS[0], since=None, until=None):
+    """
+    Return ETag of a photo list response, made of the list version of the user, the request and the window
+    of S3_PRESIGNED_URL_WINDOW which the URLs of the list are signed in, see cached_presigned_urls().
+    The version is read before the query, so a change during the query is seen by the next request.
+    :param user_id: user id
+    :param limit: max number of photos, None for the whole list
+    :param cursor: next cursor of the previous page
+    :param view: list or full
+    :param order: one of PHOTO_LIST_ORDERS
+    :param since: since of the request as it is given
+    :param until: until of the request as it is given
+    :return: string, None when PHOTO_LIST_ETAG is off or the URLs are signed on every request
+    """
+    window = int(conf['S3_PRESIGNED_URL_WINDOW'])
+    if str(conf['PHOTO_LIST_ETAG']) != 'True' or window <= 0:
+        return None
+    version = get_photo_list_version(user_id)
+    request_key = json.dumps([user_id, limit, cursor, view, order, since, until, window_start(time.time(), window)])
+    return '{0}-{1}'.format(version, hashlib.sha1(request_key.encode('utf-8')).hexdigest()[:16])
+
+
+# Fields of Photo with presigned URLs, datetimes are formatted as ModelEncoder does.
+PRESIGNED_PHOTO_JSON_PLAN = FieldPlan(['address', 'city', 'desc', 'filename', 'filename_orig', 'filesize',
+                                       'geotag_lat', 'geotag_lng', 'height', 'id', 'make', 'model', 'nation', 'tags',
+                                       'taken_date', 'upload_date', 'user_id', 'width'],
+                                      {'geotag_lat': float, 'geotag_lng': float, 'taken_date': datetime.isoformat,
+                                       'upload_date': datetime.isoformat}, values='attribute_values')
+
+
+def with_presigned_urls(current_user, photos, attributes=None):
+    """
+    Return the photos with additional attributes for presigned URL access, the URLs of all photos are signed at once.
+    :param current_user:
+    :param photos: iterable of Photo
+    :param attributes: names of the photo attributes returned, every attribute when it is None
+    :return: list of dict
+    """
+    photos = list(photos)
+    keys = []
+    for photo in photos:
+        keys.extend(photo_url_keys(photo.filename, current_user['email']))
+    urls = cached_presigned_urls(keys)
+    photos_json = PRESIGNED_PHOTO_JSON_PLAN.only(attributes).many(photos)
+    for i, photo_json in enumerate(photos_json):
+        photo_json['thumbSrc'], photo_json['originalSrc'] = urls[2 * i:2 * i + 2]
+    return photos_json
+
 
-def with_presigned_url(current_user, photo):
+def with_presigned_url(current_user, photo, urls=None):
     """
     Append additional attributes for presigned URL access.
     :param current_user:
     :param photo:
+    :param urls: (thumbnail URL, original URL) signed beforehand, see with_presigned_urls()
     :return:
     """
-    thumbSrc, originalSrc = presigned_url_both(photo.filename, current_user['email'])
-    temp = {}
-    temp['address'] = photo.address
-    temp['city'] = photo.city
-    temp['desc'] = photo.desc
-    temp['filename'] = photo.filename
-    temp['filename_orig'] = photo.filename_orig
-    temp['filesize'] = photo.filesize
-    temp['geotag_lat'] = float(photo.geotag_lat)
-    temp['geotag_lng'] = float(photo.geotag_lng)
-    temp['height'] = photo.height
-    temp['id'] = photo.id
-    temp['make'] = photo.make
-    temp['model'] = photo.model
-    temp['nation'] = photo.nation
-    temp['tags'] = photo.tags
-    temp['taken_date'] = photo.taken_date
-    temp['upload_date'] = photo.upload_date
-    temp['user_id'] = photo.user_id
-    temp['width'] = photo.width
-    temp['thumbSrc'] = thumbSrc
-    temp['originalSrc'] = originalSrc
-    return temp
+    if urls is None:
+        urls = presigned_url_both(photo.filename, current_user['email'])
+    photo_json = PRESIGNED_PHOTO_JSON_PLAN.one(photo)
+    photo_json['thumbSrc'], photo_json['originalSrc'] = urls
+    return photo_json
@@ -0,0 +1,66 @@
+"""
+    cloudalbum/chalicelib/rendition.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Generate resized renditions (grid thumbnail, retina, lightbox ...) of an uploaded image.
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+from io import BytesIO
+from PIL import Image
+
+# Shrink with integer box reduction while the image is larger than REDUCING_GAP times of the target,
+# then finish with ANTIALIAS resampling.
+REDUCING_GAP = 2.0
+
+
+def parse_renditions(spec):
+    """
+    Parse rendition list from configuration value.
+    :param spec: comma separated 'name:WIDTHxHEIGHT', e.g. 'thumbnails:300x200,retina:600x400'
+    :return: list of (name, (width, height)), largest first
+    """
+    renditions = []
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        name, size = item.strip().split(':')
+        width, height = size.lower().split('x')
+        renditions.append((name.strip(), (int(width), int(height))))
+    return sorted(renditions, key=lambda r: r[1][0] * r[1][1], reverse=True)
+
+
+def make_renditions(file_p, renditions, format='JPEG'):
+    """
+    Decode the original image once and generate every rendition from it.
+    JPEG decoder scales down by DCT while decoding (draft mode) to the smallest scale which still
+    covers the largest rendition, so the full resolution bitmap is never allocated.
+    Each smaller rendition is reduced from the smallest one already made which is big enough.
+    :param file_p: path or file object of original image
+    :param renditions: list of (name, (width, height)), see parse_renditions()
+    :param format: image format of renditions
+    :return: dict, rendition name to image bytes
+    """
+    im = Image.open(file_p)
+    im.draft('RGB', (max(size[0] for _, size in renditions), max(size[1] for _, size in renditions)))
+    im = im.convert('RGB')
+
+    sources = [im]
+    result = {}
+    for name, size in sorted(renditions, key=lambda r: r[1][0] * r[1][1], reverse=True):
+        source = im
+        for candidate in reversed(sources):
+            if candidate.width >= size[0] * REDUCING_GAP and candidate.height >= size[1] * REDUCING_GAP:
+                source = candidate
+                break
+
+        rendition = source.copy()
+        rendition.thumbnail(size, Image.ANTIALIAS, reducing_gap=REDUCING_GAP)
+        sources.append(rendition)
+
+        result_bytes_stream = BytesIO()
+        rendition.save(result_bytes_stream, format)
+        result[name] = result_bytes_stream.getvalue()
+
+    return result
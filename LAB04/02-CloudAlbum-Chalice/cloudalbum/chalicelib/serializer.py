@@ -0,0 +1,118 @@
+"""
+    cloudalbum/chalicelib/serializer.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Photo responses serialized by a field plan which is made once, and encoded by orjson when it is installed.
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FieldPlan:
+    """
+    Fields of the dict of an object, the function which builds the dict is made once from them.
+    Values of a field which are not of a JSON type, e.g. datetime, are converted a column at a time over a list
+    of objects by the converter of the field, so the encoder never calls JSONEncoder.default().
+    """
+
+    def __init__(self, names, converters=None, values=None):
+        """
+        :param names: attribute names of the object, which are the keys of the dict in the same order
+        :param converters: dict of field name to function which converts a value that is not None
+        :param values: name of the dict attribute of the object which holds the values, e.g. 'attribute_values'
+                       of pynamodb Model, the attributes are read one by one when it is None
+        """
+        for name in list(names) + ([values] if values else []):
+            if not name.isidentifier():
+                raise ValueError('Invalid field name:{0}'.format(name))
+        self.names = tuple(names)
+        self.converters = [(name, convert) for name, convert in (converters or {}).items() if name in self.names]
+        self.values = values
+        self.row = make_row(self.names, values)
+        self.subsets = {}
+
+    def only(self, attributes):
+        """
+        Return the plan of the fields among the attributes.
+        :param attributes: field names, every field when it is None
+        :return: FieldPlan
+        """
+        if attributes is None:
+            return self
+        key = frozenset(attributes)
+        plan = self.subsets.get(key)
+        if plan is None:
+            plan = FieldPlan([name for name in self.names if name in key], dict(self.converters), self.values)
+            self.subsets[key] = plan
+        return plan
+
+    def many(self, objects):
+        """
+        Return the dicts of the objects.
+        :param objects: iterable of objects
+        :return: list of dict
+        """
+        return self.convert(list(map(self.row, objects)))
+
+    def many_tuples(self, tuples):
+        """
+        Return the dicts of the tuples of the values of the fields in order, e.g. rows of a SQL query of the
+        columns of the fields, which are read without an object of each row.
+        :param tuples: iterable of tuples
+        :return: list of dict
+        """
+        names = self.names
+        return self.convert([dict(zip(names, values)) for values in tuples])
+
+    def convert(self, rows):
+        for name, convert in self.converters:
+            for row in rows:
+                value = row[name]
+                if value is not None:
+                    row[name] = convert(value)
+        return rows
+
+    def one(self, obj):
+        """
+        Return the dict of the object.
+        :param obj: object
+        :return: dict
+        """
+        return self.many([obj])[0]
+
+
+def make_row(names, values=None):
+    """
+    Return function which builds the dict of the fields of an object.
+    :param names: attribute names
+    :param values: name of the dict attribute which holds the values, see FieldPlan
+    :return: function
+    """
+    names = tuple(names)
+    if values is None:
+        def row(obj):
+            return {name: getattr(obj, name) for name in names}
+    else:
+        def row(obj):
+            get = getattr(obj, values).get
+            return {name: get(name) for name in names}
+    return row
+
+
+def dumps(obj, fast=True):
+    """
+    Return JSON text of the object made of JSON types only, e.g. dicts of FieldPlan.
+    :param obj: object
+    :param fast: encoded by orjson when it is installed
+    :return: string
+    """
+    if fast and orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj)
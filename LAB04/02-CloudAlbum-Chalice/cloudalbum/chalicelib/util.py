@@ -8,17 +8,25 @@
     :license: MIT, see LICENSE for more details.
 """
 
-import os
 import cgi
-import boto3
+import json
+import time
+import resource
 import pprint
-from PIL import Image
 from io import BytesIO
+from urllib.parse import unquote
+from concurrent.futures import ThreadPoolExecutor, wait
 from chalicelib.config import conf
+from chalicelib import aws_client
+from chalicelib.rendition import parse_renditions, make_renditions
+from chalicelib.presign import get_presigned_url_cache, get_sigv4_presigner, cache_control
 from chalice import ChaliceViewError
 
 pp = pprint.PrettyPrinter(indent=2)
 
+# S3 I/O executor, kept across invocations of a warm Lambda container.
+io_executor = ThreadPoolExecutor(max_workers=int(conf['S3_UPLOAD_WORKERS']))
+
 
 def get_parts(app):
     """
@@ -34,6 +42,18 @@ def get_parts(app):
     return parsed
 
 
+def get_photo_info(app):
+    """
+    Parse photo information of raw image upload, URL-encoded JSON object in the X-Photo-Info header.
+    :param app:
+    :return: dict in the same form as get_parts(), field name to list of bytes
+    """
+    info = json.loads(unquote(app.current_request.headers['x-photo-info']))
+    if not isinstance(info, dict):
+        raise ValueError('photo information must be a JSON object')
+    return {key: [str(value).encode('utf-8')] for key, value in info.items()}
+
+
 def get_password_reset_url():
     """
     User password reset page provided by cognito.
@@ -57,27 +77,21 @@ def email_normalize(email):
     return email.replace('@', '_at_').replace('.', '_dot_')
 
 
-def make_thumbnails(path, filename, logger):
+def make_thumbnails(image, logger):
     """
-    Generate thumbnail from original image file.
-    :param path: target path
-    :param filename: secure file name
-    :param app: Falsk.application
-    :return: None
+    Generate thumbnail and the other renditions from original image bytes, decoding it only once.
+    :param image: bytes of original image, BytesIO shares it without a copy
+    :param logger: Chalice.log
+    :return: dict, rendition name to JPEG bytes
     """
-    thumb_full_path = '/tmp/thumbnail.jpg'
-
-    im = Image.open(os.path.join(path, filename))
-    logger.debug(os.path.join(path, filename))
-    im = im.convert('RGB')
-    im.thumbnail((int(conf['THUMBNAIL_WIDTH']), int(conf['THUMBNAIL_HEIGHT']), Image.ANTIALIAS))
-    im.save(thumb_full_path)
-    return thumb_full_path
+    logger.debug('make renditions: {0} bytes'.format(len(image)))
+    return make_renditions(BytesIO(image), parse_renditions(conf['THUMBNAIL_RENDITIONS']))
 
 
 def save_s3_chalice(bytes, filename, email, logger):
     """
     File save from multipart-form data.
+    Original and renditions are uploaded straight from memory, nothing is written to /tmp.
     :param bytes:
     :param filename:
     :param email:
@@ -85,30 +99,63 @@ def save_s3_chalice(bytes, filename, email, logger):
     :return:
     """
     prefix = "photos/{0}/".format(email_normalize(email))
-    prefix_thumb = "photos/{0}/thumbnails/".format(email_normalize(email))
     key = "{0}{1}".format(prefix, filename)
-    key_thumb = "{0}{1}".format(prefix_thumb, filename)
     logger.debug('key: {0}'.format(key))
-    logger.debug('key_thumb: {0}'.format(key_thumb))
-    s3_client = boto3.client('s3')
+    s3_client = aws_client.s3()
+    started = time.time()
     try:
-        temp_file = '/tmp/' + filename
-        with open(temp_file, 'wb') as f:
-            f.write(bytes)
-            statinfo = os.stat(temp_file)
-            logger.debug(statinfo)
-            s3_client.upload_file(temp_file, conf['S3_PHOTO_BUCKET'], key)
-            thumb_path = make_thumbnails('/tmp', filename, logger)
-            logger.debug('thumb_path for upload: {0}'.format(thumb_path))
-            logger.debug('prefix_thumb: {0}'.format(prefix_thumb))
-            logger.debug(os.stat(temp_file))
-            s3_client.upload_file(thumb_path, conf['S3_PHOTO_BUCKET'], key_thumb)
+        futures = {io_executor.submit(s3_client.put_object, Bucket=conf['S3_PHOTO_BUCKET'], Key=key,
+                                      Body=bytes, ContentType='image/jpeg'): key}
+
+        # Make thumbnail files while the original is uploading
+        try:
+            renditions = make_thumbnails(bytes, logger)
+        except Exception as e:
+            # Roll back the original PUT, the error is raised here whatever wait_s3_puts() does.
+            wait_s3_puts(s3_client, futures, logger, error=e)
+            raise e
+        for name, image_bytes in renditions.items():
+            key_thumb = "{0}{1}/{2}".format(prefix, name, filename)
+            logger.debug('key_thumb for upload: {0}'.format(key_thumb))
+            futures[io_executor.submit(s3_client.put_object, Bucket=conf['S3_PHOTO_BUCKET'], Key=key_thumb,
+                                       Body=image_bytes, ContentType='image/jpeg')] = key_thumb
+        wait_s3_puts(s3_client, futures, logger)
     except Exception as e:
         logger.error('Error occurred while saving file:%s', e)
         raise ChaliceViewError('Error occurred while saving file.')
+    # Compare with the REPORT line of the invocation to size the function memory.
+    logger.debug('upload saved: {0} bytes, {1:.1f} ms, max RSS {2:.1f} MB'.format(
+        len(bytes), (time.time() - started) * 1000, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
     return len(bytes)
 
 
+def wait_s3_puts(s3_client, futures, logger, error=None):
+    """
+    Wait for concurrent PUTs. When any of them failed, or error is given, the objects which were
+    put successfully are deleted and the error is raised.
+    :param s3_client:
+    :param futures: dict, future to S3 key
+    :param logger:
+    :param error: exception raised by the caller while the PUTs were in flight
+    :return:
+    """
+    wait(futures)
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if error is not None:
+        errors.insert(0, error)
+    if not errors:
+        return
+
+    for future, key in futures.items():
+        if future.exception() is None:
+            try:
+                s3_client.delete_object(Bucket=conf['S3_PHOTO_BUCKET'], Key=key)
+                logger.debug('rollback: deleted object: {0}'.format(key))
+            except Exception as e:
+                logger.error('Error occurred while rollback of %s:%s', key, e)
+    raise errors[0]
+
+
 def delete_s3(logger, filename, current_user):
     """
     Delete both original and thumbnail image file in the S3.
@@ -118,20 +165,34 @@ def delete_s3(logger, filename, current_user):
     :return:
     """
     prefix = "photos/{0}/".format(email_normalize(current_user['email']))
-    prefix_thumb = "photos/{0}/thumbnails/".format(email_normalize(current_user['email']))
-    key = "{0}{1}".format(prefix, filename)
-    key_thumb = "{0}{1}".format(prefix_thumb, filename)
-    logger.debug('Attempting delete object: {0}'.format(key))
-    logger.debug('Attempting delete object: {0}'.format(key_thumb))
+    keys = ["{0}{1}".format(prefix, filename)]
+    keys += ["{0}{1}/{2}".format(prefix, name, filename) for name, _ in parse_renditions(conf['THUMBNAIL_RENDITIONS'])]
     try:
-        s3_client = boto3.client('s3')
-        s3_client.delete_object(Bucket=conf['S3_PHOTO_BUCKET'], Key=key)
-        s3_client.delete_object(Bucket=conf['S3_PHOTO_BUCKET'], Key=key_thumb)
+        s3_client = aws_client.s3()
+        for key in keys:
+            logger.debug('Attempting delete object: {0}'.format(key))
+            s3_client.delete_object(Bucket=conf['S3_PHOTO_BUCKET'], Key=key)
     except Exception as e:
         logger.error('Error occurred while deleting file:%s', e)
         raise ChaliceViewError('Error occurred while deleting file.')
 
 
+def etag_matches(if_none_match, etag):
+    """
+    Return True when the If-None-Match header has the ETag, compared weakly as RFC 7232 does for GET.
+    :param if_none_match: If-None-Match header, e.g. '"a", W/"b"' or '*'
+    :param etag: ETag without quotes
+    :return: bool
+    """
+    if not if_none_match or not etag:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or (tag[2:] if tag.startswith('W/') else tag) == '"{0}"'.format(etag):
+            return True
+    return False
+
+
 def presigned_url_both(filename, email):
     """
     Return presigned urls both original image url and thumbnail image url
@@ -139,22 +200,57 @@ def presigned_url_both(filename, email):
     :param email:
     :return:
     """
+    try:
+        thumb_url, origin_url = cached_presigned_urls(photo_url_keys(filename, email))
+    except Exception as e:
+        raise ChaliceViewError(e)
+    return thumb_url, origin_url
+
+
+def photo_url_keys(filename, email):
+    """
+    Return S3 keys of the thumbnail and the original of the photo.
+    :param filename:
+    :param email:
+    :return: (thumbnail key, original key)
+    """
     prefix = "photos/{0}/".format(email_normalize(email))
     prefix_thumb = "photos/{0}/thumbnails/".format(email_normalize(email))
     key_thumb = "{0}{1}".format(prefix_thumb, filename)
     key_origin = "{0}{1}".format(prefix, filename)
-    try:
-        s3_client = boto3.client('s3')
-        thumb_url = s3_client.generate_presigned_url(
+    return key_thumb, key_origin
+
+
+def cached_presigned_urls(keys):
+    """
+    Return presigned GET URLs of the keys, the same URLs within a window of S3_PRESIGNED_URL_WINDOW seconds,
+    so the browser gets a cache hit on the images of the photo list. 0 signs new URLs on every call.
+    The URLs missing in the cache are signed at once by the local SigV4 presigner unless S3_LOCAL_PRESIGNER is off,
+    dated at the start of the window, so every container gives the same URLs in the window.
+    :param keys: list of S3 object keys
+    :return: list of URLs
+    """
+    bucket = conf['S3_PHOTO_BUCKET']
+    window = int(conf['S3_PRESIGNED_URL_WINDOW'])
+    s3_client = aws_client.s3()
+    if window <= 0:
+        return [s3_client.generate_presigned_url(
             'get_object',
-            Params={'Bucket': conf['S3_PHOTO_BUCKET'], 'Key': key_thumb},
-            ExpiresIn=conf['S3_PRESIGNED_EXP'])
-        origin_url = s3_client.generate_presigned_url(
+            Params={'Bucket': bucket, 'Key': key},
+            ExpiresIn=conf['S3_PRESIGNED_EXP']) for key in keys]
+
+    def sign(cache_keys, start, expires):
+        local = str(conf['S3_LOCAL_PRESIGNER']) == 'True'
+        presigner = get_sigv4_presigner(s3_client, bucket) if local else None
+        if presigner is not None:
+            return presigner.presign(aws_client.credentials(), [key for _, key in cache_keys], start,
+                                     expires - start, {'response-cache-control': cache_control(window)})
+        return [s3_client.generate_presigned_url(
             'get_object',
-            Params={'Bucket': conf['S3_PHOTO_BUCKET'], 'Key': key_origin},
-            ExpiresIn=conf['S3_PRESIGNED_EXP'])
-    except Exception as e:
-        raise ChaliceViewError(e)
-    return thumb_url, origin_url
+            Params={'Bucket': bucket, 'Key': key, 'ResponseCacheControl': cache_control(window)},
+            ExpiresIn=int(expires - time.time())) for _, key in cache_keys]
+
+    cache = get_presigned_url_cache(window, int(conf['S3_PRESIGNED_URL_CACHE_SIZE']))
+    return cache.get_many([(bucket, key) for key in keys], sign)
 
 
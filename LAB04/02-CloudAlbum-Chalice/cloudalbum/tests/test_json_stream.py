@@ -0,0 +1,43 @@
+"""
+    cloudalbum/tests/test_json_stream.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Test cases for JSON response written piece by piece
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import json
+import unittest
+from chalicelib.json_stream import batched, iter_json_object
+
+
+class TestJsonStream(unittest.TestCase):
+    """Tests for the JSON stream."""
+
+    def test_batched(self):
+        """Ensure the items are split into lists of the size."""
+        self.assertEqual(list(batched(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(batched([], 2)), [])
+
+    def test_iter_json_object(self):
+        """Ensure the pieces make the same JSON as the whole object, and the tail is read after the batches."""
+        read = []
+
+        def batches():
+            for batch in [[{'id': 1}], [], [{'id': 2}, {'id': 3}]]:
+                read.append(batch)
+                yield batch
+
+        def tail():
+            self.assertEqual(len(read), 3)
+            return {'next_cursor': None}
+
+        text = ''.join(iter_json_object({'ok': True}, 'photos', batches(), tail))
+        self.assertEqual(json.loads(text), {'ok': True, 'photos': [{'id': 1}, {'id': 2}, {'id': 3}],
+                                            'next_cursor': None})
+        self.assertEqual(json.loads(''.join(iter_json_object({}, 'photos', []))), {'photos': []})
+
+
+if __name__ == '__main__':
+    unittest.main()
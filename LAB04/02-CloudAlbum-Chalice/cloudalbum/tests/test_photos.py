@@ -11,13 +11,16 @@ import boto3
 import pytest
 import unittest
 import base64
+import json
+from urllib.parse import quote
 from app import app
 from chalice.config import Config
 from chalice.local import LocalGateway
 from tests.base import BaseTestCase, user as existed_user
 from tests.multipart import MultipartFormdataEncoder
 from chalicelib import cognito
-from chalicelib.model_ddb import Photo
+from chalicelib.config import conf
+from chalicelib.model_ddb import Photo, is_photo_id
 
 upload = dict(
     tags='ITA, Venezia, SONY , DSLR-A300, 2048 x 1371',
@@ -80,6 +83,151 @@ class TestPhotoService(BaseTestCase):
             body=None)
         self.assertEqual(response['statusCode'], 200)
 
+    def test_list_pages(self):
+        """Ensure the /photos/?limit=&cursor= returns the whole list page by page."""
+        headers = {'Content-Type': 'application/json', 'Authorization': 'Bearer {0}'.format(self.access_token)}
+        for _ in range(3):
+            response = self.gateway.handle_request(
+                method='POST',
+                path='/photos/file',
+                headers={'Content-Type': self.multipart_content_type,
+                         'Authorization': 'Bearer {0}'.format(self.access_token)},
+                body=self.multipart_body)
+            self.assertEqual(response['statusCode'], 200)
+        response = self.gateway.handle_request(method='GET', path='/photos/', headers=headers, body=None)
+        self.assertEqual(response['statusCode'], 200)
+        photo_ids = [photo['id'] for photo in json.loads(response['body'])['photos']]
+
+        paged_ids = []
+        path = '/photos/?limit=2'
+        while True:
+            response = self.gateway.handle_request(method='GET', path=path, headers=headers, body=None)
+            self.assertEqual(response['statusCode'], 200)
+            body = json.loads(response['body'])
+            self.assertLessEqual(len(body['photos']), 2)
+            paged_ids.extend(photo['id'] for photo in body['photos'])
+            if not body['next_cursor']:
+                break
+            path = '/photos/?limit=2&cursor={0}'.format(body['next_cursor'])
+        self.assertEqual(paged_ids, photo_ids)
+
+        for path in ['/photos/?limit=-1', '/photos/?limit=100000', '/photos/?limit=2&cursor=%25%25']:
+            response = self.gateway.handle_request(method='GET', path=path, headers=headers, body=None)
+            self.assertEqual(response['statusCode'], 400)
+
+    def test_list_order(self):
+        """Ensure the /photos/?order=&since=&until= returns the photos newest first in the order, within the dates."""
+        headers = {'Content-Type': 'application/json', 'Authorization': 'Bearer {0}'.format(self.access_token)}
+        for _ in range(3):
+            response = self.gateway.handle_request(
+                method='POST',
+                path='/photos/file',
+                headers={'Content-Type': self.multipart_content_type,
+                         'Authorization': 'Bearer {0}'.format(self.access_token)},
+                body=self.multipart_body)
+            self.assertEqual(response['statusCode'], 200)
+        response = self.gateway.handle_request(method='GET', path='/photos/', headers=headers, body=None)
+        self.assertEqual(response['statusCode'], 200)
+        photo_ids = [photo['id'] for photo in json.loads(response['body'])['photos']]
+        self.assertEqual(photo_ids, sorted(photo_ids, reverse=True))
+        self.assertTrue(all(is_photo_id(photo_id) for photo_id in photo_ids))
+
+        for query, expected in [('since=2000', photo_ids), ('since=2999', []),
+                                ('order=taken_date&since=2012-07&until=2012-07', photo_ids),
+                                ('order=taken_date&until=2012-07-14', [])]:
+            response = self.gateway.handle_request(method='GET', path='/photos/?{0}'.format(query),
+                                                   headers=headers, body=None)
+            self.assertEqual(response['statusCode'], 200)
+            self.assertEqual(sorted(photo['id'] for photo in json.loads(response['body'])['photos']), sorted(expected))
+
+        paged_ids = []
+        path = '/photos/?order=taken_date&limit=2'
+        while True:
+            response = self.gateway.handle_request(method='GET', path=path, headers=headers, body=None)
+            self.assertEqual(response['statusCode'], 200)
+            body = json.loads(response['body'])
+            paged_ids.extend(photo['id'] for photo in body['photos'])
+            if not body['next_cursor']:
+                break
+            path = '/photos/?order=taken_date&limit=2&cursor={0}'.format(body['next_cursor'])
+        self.assertEqual(sorted(paged_ids), sorted(photo_ids))
+
+        response = self.gateway.handle_request(method='GET', path='/photos/?limit=1', headers=headers, body=None)
+        cursor = json.loads(response['body'])['next_cursor']
+        for query in ['since=x', 'since=2020&until=2019', 'order=name',
+                      'order=taken_date&limit=1&cursor={0}'.format(cursor)]:
+            response = self.gateway.handle_request(method='GET', path='/photos/?{0}'.format(query),
+                                                   headers=headers, body=None)
+            self.assertEqual(response['statusCode'], 400)
+        conf['PHOTO_TAKEN_DATE_INDEX'] = 'False'
+        try:
+            response = self.gateway.handle_request(method='GET', path='/photos/?order=taken_date',
+                                                   headers=headers, body=None)
+            self.assertEqual(response['statusCode'], 400)
+        finally:
+            conf['PHOTO_TAKEN_DATE_INDEX'] = 'True'
+
+    def test_list_view(self):
+        """Ensure the /photos/ returns the list attributes only unless view=full is given."""
+        headers = {'Content-Type': 'application/json', 'Authorization': 'Bearer {0}'.format(self.access_token)}
+        response = self.gateway.handle_request(
+            method='POST',
+            path='/photos/file',
+            headers={'Content-Type': self.multipart_content_type,
+                     'Authorization': 'Bearer {0}'.format(self.access_token)},
+            body=self.multipart_body)
+        self.assertEqual(response['statusCode'], 200)
+
+        # Reads the table, the list index is updated asynchronously.
+        conf['PHOTO_LIST_INDEX'] = 'False'
+        try:
+            views = {}
+            for view in ['list', 'full']:
+                response = self.gateway.handle_request(method='GET', path='/photos/?view={0}'.format(view),
+                                                       headers=headers, body=None)
+                self.assertEqual(response['statusCode'], 200)
+                views[view] = json.loads(response['body'])['photos'][0]
+        finally:
+            conf['PHOTO_LIST_INDEX'] = 'True'
+        self.assertIn('thumbSrc', views['list'])
+        self.assertNotIn('make', views['list'])
+        self.assertIn('make', views['full'])
+
+        response = self.gateway.handle_request(method='GET', path='/photos/?view=grid', headers=headers, body=None)
+        self.assertEqual(response['statusCode'], 400)
+
+    def test_list_etag(self):
+        """Ensure the default /photos/ returns 304 for the ETag of the list until a photo is uploaded."""
+        headers = {'Content-Type': 'application/json', 'Authorization': 'Bearer {0}'.format(self.access_token)}
+        response = self.gateway.handle_request(method='GET', path='/photos/', headers=headers, body=None)
+        self.assertEqual(response['statusCode'], 200)
+        etag = response['headers']['ETag']
+        headers['If-None-Match'] = etag
+        response = self.gateway.handle_request(method='GET', path='/photos/', headers=headers, body=None)
+        self.assertEqual(response['statusCode'], 304)
+        response = self.gateway.handle_request(method='GET', path='/photos/?view=full', headers=headers, body=None)
+        self.assertEqual(response['statusCode'], 200)
+
+        response = self.gateway.handle_request(
+            method='POST',
+            path='/photos/file',
+            headers={'Content-Type': self.multipart_content_type,
+                     'Authorization': 'Bearer {0}'.format(self.access_token)},
+            body=self.multipart_body)
+        self.assertEqual(response['statusCode'], 200)
+        response = self.gateway.handle_request(method='GET', path='/photos/', headers=headers, body=None)
+        self.assertEqual(response['statusCode'], 200)
+        self.assertNotEqual(response['headers']['ETag'], etag)
+
+        # Without ETag the list reads the list index.
+        conf['PHOTO_LIST_ETAG'] = 'False'
+        try:
+            response = self.gateway.handle_request(method='GET', path='/photos/', headers=headers, body=None)
+            self.assertEqual(response['statusCode'], 200)
+            self.assertNotIn('ETag', response['headers'])
+        finally:
+            conf['PHOTO_LIST_ETAG'] = 'True'
+
     def test_upload(self):
         """Ensure the /photos/file behaves correctly."""
         response = self.gateway.handle_request(
@@ -90,6 +238,36 @@ class TestPhotoService(BaseTestCase):
             body=self.multipart_body)
         self.assertEqual(response['statusCode'], 200)
 
+    def test_upload_binary(self):
+        """Ensure the /photos/file accepts raw image body with photo information in the header."""
+        with open('test_image.jpg', 'rb') as file:
+            image = file.read()
+        info = {key: value for key, value in upload.items() if key != 'base64_image'}
+        response = self.gateway.handle_request(
+            method='POST',
+            path='/photos/file',
+            headers={'Content-Type': 'image/jpeg',
+                     'X-Photo-Info': quote(json.dumps(info)),
+                     'Authorization': 'Bearer {0}'.format(self.access_token)},
+            body=image)
+        self.assertEqual(response['statusCode'], 200)
+
+    def test_upload_invalid_info(self):
+        """Ensure the /photos/file returns 400 for photo information without a field or an extension."""
+        with open('test_image.jpg', 'rb') as file:
+            image = file.read()
+        info = {key: value for key, value in upload.items() if key != 'base64_image'}
+        for broken in [{key: value for key, value in info.items() if key != 'taken_date'},
+                       dict(info, filename_orig='test_image'), dict(info, taken_date='0000:00:00 00:00:00')]:
+            response = self.gateway.handle_request(
+                method='POST',
+                path='/photos/file',
+                headers={'Content-Type': 'image/jpeg',
+                         'X-Photo-Info': quote(json.dumps(broken)),
+                         'Authorization': 'Bearer {0}'.format(self.access_token)},
+                body=image)
+            self.assertEqual(response['statusCode'], 400)
+
     def test_delete(self):
         """Ensure the /photos/<photo_id> route behaves correctly."""
         # 1. upload
@@ -0,0 +1,68 @@
+"""
+    cloudalbum/tests/test_serializer.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Test cases for the field plan of photo responses
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import json
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+from chalicelib.serializer import FieldPlan, dumps
+
+
+class TestFieldPlan(unittest.TestCase):
+    """Tests for the field plan."""
+
+    def test_many(self):
+        """Ensure the dicts have the fields in order and the converted values, None is left as it is."""
+        plan = FieldPlan(['id', 'taken_date', 'geotag_lat'], {'taken_date': str, 'geotag_lat': float})
+        photos = [SimpleNamespace(id=1, taken_date=datetime(2012, 7, 15, 9, 46, 46), geotag_lat='45.5', desc='x'),
+                  SimpleNamespace(id=2, taken_date=None, geotag_lat=None, desc='y')]
+        rows = plan.many(photos)
+        self.assertEqual(rows, [{'id': 1, 'taken_date': '2012-07-15 09:46:46', 'geotag_lat': 45.5},
+                                {'id': 2, 'taken_date': None, 'geotag_lat': None}])
+        self.assertEqual(list(rows[0]), ['id', 'taken_date', 'geotag_lat'])
+        self.assertEqual(plan.one(photos[0]), rows[0])
+        self.assertEqual(plan.many([]), [])
+
+    def test_only(self):
+        """Ensure the subset plan has the fields among the attributes and keeps their converters."""
+        plan = FieldPlan(['id', 'taken_date', 'desc'], {'taken_date': str})
+        photo = SimpleNamespace(id=1, taken_date=datetime(2012, 7, 15), desc='x')
+        self.assertEqual(plan.only(['taken_date', 'id', 'unknown']).one(photo),
+                         {'id': 1, 'taken_date': '2012-07-15 00:00:00'})
+        self.assertIs(plan.only(['id']), plan.only({'id'}))
+        self.assertIs(plan.only(None), plan)
+
+    def test_many_tuples(self):
+        """Ensure the dicts of the tuples equal the dicts of the objects of the same values."""
+        plan = FieldPlan(['id', 'taken_date'], {'taken_date': str})
+        tuples = [(1, datetime(2012, 7, 15)), (2, None)]
+        self.assertEqual(plan.many_tuples(tuples), plan.many([SimpleNamespace(id=1, taken_date=datetime(2012, 7, 15)),
+                                                             SimpleNamespace(id=2, taken_date=None)]))
+        self.assertEqual(plan.many_tuples([]), [])
+
+    def test_values(self):
+        """Ensure the values are read from the dict attribute, a missing value is None."""
+        plan = FieldPlan(['id', 'desc'], values='attribute_values')
+        photo = SimpleNamespace(attribute_values={'id': 'a'})
+        self.assertEqual(plan.one(photo), {'id': 'a', 'desc': None})
+
+    def test_invalid_name(self):
+        """Ensure a name which is not an identifier is refused."""
+        self.assertRaises(ValueError, FieldPlan, ['id', 'desc): pass'])
+        self.assertRaises(ValueError, FieldPlan, ['id'], values='__dict__.get(1)')
+
+    def test_dumps(self):
+        """Ensure both encoders give the same JSON."""
+        data = {'ok': True, 'photos': [{'id': 1, 'tags': 'Venezia, ITA', 'geotag_lat': 45.5, 'desc': None}]}
+        self.assertEqual(json.loads(dumps(data)), data)
+        self.assertEqual(json.loads(dumps(data, fast=False)), data)
+
+
+if __name__ == '__main__':
+    unittest.main()